@@ -1,5 +1,6 @@
 import os
 import asyncio
+import collections
 import aiohttp
 from aiohttp import web
 from aiohttp_session import setup as setup_session, get_session
@@ -7,15 +8,23 @@ from aiohttp_session.cookie_storage import EncryptedCookieStorage
 import bcrypt
 import json
 from cryptography import fernet
+import hmac
 import html
+import re
+from datetime import datetime
 
 # Local imports
 import database as db
+import loop_watchdog
+import metrics
+import spans
+import user_resolver
 
 # These will be populated by main.py
 BOT_INSTANCE = None
 LOG_CACHE = None
-active_websockets = set()
+LOOP_WATCHDOG = None  # loop_watchdog.LoopWatchdog
+active_websockets = set()  # of LogClient
 
 # --- Password Hashing (No changes) ---
 def hash_password(plain_text_password: str) -> bytes:
@@ -24,28 +33,201 @@ def hash_password(plain_text_password: str) -> bytes:
 def check_password(plain_text_password: str, hashed_password: bytes) -> bool:
     return bcrypt.checkpw(plain_text_password.encode('utf-8'), hashed_password)
 
-# --- Authentication Middleware (No changes) ---
+# --- Authentication Middleware ---
+def _metrics_token_ok(request: web.Request) -> bool:
+    """Scrapers can't log in, so /metrics also accepts `Authorization: Bearer <METRICS_TOKEN>`."""
+    token = os.getenv('METRICS_TOKEN')
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode())
+
 @web.middleware
 async def auth_middleware(request, handler):
+    if request.path == '/metrics' and _metrics_token_ok(request):
+        return await handler(request)
     session = await get_session(request)
-    # Allow access to static files, the login page, and the websocket without being logged in
-    if request.path.startswith(('/static', '/login', '/ws/logs')):
+    # Allow access to static files and the login page without being logged in
+    if request.path.startswith(('/static', '/login')):
         return await handler(request)
     
     if not session.get('authed'):
+        # The log websocket carries stall stacks and user activity; a socket can't follow a redirect.
+        if request.path.startswith('/ws/'):
+            return web.HTTPUnauthorized()
         return web.HTTPFound('/login')
         
     return await handler(request)
 
-# --- WebSocket Log Broadcaster (No changes) ---
-async def broadcast_log(html_log_entry: str):
-    if not active_websockets:
-        return
-    
-    message = json.dumps({'type': 'log', 'payload': html_log_entry})
-    # Create a task to send messages to all clients
-    tasks = [ws.send_str(message) for ws in active_websockets]
-    await asyncio.gather(*tasks, return_exceptions=True)
+# --- WebSocket Log Broadcaster ---
+# Every dashboard socket gets its own bounded queue and writer task, so publishing never
+# awaits the network. A client that falls behind loses its oldest messages; one whose
+# send stalls for SEND_TIMEOUT is disconnected (the page reconnects by itself).
+CLIENT_QUEUE_SIZE = 200
+# Messages arriving within this window are sent together as one 'batch' frame.
+BATCH_WINDOW = 0.05
+MAX_BATCH_SIZE = 50
+SEND_TIMEOUT = 5.0
+
+class LogClient:
+    def __init__(self, ws: web.WebSocketResponse):
+        self.ws = ws
+        self.queue = collections.deque(maxlen=CLIENT_QUEUE_SIZE)
+        self.dropped = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def push(self, message: dict):
+        if self.closed:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(message)
+        self._wakeup.set()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._task.cancel()
+        if not self.ws.closed:
+            asyncio.create_task(self.ws.close())
+
+    async def _run(self):
+        try:
+            while not self.ws.closed:
+                await self._wakeup.wait()
+                await asyncio.sleep(BATCH_WINDOW)
+                self._wakeup.clear()
+                while self.queue:
+                    batch = [self.queue.popleft() for _ in range(min(MAX_BATCH_SIZE, len(self.queue)))]
+                    frame = batch[0] if len(batch) == 1 else {'type': 'batch', 'payload': batch}
+                    await asyncio.wait_for(self.ws.send_str(json.dumps(frame)), SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Timed out or the socket died: stop writing and let the handler clean up.
+            print(f"WARNING: Disconnecting dashboard client ({self.dropped} messages dropped). {e!r}")
+            self.closed = True
+            if not self.ws.closed:
+                await self.ws.close()
+
+def publish(message: dict):
+    """Queues a message for every connected dashboard. Never blocks."""
+    for client in active_websockets:
+        client.push(message)
+
+def broadcast_log(html_log_entry: str):
+    publish({'type': 'log', 'payload': html_log_entry})
+
+# --- Templates ---
+TEMPLATE_DIR = './templates'
+# Each template's mtime is re-checked at most this often.
+TEMPLATE_CHECK_INTERVAL = 2.0
+_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+class SafeHTML(str):
+    """Marks a value as already-escaped HTML so templates insert it verbatim."""
+
+class Template:
+    """A template compiled once into literal chunks and `{{ name }}` placeholders."""
+
+    def __init__(self, source: str):
+        # Even indexes hold literal text, odd indexes hold placeholder names.
+        self.segments = _PLACEHOLDER.split(source)
+
+    def render(self, **context) -> str:
+        parts = self.segments[:]
+        for i in range(1, len(parts), 2):
+            value = context[parts[i]]
+            parts[i] = value if isinstance(value, SafeHTML) else html.escape(str(value))
+        return "".join(parts)
+
+def _read_template(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return os.fstat(f.fileno()).st_mtime_ns, f.read()
+
+class TemplateStore:
+    """Compiled page templates, reloaded only when the file on disk changes. File I/O runs off the event loop."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._templates = {}  # name -> (mtime_ns, Template)
+        self._checked_at = {}  # name -> loop time of the last mtime check
+
+    async def load_all(self):
+        names = await asyncio.to_thread(os.listdir, self.directory)
+        for name in names:
+            if name.endswith('.html'):
+                await self._load(name)
+
+    async def _load(self, name: str) -> Template:
+        mtime, source = await asyncio.to_thread(_read_template, os.path.join(self.directory, name))
+        template = Template(source)
+        self._templates[name] = (mtime, template)
+        return template
+
+    async def get(self, name: str) -> Template:
+        now = asyncio.get_running_loop().time()
+        cached = self._templates.get(name)
+        if cached and now - self._checked_at.get(name, 0) < TEMPLATE_CHECK_INTERVAL:
+            return cached[1]
+        self._checked_at[name] = now
+        if cached:
+            stat = await asyncio.to_thread(os.stat, os.path.join(self.directory, name))
+            if stat.st_mtime_ns == cached[0]:
+                return cached[1]
+        return await self._load(name)
+
+    async def render(self, name: str, **context) -> web.Response:
+        template = await self.get(name)
+        return web.Response(text=template.render(**context), content_type='text/html')
+
+TEMPLATES = TemplateStore(TEMPLATE_DIR)
+
+LOG_ENTRY_TEMPLATE = Template("<div class='log-entry'>{{ entry }}</div>")
+SHOP_ITEM_ROW_TEMPLATE = Template("""
+        <tr data-itemid="{{ item_id }}">
+            <td><input type="text" value="{{ name }}" data-field="name"></td>
+            <td><input type="number" value="{{ cost }}" data-field="cost"></td>
+            <td>{{ role_id }} ({{ role_name }})</td>
+            <td><input type="text" value="{{ image_url }}" data-field="image_url"></td>
+            <td>{{ one_time }}</td>
+            <td>
+                <button class="update-item">Update</button>
+                <button class="delete-item">Delete</button>
+            </td>
+        </tr>
+        """)
+STALL_ENTRY_TEMPLATE = Template("""
+            <details class="stall-entry">
+                <summary><span class="timestamp">{{ at }}</span> Blocked for <strong>{{ lag_ms }}ms</strong></summary>
+                <pre>{{ stacks }}</pre>
+            </details>""")
+STATEMENT_ROW_TEMPLATE = Template("""
+                <tr>
+                    <td><details><summary><code>{{ sql }}</code></summary><pre>{{ plan }}</pre></details></td>
+                    <td>{{ detail }}</td><td>{{ count }}</td><td>{{ total_ms }}ms</td><td>{{ max_ms }}ms</td>
+                </tr>""")
+SLOW_QUERY_ROW_TEMPLATE = Template("""
+                <tr><td class="timestamp">{{ at }}</td><td>{{ ms }}ms</td><td><code>{{ shape }}</code></td><td><code>{{ sql }}</code></td></tr>""")
+TRACE_ENTRY_TEMPLATE = Template("""
+            <details class="trace-entry{{ status_class }}">
+                <summary><span class="timestamp">{{ at }}</span> <strong>{{ name }}</strong> {{ ms }}ms <span class="timestamp">{{ summary }}</span></summary>
+                <div class="waterfall">{{ rows }}</div>
+            </details>""")
+SPAN_ROW_TEMPLATE = Template("""
+                    <div class="span-row{{ status_class }}" title="{{ details }}">
+                        <div class="span-label" style="padding-left: {{ indent }}em">{{ name }}</div>
+                        <div class="span-track"><div class="span-bar" style="margin-left: {{ left }}%; width: {{ width }}%"></div></div>
+                        <div class="span-duration">{{ ms }}</div>
+                    </div>""")
+EMPTY_ROW_TEMPLATE = Template('<tr><td colspan="{{ columns }}">{{ message }}</td></tr>')
+ROLE_OPTION_TEMPLATE = Template('<option value="{{ role_id }}">{{ role_name }}</option>')
+SLOTS_FORM_ROW_TEMPLATE = Template("""
+            <label for="slots-multiplier-{{ key }}">{{ label }} Multiplier</label>
+            <input type="number" step="1" id="slots-multiplier-{{ key }}" class="slots-multiplier-input" data-key="{{ key }}" value="{{ value }}">
+        """)
 
 # --- Route Handlers (No changes) ---
 async def get_login(request: web.Request):
@@ -68,53 +250,62 @@ async def logout(request: web.Request):
     session.pop('authed', None)
     return web.HTTPFound('/login')
 
+def _format_stall_stacks(stall: dict) -> str:
+    return "\n\n".join(f"{stack['count']}/{stall['samples']} samples:\n  " + "\n  ".join(stack['frames']) for stack in stall['stacks'])
+
 async def get_dashboard(request: web.Request):
-    context = {'logs': reversed(LOG_CACHE)}
-    with open('./templates/dashboard.html', 'r', encoding='utf-8') as f:
-        html_content = f.read()
-    
-    log_html = "".join([f"<div class='log-entry'>{item}</div>" for item in context['logs']])
-    response_html = html_content.replace("{{ log_entries }}", log_html)
-    return web.Response(text=response_html, content_type='text/html')
+    # Log entries are built (and escaped) by main.send_log
+    log_html = SafeHTML("".join(LOG_ENTRY_TEMPLATE.render(entry=SafeHTML(item)) for item in reversed(LOG_CACHE)))
+    # The chart and stall list start from what the watchdog has seen; /ws/logs keeps them live.
+    stalls = LOOP_WATCHDOG.worst_stalls() if LOOP_WATCHDOG else []
+    stall_html = SafeHTML("".join(
+        STALL_ENTRY_TEMPLATE.render(at=stall['at'], lag_ms=stall['lag_ms'], stacks=_format_stall_stacks(stall)) for stall in stalls
+    ))
+    lag_history = json.dumps(list(LOOP_WATCHDOG.history) if LOOP_WATCHDOG else [])
+    return await TEMPLATES.render(
+        'dashboard.html', log_entries=log_html, stall_entries=stall_html, lag_history=lag_history,
+        stall_threshold_ms=int(loop_watchdog.STALL_LOG_THRESHOLD * 1000),
+    )
+
+USERS_PAGE_SIZE = 50
 
 async def get_users(request: web.Request):
-    query = request.query.get('q', '').lower()
-    all_users_data = await db.get_all_users_combined()
-    
-    users_with_names = []
-    for user_data in all_users_data:
-        try:
-            user = BOT_INSTANCE.get_user(user_data['user_id']) or await BOT_INSTANCE.fetch_user(user_data['user_id'])
-            user_display = f"{user.name}#{user.discriminator}"
-        except Exception:
-            user_display = "Unknown User"
-
-        if query and query not in user_display.lower() and query not in str(user_data['user_id']):
-            continue
-
-        users_with_names.append({
-            'id': user_data['user_id'],
-            'name': user_display,
-            'ssc': user_data['ssc_balance'] or 0,
-            'grr': user_data['grr_balance'] or 0,
+    # Rows are fetched page by page from /api/users by the page's script.
+    return await TEMPLATES.render('users.html', query=request.query.get('q', ''))
+
+async def get_users_page(request: web.Request):
+    try:
+        query = request.query.get('q', '')
+        sort = request.query.get('sort', 'ssc')
+        cursor = request.query.get('cursor') or None
+        limit = max(1, min(int(request.query.get('limit', USERS_PAGE_SIZE)), 200))
+        rows, next_cursor = await db.search_users(query, sort, cursor, limit)
+    except ValueError as e:
+        return web.json_response({'status': 'error', 'message': str(e)}, status=400)
+
+    names = await user_resolver.resolve_many(row['user_id'] for row in rows)
+    users = []
+    for row in rows:
+        user = names[row['user_id']]
+        users.append({
+            # IDs are strings so the browser doesn't round 64-bit snowflakes.
+            'id': str(row['user_id']),
+            'name': user.tag if user.found else "Unknown User",
+            'ssc': row['ssc_balance'],
+            'grr': row['grr_balance'],
         })
-    
-    context = {'users': users_with_names, 'query': query}
-    with open('./templates/users.html', 'r', encoding='utf-8') as f:
-        html_content = f.read()
-
-    user_rows = ""
-    for u in context['users']:
-        user_rows += f"""
-        <tr>
-            <td>{u['id']}</td>
-            <td>{u['name']}</td>
-            <td><input type="number" class="coin-input" data-userid="{u['id']}" data-currency="ssc" value="{u['ssc']}"></td>
-            <td><input type="number" class="coin-input" data-userid="{u['id']}" data-currency="grr" value="{u['grr']}"></td>
-        </tr>
-        """
-    response_html = html_content.replace("{{ user_rows }}", user_rows).replace("{{ query }}", context['query'])
-    return web.Response(text=response_html, content_type='text/html')
+    return web.json_response({'status': 'success', 'users': users, 'next_cursor': next_cursor})
+
+async def warm_user_names():
+    """Resolves and persists names for accounts that have none yet, so they become searchable."""
+    last_user_id = 0
+    while True:
+        user_ids = await db.get_user_ids_missing_names(last_user_id, limit=100)
+        if not user_ids:
+            return
+        await user_resolver.resolve_many(user_ids)
+        last_user_id = user_ids[-1]
+        await asyncio.sleep(1)
 
 async def post_update_user(request: web.Request):
     try:
@@ -128,6 +319,19 @@ async def post_update_user(request: web.Request):
         print(f"Error updating user: {e}")
         return web.json_response({'status': 'error', 'message': str(e)}, status=500)
 
+async def post_bulk_update_users(request: web.Request):
+    try:
+        data = await request.json()
+        updates = data['updates']
+        if not isinstance(updates, list):
+            raise ValueError("'updates' must be a list")
+        results = await db.update_user_balances_bulk(updates)
+        status = 'success' if all(r['status'] == 'success' for r in results) else 'partial'
+        return web.json_response({'status': status, 'results': results})
+    except Exception as e:
+        print(f"Error bulk updating users: {e}")
+        return web.json_response({'status': 'error', 'message': str(e)}, status=500)
+
 async def get_shop(request: web.Request):
     guild = BOT_INSTANCE.get_guild(int(os.getenv('MAIN_GUILD_ID', 0)))
     if not guild:
@@ -135,34 +339,19 @@ async def get_shop(request: web.Request):
     
     items = await db.get_all_shop_items(guild.id)
     roles = {str(r.id): r.name for r in guild.roles}
-    context = {'items': items, 'roles': roles, 'guild_id': guild.id}
-
-    with open('./templates/shop.html', 'r', encoding='utf-8') as f:
-        html_content = f.read()
-
-    item_rows = ""
-    for item in context['items']:
-        role_name = context['roles'].get(str(item['role_id']), f"Unknown Role ID: {item['role_id']}")
-        item_rows += f"""
-        <tr data-itemid="{item['item_id']}">
-            <td><input type="text" value="{item['name']}" data-field="name"></td>
-            <td><input type="number" value="{item['cost']}" data-field="cost"></td>
-            <td>{item['role_id']} ({role_name})</td>
-            <td><input type="text" value="{item['image_url'] or ''}" data-field="image_url"></td>
-            <td>{'Yes' if item['is_one_time_buy'] else 'No'}</td>
-            <td>
-                <button class="update-item">Update</button>
-                <button class="delete-item">Delete</button>
-            </td>
-        </tr>
-        """
-    
-    role_options = ""
-    for role_id, role_name in context['roles'].items():
-        role_options += f'<option value="{role_id}">{role_name}</option>'
 
-    response_html = html_content.replace("{{ item_rows }}", item_rows).replace("{{ role_options }}", role_options)
-    return web.Response(text=response_html, content_type='text/html')
+    item_rows = SafeHTML("".join(
+        SHOP_ITEM_ROW_TEMPLATE.render(
+            item_id=item['item_id'], name=item['name'], cost=item['cost'], role_id=item['role_id'],
+            role_name=roles.get(str(item['role_id']), f"Unknown Role ID: {item['role_id']}"),
+            image_url=item['image_url'] or '', one_time='Yes' if item['is_one_time_buy'] else 'No',
+        )
+        for item in items
+    ))
+    role_options = SafeHTML("".join(
+        ROLE_OPTION_TEMPLATE.render(role_id=role_id, role_name=role_name) for role_id, role_name in roles.items()
+    ))
+    return await TEMPLATES.render('shop.html', item_rows=item_rows, role_options=role_options)
 
 async def post_shop_action(request: web.Request):
     try:
@@ -192,83 +381,201 @@ async def get_settings(request: web.Request):
     configs = await db.get_all_configs()
     
     # --- NEW: Build HTML for slot machine settings ---
-    slots_configs = {
-        "2_of_a_kind": ("Small Win (2-of-a-kind)", 2),
-        "cherry": ("Jackpot 🍒", 5), "grape": ("Jackpot 🍇", 5), "orange": ("Jackpot 🍊", 5),
-        "lemon": ("Jackpot 🍋", 8), "bell": ("Jackpot 🔔", 8), "diamond": ("Jackpot 💎", 15),
-        "clover": ("Jackpot 🍀", 25), "moneybag": ("Jackpot 💰", 50)
+    slots_labels = {
+        "2_of_a_kind": "Small Win (2-of-a-kind)",
+        "cherry": "Jackpot 🍒", "grape": "Jackpot 🍇", "orange": "Jackpot 🍊",
+        "lemon": "Jackpot 🍋", "bell": "Jackpot 🔔", "diamond": "Jackpot 💎",
+        "clover": "Jackpot 🍀", "moneybag": "Jackpot 💰"
     }
-    slots_form_rows = ""
-    for key, (label, default) in slots_configs.items():
-        db_key = f'slots_multiplier_{key}'
-        value = configs.get(db_key, str(default))
-        slots_form_rows += f"""
-            <label for="slots-multiplier-{key}">{label} Multiplier</label>
-            <input type="number" step="1" id="slots-multiplier-{key}" class="slots-multiplier-input" data-key="{key}" value="{value}">
-        """
-
-    context = {
-        'cf_win_rate': float(configs.get('cf_win_rate', 0.31)) * 100,
-        'bet_win_rate': float(configs.get('bet_win_rate', 0.29)) * 100,
-        'exchange_enabled_checked': 'checked' if configs.get('exchange_enabled', 'false') == 'true' else '',
-        'exchange_disabled_message': html.escape(configs.get('exchange_disabled_message', 'The exchange is currently disabled.')),
-        'exchange_grr_cost': configs.get('exchange_grr_cost', '5000'),
-        'exchange_ssc_reward': configs.get('exchange_ssc_reward', '100'),
-        'slots_form_rows': slots_form_rows,
-    }
-    with open('./templates/settings.html', 'r', encoding='utf-8') as f:
-        html_content = f.read()
-
-    response_html = (html_content
-        .replace("{{ cf_win_rate }}", f"{context['cf_win_rate']:.2f}")
-        .replace("{{ bet_win_rate }}", f"{context['bet_win_rate']:.2f}")
-        .replace("{{ exchange_enabled_checked }}", context['exchange_enabled_checked'])
-        .replace("{{ exchange_disabled_message }}", context['exchange_disabled_message'])
-        .replace("{{ exchange_grr_cost }}", context['exchange_grr_cost'])
-        .replace("{{ exchange_ssc_reward }}", context['exchange_ssc_reward'])
-        .replace("{{ slots_form_rows }}", context['slots_form_rows'])
+    slots_form_rows = SafeHTML("".join(
+        SLOTS_FORM_ROW_TEMPLATE.render(
+            key=key, label=slots_labels[key], value=configs.get(f'slots_multiplier_{key}', str(default))
+        )
+        for key, default in db.SLOTS_MULTIPLIER_DEFAULTS.items()
+    ))
+
+    return await TEMPLATES.render(
+        'settings.html',
+        cf_win_rate=f"{float(configs.get('cf_win_rate', 0.31)) * 100:.2f}",
+        bet_win_rate=f"{float(configs.get('bet_win_rate', 0.29)) * 100:.2f}",
+        exchange_enabled_checked=SafeHTML('checked' if configs.get('exchange_enabled', 'false') == 'true' else ''),
+        exchange_disabled_message=configs.get('exchange_disabled_message', 'The exchange is currently disabled.'),
+        exchange_grr_cost=configs.get('exchange_grr_cost', '5000'),
+        exchange_ssc_reward=configs.get('exchange_ssc_reward', '100'),
+        slots_form_rows=slots_form_rows,
     )
-    return web.Response(text=response_html, content_type='text/html')
 
 async def post_update_settings(request: web.Request):
     try:
         data = await request.json()
         
         # Standard settings
-        await db.set_config_value('cf_win_rate', str(float(data['cf_win_rate']) / 100.0))
-        await db.set_config_value('bet_win_rate', str(float(data['bet_win_rate']) / 100.0))
-        await db.set_config_value('exchange_enabled', str(data['exchange_enabled']).lower())
-        await db.set_config_value('exchange_disabled_message', data['exchange_disabled_message'])
-        await db.set_config_value('exchange_grr_cost', str(int(data['exchange_grr_cost'])))
-        await db.set_config_value('exchange_ssc_reward', str(int(data['exchange_ssc_reward'])))
+        values = {
+            'cf_win_rate': str(float(data['cf_win_rate']) / 100.0),
+            'bet_win_rate': str(float(data['bet_win_rate']) / 100.0),
+            'exchange_enabled': str(data['exchange_enabled']).lower(),
+            'exchange_disabled_message': data['exchange_disabled_message'],
+            'exchange_grr_cost': str(int(data['exchange_grr_cost'])),
+            'exchange_ssc_reward': str(int(data['exchange_ssc_reward'])),
+        }
 
         # --- NEW: Iterate and save all slot machine settings ---
         for key, value in data.items():
             if key.startswith('slots_multiplier_'):
-                await db.set_config_value(key, str(int(value)))
+                values[key] = str(int(value))
+
+        # Validated up front, then written (and cached) in a single transaction
+        await db.set_config_values(values)
 
         return web.json_response({'status': 'success'})
     except Exception as e:
         return web.json_response({'status': 'error', 'message': str(e)}, status=500)
 
+async def get_metrics(request: web.Request):
+    return web.Response(text=metrics.render(), headers={'Content-Type': f"{metrics.CONTENT_TYPE}; charset=utf-8"})
+
+def _statement_rows(statements, detail) -> SafeHTML:
+    if not statements:
+        return SafeHTML(EMPTY_ROW_TEMPLATE.render(columns=5, message="Nothing recorded."))
+    return SafeHTML("".join(
+        STATEMENT_ROW_TEMPLATE.render(
+            sql=stats.sql, plan="\n".join(stats.plan or []) or stats.plan_error or "No plan.",
+            detail=detail(stats), count=f"{stats.count:,}",
+            total_ms=f"{stats.total * 1000:,.1f}", max_ms=f"{stats.max * 1000:,.2f}",
+        )
+        for stats in statements
+    ))
+
+async def get_queries(request: web.Request):
+    log = db.get_query_log()
+    if log is None:
+        return await TEMPLATES.render(
+            'queries.html', toggle_action='enable', toggle_label='Start Tracing',
+            status="Tracing is off. While it's on every statement is timed and each new statement's query plan is captured, at a small cost per statement.",
+            scan_rows=SafeHTML(""), slow_rows=SafeHTML(""), statement_rows=SafeHTML(""),
+        )
+    statements = log.by_total_time()
+    slowest = log.slowest()
+    slow_rows = SafeHTML("".join(
+        SLOW_QUERY_ROW_TEMPLATE.render(
+            at=datetime.fromtimestamp(entry['at']).strftime('%H:%M:%S'), ms=f"{entry['ms']:,.2f}", shape=entry['shape'], sql=entry['sql'],
+        )
+        for entry in slowest
+    ) or EMPTY_ROW_TEMPLATE.render(columns=4, message="Nothing recorded."))
+    untracked = f" {log.untracked:,} executions of further statements were not tracked." if log.untracked else ""
+    return await TEMPLATES.render(
+        'queries.html', toggle_action='disable', toggle_label='Stop Tracing',
+        status=f"Tracing since {datetime.fromtimestamp(log.started).strftime('%Y-%m-%d %H:%M:%S')}: {len(statements):,} distinct statements.{untracked} Expand a statement to see its query plan.",
+        scan_rows=_statement_rows([stats for stats in statements if stats.full_scans], lambda stats: ", ".join(stats.full_scans)),
+        slow_rows=slow_rows,
+        statement_rows=_statement_rows(statements, lambda stats: f"{stats.total / stats.count * 1000:,.2f}ms" if stats.count else "-"),
+    )
+
+async def post_query_action(request: web.Request):
+    try:
+        data = await request.json()
+        action = data.get('action')
+        if action == 'enable':
+            db.set_query_tracing(True)
+        elif action == 'disable':
+            db.set_query_tracing(False)
+        elif action == 'reset':
+            log = db.get_query_log()
+            if log:
+                log.reset()
+        else:
+            raise ValueError("Invalid action")
+        return web.json_response({'status': 'success'})
+    except Exception as e:
+        return web.json_response({'status': 'error', 'message': str(e)}, status=400)
+
+def _span_rows(trace: dict) -> SafeHTML:
+    total = trace['ms'] or 1.0
+    depths = []
+    rows = []
+    for span in trace['spans']:
+        depth = 0 if span['parent'] is None else depths[span['parent']] + 1
+        depths.append(depth)
+        running = span['ms'] is None
+        # Spans of background tasks may outlive the trace; their bar runs to its end.
+        ms = total - span['start_ms'] if running else span['ms']
+        details = ", ".join(f"{key}={value}" for key, value in span['attributes'].items())
+        if span['error']:
+            details = f"{details}, raised {span['error']}" if details else f"raised {span['error']}"
+        rows.append(SPAN_ROW_TEMPLATE.render(
+            status_class=" error" if span['error'] else " running" if running else "",
+            details=details, indent=depth * 1.2, name=span['name'],
+            left=f"{min(span['start_ms'] / total * 100, 100):.2f}", width=f"{min(ms / total * 100, 100):.2f}",
+            ms="running" if running else f"{span['ms']:,.1f}ms",
+        ))
+    return SafeHTML("".join(rows))
+
+def _trace_failed(trace: dict) -> bool:
+    root = trace['spans'][0] if trace['spans'] else None
+    return bool(root and (root['error'] or root['attributes'].get('outcome') == 'error'))
+
+def _trace_summary(trace: dict) -> str:
+    count = len(trace['spans']) - 1
+    summary = f"{count} span" if count == 1 else f"{count} spans"
+    return f"{summary}, {trace['dropped']} more dropped" if trace['dropped'] else summary
+
+async def get_traces(request: web.Request):
+    log = spans.get_log()
+    if log is None:
+        return await TEMPLATES.render('traces.html', status="Tracing starts once the bot is ready.", trace_entries=SafeHTML(""))
+    traces = log.slowest()
+    entries = SafeHTML("".join(
+        TRACE_ENTRY_TEMPLATE.render(
+            status_class=" error" if _trace_failed(trace) else "",
+            at=datetime.fromtimestamp(trace['at']).strftime('%Y-%m-%d %H:%M:%S'), name=trace['name'], ms=f"{trace['ms']:,.1f}",
+            summary=_trace_summary(trace),
+            rows=_span_rows(trace),
+        )
+        for trace in traces
+    ) or "<p>Nothing recorded yet.</p>")
+    where = f" Each is also written to {log.path}." if log.path else ""
+    return await TEMPLATES.render(
+        'traces.html', trace_entries=entries,
+        status=f"The {len(traces)} slowest of the last {len(log.recent):,} traced commands.{where} Expand one for its waterfall; hover over a span for its details.",
+    )
+
 async def websocket_handler(request):
     ws = web.WebSocketResponse()
     await ws.prepare(request)
-    active_websockets.add(ws)
+    client = LogClient(ws)
+    active_websockets.add(client)
     try:
         async for msg in ws:
             # We don't expect messages from client, but good to have a loop
             pass
     finally:
-        active_websockets.remove(ws)
+        active_websockets.discard(client)
+        client.close()
     return ws
 
 # --- App Setup and Runner ---
-async def start_admin_panel_server(bot_instance, log_cache):
-    global BOT_INSTANCE, LOG_CACHE
+async def start_admin_panel_server(bot_instance, log_cache, loop_watchdog=None):
+    global BOT_INSTANCE, LOG_CACHE, LOOP_WATCHDOG
     BOT_INSTANCE = bot_instance
     LOG_CACHE = log_cache
+    LOOP_WATCHDOG = loop_watchdog
     
+    await TEMPLATES.load_all()
+    app = create_app()
+
+    # Start the server
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '0.0.0.0', 5000)
+    try:
+        await site.start()
+        print(f"INFO: Admin Panel started on http://localhost:5000")
+        asyncio.create_task(warm_user_names())
+    except Exception as e:
+        print(f"ERROR: Could not start Admin Panel server. {e}")
+
+def create_app() -> web.Application:
+    """The panel's routes, sessions and login check, ready to be served."""
     app = web.Application() 
     
     fernet_key = fernet.Fernet.generate_key()
@@ -285,20 +592,17 @@ async def start_admin_panel_server(bot_instance, log_cache):
     
     app.router.add_get('/', get_dashboard)
     app.router.add_get('/users', get_users)
+    app.router.add_get('/api/users', get_users_page)
     app.router.add_post('/api/users/update', post_update_user)
+    app.router.add_post('/api/users/bulk-update', post_bulk_update_users)
     app.router.add_get('/shop', get_shop)
     app.router.add_post('/api/shop', post_shop_action)
     app.router.add_get('/settings', get_settings)
     app.router.add_post('/api/settings/update', post_update_settings)
 
+    app.router.add_get('/queries', get_queries)
+    app.router.add_post('/api/queries', post_query_action)
+    app.router.add_get('/traces', get_traces)
+    app.router.add_get('/metrics', get_metrics)
     app.router.add_get('/ws/logs', websocket_handler)
-
-    # Start the server
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 5000)
-    try:
-        await site.start()
-        print(f"INFO: Admin Panel started on http://localhost:5000")
-    except Exception as e:
-        print(f"ERROR: Could not start Admin Panel server. {e}")
\ No newline at end of file
+    return app
@@ -0,0 +1,55 @@
+import collections
+from typing import Dict, Optional
+
+class BalanceCache:
+    """
+    A bounded LRU map of user_id -> balance for one currency. database.py writes through
+    to it after each committed balance change and fills it on read misses.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._balances: "collections.OrderedDict[int, int]" = collections.OrderedDict()
+        # Bumped by every write so a read that raced one doesn't cache what it saw.
+        self.write_count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._balances)
+
+    def get(self, user_id: int) -> Optional[int]:
+        balance = self._balances.get(user_id)
+        if balance is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._balances.move_to_end(user_id)
+        return balance
+
+    def _store(self, user_id: int, balance: int):
+        self._balances[user_id] = balance
+        self._balances.move_to_end(user_id)
+        while len(self._balances) > self.capacity:
+            self._balances.popitem(last=False)
+
+    def put(self, user_id: int, balance: int):
+        """Records a committed balance change."""
+        self.write_count += 1
+        self._store(user_id, balance)
+
+    def fill(self, user_id: int, balance: int, write_count: int):
+        """Caches a balance read from SQLite, unless a write has landed since `write_count`."""
+        if write_count == self.write_count:
+            self._store(user_id, balance)
+
+    def discard(self, user_id: int):
+        self.write_count += 1
+        self._balances.pop(user_id, None)
+
+    def clear(self):
+        self.write_count += 1
+        self._balances.clear()
+
+    def items(self) -> Dict[int, int]:
+        return dict(self._balances)
@@ -0,0 +1,3 @@
+"""
+Offline load benchmarks for database.py. Run `python -m bench --help` from the repo root.
+"""
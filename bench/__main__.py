@@ -0,0 +1,54 @@
+"""
+Load benchmarks for database.py.
+
+    python -m bench [scenario ...] [--concurrency 1,10,100] [--seconds 3] [--output results.json]
+    python -m bench --compare baseline.json candidate.json [--threshold 0.1]
+    python -m bench --list
+
+Each scenario runs against a scratch database seeded with --users accounts, once per
+concurrency level, and reports throughput and p50/p95/p99 latency.
+"""
+import argparse
+import asyncio
+import sys
+
+from bench import harness
+from bench.scenarios import SCENARIOS, DEFAULT_SCENARIOS
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: {' '.join(DEFAULT_SCENARIOS)}).")
+    parser.add_argument("--list", action="store_true", help="List the scenarios and exit.")
+    parser.add_argument("--concurrency", default="1,10,100", help="Comma-separated concurrent worker counts.")
+    parser.add_argument("--seconds", type=float, default=3.0, help="How long to run each scenario at each concurrency.")
+    parser.add_argument("--users", type=int, default=10_000, help="How many accounts to seed.")
+    parser.add_argument("--backend", choices=("sqlite", "memory"), default="sqlite", help="Storage engine to measure.")
+    parser.add_argument("--ungrouped", action="store_true", help="Commit every write on its own (no group commit).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the workers.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files instead of running.")
+    parser.add_argument("--threshold", type=float, default=harness.DEFAULT_THRESHOLD,
+                        help="Relative change --compare treats as a regression.")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(SCENARIOS))
+        return 0
+    if args.compare:
+        lines, regressions = harness.compare(harness.load(args.compare[0]), harness.load(args.compare[1]), args.threshold)
+        print("\n".join(lines))
+        print(f"{regressions} regression(s) beyond {args.threshold:.0%}.")
+        return 1 if regressions else 0
+
+    concurrencies = [int(value) for value in args.concurrency.split(",")]
+    report = asyncio.run(harness.run(
+        args.scenarios or DEFAULT_SCENARIOS, concurrencies, args.seconds, args.users,
+        backend=args.backend, ungrouped=args.ungrouped, seed=args.seed,
+    ))
+    if args.output:
+        harness.save(report, args.output)
+        print(f"Results written to {args.output}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
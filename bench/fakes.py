@@ -0,0 +1,241 @@
+"""
+Stand-ins for the discord.py objects main.py's handlers touch, so commands can run without a
+gateway. Every method that would hit Discord's REST API records the call (see `counting`)
+and returns at once.
+"""
+import collections
+import contextvars
+import itertools
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import discord
+
+class CallCounts:
+    """
+    REST routes and database.py functions one command caused, with call counts. Calls made
+    after `finish()` (by background work the command started) go to `spill` instead.
+    """
+
+    def __init__(self, spill: Optional["CallCounts"] = None):
+        self.rest: "collections.Counter[str]" = collections.Counter()
+        self.db: "collections.Counter[str]" = collections.Counter()
+        self.spill = spill
+        self.finished = False
+
+    def finish(self):
+        self.finished = True
+
+_current_counts: "contextvars.ContextVar[Optional[CallCounts]]" = contextvars.ContextVar('bench_call_counts', default=None)
+
+@contextmanager
+def counting(counts: CallCounts) -> Iterator[CallCounts]:
+    """Attributes the calls made inside the block (and tasks it starts) to `counts`."""
+    token = _current_counts.set(counts)
+    try:
+        yield counts
+    finally:
+        _current_counts.reset(token)
+
+def _current() -> Optional[CallCounts]:
+    counts = _current_counts.get()
+    while counts is not None and counts.finished:
+        counts = counts.spill
+    return counts
+
+def record_rest(route: str):
+    counts = _current()
+    if counts is not None:
+        counts.rest[route] += 1
+
+def record_db(function: str):
+    counts = _current()
+    if counts is not None:
+        counts.db[function] += 1
+
+_snowflakes = itertools.count(1 << 40)
+
+class FakeAsset:
+    def __init__(self, url: str):
+        self.url = url
+
+class FakeRole:
+    def __init__(self, role_id: int, name: str, position: int):
+        self.id = role_id
+        self.name = name
+        self.position = position
+        self.mention = f"<@&{role_id}>"
+
+class FakeMessage:
+    def __init__(self, author, content: str, channel: "FakeChannel", mentions: Optional[list] = None, guild=None):
+        self.id = next(_snowflakes)
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.mentions = mentions or []
+        self.guild = guild
+
+    async def edit(self, content: Optional[str] = None, **kwargs):
+        record_rest('message.edit')
+        if content is not None:
+            self.content = content
+        return self
+
+    async def delete(self, **kwargs):
+        record_rest('message.delete')
+
+class FakeChannel:
+    def __init__(self, channel_id: int, bot_user=None, guild=None):
+        self.id = channel_id
+        self.bot_user = bot_user
+        self.guild = guild
+
+    async def send(self, content: Optional[str] = None, *, delete_after: Optional[float] = None, **kwargs) -> FakeMessage:
+        record_rest('channel.send')
+        if delete_after is not None:
+            # discord.py deletes the message later with a second request.
+            record_rest('message.delete')
+        return FakeMessage(self.bot_user, content or "", self, guild=self.guild)
+
+class FakeUser:
+    """A user outside any guild, as bot.get_user/fetch_user return them."""
+
+    def __init__(self, user_id: int, name: Optional[str] = None):
+        self.id = user_id
+        self.name = name or f"user{user_id}"
+        self.discriminator = "0"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+        self.display_avatar = FakeAsset(f"https://cdn.example/avatars/{user_id}.png")
+        self.dm_channel: Optional[FakeChannel] = None
+
+    async def create_dm(self) -> FakeChannel:
+        record_rest('user.create_dm')
+        self.dm_channel = FakeChannel(next(_snowflakes))
+        return self.dm_channel
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        channel = self.dm_channel or await self.create_dm()
+        return await channel.send(content, **kwargs)
+
+class FakeMember(discord.Member):
+    """Passes main.py's isinstance(..., discord.Member) checks without a gateway payload."""
+    # Plain class attributes shadow discord.Member's properties and slots, so each
+    # instance can hold its own values.
+    id = name = discriminator = display_name = mention = bot = roles = guild = display_avatar = dm_channel = None
+    guild_permissions = top_role = None
+
+    def __init__(self, user_id: int, guild: "FakeGuild", roles: Optional[List[FakeRole]] = None):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.discriminator = "0"
+        self.display_name = f"Incarnation {user_id}"
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+        self.roles = list(roles or [])
+        self.guild = guild
+        self.display_avatar = FakeAsset(f"https://cdn.example/avatars/{user_id}.png")
+        self.dm_channel = None
+
+    def __hash__(self) -> int:
+        return self.id >> 22
+
+    def __repr__(self) -> str:
+        return f"<FakeMember id={self.id}>"
+
+    async def add_roles(self, *roles: FakeRole, reason: Optional[str] = None, atomic: bool = True):
+        record_rest('member.add_roles')
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def create_dm(self) -> FakeChannel:
+        record_rest('user.create_dm')
+        self.dm_channel = FakeChannel(next(_snowflakes))
+        return self.dm_channel
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        channel = self.dm_channel or await self.create_dm()
+        return await channel.send(content, **kwargs)
+
+class FakePermissions:
+    def __init__(self, manage_roles: bool = True):
+        self.manage_roles = manage_roles
+
+class FakeGuild:
+    """One guild with a text channel, the given roles and members created on first use."""
+
+    def __init__(self, guild_id: int, name: str, roles: List[FakeRole]):
+        self.id = guild_id
+        self.name = name
+        self._roles: Dict[int, FakeRole] = {role.id: role for role in roles}
+        self._members: Dict[int, FakeMember] = {}
+        self.me = FakeMember(next(_snowflakes), self)
+        self.me.bot = True
+        self.me.guild_permissions = FakePermissions()
+        self.me.top_role = FakeRole(next(_snowflakes), "Dokkaebi", max((role.position for role in roles), default=0) + 1)
+        self.channel = FakeChannel(next(_snowflakes), self.me, self)
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self._roles.get(role_id)
+
+    def member(self, user_id: int) -> FakeMember:
+        member = self._members.get(user_id)
+        if member is None:
+            member = self._members[user_id] = FakeMember(user_id, self)
+        return member
+
+    def get_member(self, user_id: int) -> Optional[FakeMember]:
+        return self._members.get(user_id)
+
+class FakeFollowup:
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        record_rest('followup.send')
+        return FakeMessage(None, content or "", None)
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild, user: FakeMember):
+        self.guild = guild
+        self.user = user
+
+class FakeContext:
+    """What slash command callbacks use of discord.ApplicationContext."""
+
+    def __init__(self, author: FakeMember, guild: FakeGuild, command=None):
+        self.author = author
+        self.user = author
+        self.guild = guild
+        self.command = command
+        self.interaction = FakeInteraction(guild, author)
+        self.followup = FakeFollowup()
+
+    async def defer(self, ephemeral: bool = False, **kwargs):
+        record_rest('interaction.defer')
+
+    async def respond(self, content: Optional[str] = None, **kwargs):
+        record_rest('interaction.respond')
+
+class FakeBot:
+    """The parts of the bot that user_resolver.py and notifications.py call."""
+
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+        self.user = guild.me
+        self._users: Dict[int, FakeUser] = {}
+
+    def get_user(self, user_id: int):
+        # Only members already seen are cached, like the gateway's member cache.
+        return self.guild.get_member(user_id)
+
+    async def fetch_user(self, user_id: int) -> FakeUser:
+        record_rest('user.fetch')
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = FakeUser(user_id)
+        return user
+
+    def get_channel(self, channel_id: int):
+        return self.guild.channel if channel_id == self.guild.channel.id else None
+
+    async def fetch_channel(self, channel_id: int) -> FakeChannel:
+        record_rest('channel.fetch')
+        return FakeChannel(channel_id, self.user, self.guild)
@@ -0,0 +1,158 @@
+"""Runs scenarios against a scratch database and compares result files."""
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+
+import database as db
+from bench.scenarios import SCENARIOS, BenchData
+
+# --compare flags a scenario when throughput drops, or p99 latency rises, by more than this.
+DEFAULT_THRESHOLD = 0.10
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+async def _measure(scenario: str, data: BenchData, concurrency: int, seconds: float, seed: int) -> Dict[str, Any]:
+    run = SCENARIOS[scenario]
+    latencies: List[float] = []
+    errors = 0
+    stop_at = time.perf_counter() + seconds
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        rng = random.Random(seed * 1_000_003 + worker_id)
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                await run(rng, data)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"WARNING: {scenario} raised {e!r}")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'ops': len(latencies),
+        'errors': errors,
+        'ops_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@asynccontextmanager
+async def scratch_database(backend: str = "sqlite", ungrouped: bool = False) -> AsyncIterator[None]:
+    """Points database.py at an empty database in a temporary directory for the duration."""
+    saved = (db.DB_FILE, db.STORAGE_BACKEND, db.MEMORY_STORAGE_DIR, db.GROUP_COMMIT_WINDOW, db.MAX_GROUP_SIZE)
+    saved_env = os.environ.pop('STORAGE_BACKEND', None), os.environ.pop('MEMORY_STORAGE_DIR', None)
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            db.DB_FILE = os.path.join(scratch, "bench.db")
+            db.STORAGE_BACKEND = backend
+            db.MEMORY_STORAGE_DIR = os.path.join(scratch, "memory")
+            if ungrouped:
+                # One write per transaction, to see what group commit is worth.
+                db.GROUP_COMMIT_WINDOW, db.MAX_GROUP_SIZE = 0, 1
+            await db.init_db()
+            try:
+                yield
+            finally:
+                await db.close_db()
+    finally:
+        db.DB_FILE, db.STORAGE_BACKEND, db.MEMORY_STORAGE_DIR, db.GROUP_COMMIT_WINDOW, db.MAX_GROUP_SIZE = saved
+        for key, value in zip(('STORAGE_BACKEND', 'MEMORY_STORAGE_DIR'), saved_env):
+            if value is not None:
+                os.environ[key] = value
+
+async def run(scenarios: List[str], concurrencies: List[int], seconds: float, users: int,
+              backend: str = "sqlite", ungrouped: bool = False, seed: int = 0) -> Dict[str, Any]:
+    """
+    Seeds a scratch database, runs every scenario at every concurrency and returns the
+    results with enough metadata to tell runs apart later.
+    """
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"Unknown scenario(s): {', '.join(unknown)}")
+    results = []
+    async with scratch_database(backend, ungrouped):
+        data = BenchData(users)
+        await data.seed()
+        for scenario in scenarios:
+            for concurrency in concurrencies:
+                result = await _measure(scenario, data, concurrency, seconds, seed)
+                results.append(result)
+                print(format_result(result))
+    return {
+        'meta': {
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'backend': backend,
+            'ungrouped': ungrouped,
+            'seconds': seconds,
+            'users': users,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+def format_result(result: Dict[str, Any]) -> str:
+    errors = f"  {result['errors']} errors" if result['errors'] else ""
+    return (f"{result['scenario']:>26}  x{result['concurrency']:<4} {result['ops_per_sec']:>10,.0f} ops/s"
+            f"  p50 {result['p50_ms']:>8.3f}ms  p95 {result['p95_ms']:>8.3f}ms  p99 {result['p99_ms']:>8.3f}ms{errors}")
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save(report: Dict[str, Any], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+def compare(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> Tuple[List[str], int]:
+    """
+    Lines describing each scenario both reports ran, and how many of them regressed:
+    throughput down, or p99 latency up, by more than `threshold`.
+    """
+    before = {(r['scenario'], r['concurrency']): r for r in baseline['results']}
+    lines = []
+    regressions = 0
+    for result in candidate['results']:
+        old = before.get((result['scenario'], result['concurrency']))
+        if old is None:
+            continue
+        throughput = result['ops_per_sec'] / old['ops_per_sec'] - 1 if old['ops_per_sec'] else 0.0
+        p99 = result['p99_ms'] / old['p99_ms'] - 1 if old['p99_ms'] else 0.0
+        regressed = throughput < -threshold or p99 > threshold
+        regressions += regressed
+        lines.append(
+            f"{'REGRESSION' if regressed else 'ok':>10}  {result['scenario']:>26}  x{result['concurrency']:<4}"
+            f" {old['ops_per_sec']:>10,.0f} -> {result['ops_per_sec']:>10,.0f} ops/s ({throughput:+.1%})"
+            f"  p99 {old['p99_ms']:.3f} -> {result['p99_ms']:.3f}ms ({p99:+.1%})"
+        )
+    return lines, regressions
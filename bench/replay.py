@@ -0,0 +1,372 @@
+"""
+Replays command traces through main.py's handlers without Discord.
+
+    python -m bench.replay [TRACE] [--users 5000] [--events 20000] [--write-trace out.jsonl]
+                           [--max-in-flight 50] [--speed 0] [--no-rate-limits] [--output results.json]
+
+TRACE is a file written by the bot with COMMAND_TRACE_FILE set (see command_trace.py).
+Without one, a synthetic trace is generated: steady arrivals from --users accounts plus
+regular bursts from a handful of spammers. Messages go through main.on_message and slash
+commands straight to their callbacks, against the fakes in bench/fakes.py and a scratch
+database seeded like `python -m bench`.
+
+Reported per command: how many ran, p50/p99 latency, and the REST and database.py calls
+each one made on average. Calls made by background work after a command returned (digest
+DMs, say) are reported under "(background)".
+"""
+import argparse
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import discord
+
+import command_trace
+import database as db
+import main
+import ratelimit
+from bench import fakes, harness
+from bench.scenarios import BenchData, GUILD_ID, SHOP_ITEM_COUNT
+
+# --- Synthetic traces ---
+
+def _message(content: str, mentions: Iterable[int] = ()) -> Dict[str, Any]:
+    return {'type': 'message', 'content': content, 'mentions': list(mentions)}
+
+def _slash(command: str, **options) -> Dict[str, Any]:
+    return {'type': 'slash', 'command': command, 'options': options}
+
+EventMaker = Callable[[random.Random, BenchData], Dict[str, Any]]
+
+# What a typical user sends, with rough relative frequencies.
+SYNTHETIC_MIX: List[Tuple[EventMaker, int]] = [
+    (lambda rng, data: _message(f"grr cf {rng.randint(10, 500)} {rng.choice(('h', 't'))}"), 20),
+    (lambda rng, data: _message(f"grr slots {rng.randint(10, 500)}"), 20),
+    (lambda rng, data: _message(f"grr bet {rng.randint(10, 500)}"), 5),
+    (lambda rng, data: _message("grr daily"), 8),
+    (lambda rng, data: _message("grr cash"), 8),
+    (lambda rng, data: _message("grr exchange"), 3),
+    (lambda rng, data: _message(f"grr lb {rng.randint(1, 5)}"), 3),
+    (lambda rng, data: (lambda recipient: _message(f"grr pay <@{recipient}> {rng.randint(1, 200)}", [recipient]))(data.user(rng)), 6),
+    (lambda rng, data: _slash("balance"), 8),
+    (lambda rng, data: _slash("pay", recipient=data.user(rng), amount=rng.randint(1, 50)), 4),
+    (lambda rng, data: _slash("leaderboard", page=rng.randint(1, 5)), 3),
+    (lambda rng, data: _slash("shop view"), 3),
+    (lambda rng, data: _slash("shop buy", name=rng.choice(data.item_names)), 2),
+]
+
+def synthetic_trace(data: BenchData, events: int, seed: int = 0, rate: float = 200.0,
+                    burst_every: float = 10.0, burst_users: int = 20, burst_size: int = 10) -> List[Dict[str, Any]]:
+    """
+    `events` commands: Poisson arrivals at `rate` per second from random users, plus every
+    `burst_every` seconds `burst_users` users each sending `burst_size` gambling commands
+    within a second.
+    """
+    rng = random.Random(seed)
+    makers = [maker for maker, _ in SYNTHETIC_MIX]
+    weights = [weight for _, weight in SYNTHETIC_MIX]
+    trace: List[Dict[str, Any]] = []
+    at = 0.0
+    next_burst = burst_every
+    while len(trace) < events:
+        at += rng.expovariate(rate)
+        if at >= next_burst:
+            for _ in range(burst_users):
+                user = data.user(rng)
+                for _ in range(burst_size):
+                    trace.append({'at': next_burst + rng.random(), 'user': user,
+                                  **_message(f"grr {rng.choice(('cf', 'slots'))} {rng.randint(10, 100)}")})
+            next_burst += burst_every
+        maker, = rng.choices(makers, weights=weights)
+        trace.append({'at': at, 'user': data.user(rng), **maker(rng, data)})
+    trace.sort(key=lambda event: event['at'])
+    for event in trace:
+        event['at'] = round(event['at'], 6)
+    return trace[:events]
+
+# --- Instrumentation ---
+
+# The trace time of the event being handled; see _TraceClockLimiter.
+_trace_time: "contextvars.ContextVar[float]" = contextvars.ContextVar('replay_trace_time', default=0.0)
+# Set while a counted database.py call runs, so the calls it makes itself aren't counted again.
+_in_db_call: "contextvars.ContextVar[bool]" = contextvars.ContextVar('replay_in_db_call', default=False)
+
+class _TraceClockLimiter:
+    """
+    A RateLimiter that reads the trace's clock instead of the wall clock, so a full-speed
+    replay is throttled the way the recorded traffic would have been.
+    """
+
+    def __init__(self, limiter: ratelimit.RateLimiter):
+        self.limiter = limiter
+
+    def check(self, key, now: Optional[float] = None) -> float:
+        return self.limiter.check(key, _trace_time.get())
+
+    def warn_once(self, key) -> bool:
+        return self.limiter.warn_once(key)
+
+class _Unlimited:
+    def check(self, key, now: Optional[float] = None) -> float:
+        return 0.0
+
+    def warn_once(self, key) -> bool:
+        return False
+
+def _counted(name: str, function):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        if _in_db_call.get():
+            return await function(*args, **kwargs)
+        fakes.record_db(name)
+        token = _in_db_call.set(True)
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            _in_db_call.reset(token)
+    return wrapper
+
+def _db_functions() -> Dict[str, Any]:
+    """database.py's public coroutine functions, which is everything that can touch storage."""
+    return {
+        name: function for name, function in vars(db).items()
+        if not name.startswith('_') and name not in ('init_db', 'close_db')
+        and inspect.iscoroutinefunction(function) and function.__module__ == db.__name__
+    }
+
+def _slash_commands() -> Dict[str, Any]:
+    commands = {}
+    for command in main.bot.pending_application_commands:
+        for leaf in getattr(command, 'subcommands', None) or [command]:
+            commands[leaf.qualified_name] = leaf
+    return commands
+
+def _command_key(event: Dict[str, Any]) -> str:
+    if event['type'] == 'slash':
+        return f"/{event['command']}"
+    parts = event['content'].split()
+    handler, _ = main.GRR_COMMANDS.get(parts[1].lower() if len(parts) > 1 else None, (None, None))
+    # Aliases (slot/slots) share a handler, so report them under one name.
+    return f"grr {handler.__name__[len('handle_grr_'):].replace('_', '-')}" if handler else "grr (unknown)"
+
+# --- Replayer ---
+
+class Replayer:
+    """Runs trace events against main.py with Discord swapped for fakes, counting what each costs."""
+
+    def __init__(self, max_in_flight: int = 50, rate_limits: bool = True):
+        self.max_in_flight = max_in_flight
+        self.rate_limits = rate_limits
+        roles = [fakes.FakeRole(100 + i, f"Stigma {i}", i + 1) for i in range(SHOP_ITEM_COUNT)]
+        self.guild = fakes.FakeGuild(GUILD_ID, "Bench Guild", roles)
+        self.bot = fakes.FakeBot(self.guild)
+        self.slash_commands = _slash_commands()
+        self.background = fakes.CallCounts()
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self.errors = 0
+
+    def _patches(self) -> List[Tuple[Any, str, Any]]:
+        async def no_pause(seconds: float):
+            await asyncio.sleep(0)
+
+        if self.rate_limits:
+            limiters = {name: _TraceClockLimiter(ratelimit.RateLimiter(rate, burst)) for name, (rate, burst) in main.GRR_RATE_LIMITS.items()}
+        else:
+            limiters = {name: _Unlimited() for name in main.GRR_RATE_LIMITS}
+        patches = [
+            (main, '_pause', no_pause),
+            (main, 'grr_rate_limiters', limiters),
+            (main, 'grr_command_slots', asyncio.Semaphore(main.MAX_CONCURRENT_GRR_COMMANDS)),
+            (main.user_resolver, 'BOT_INSTANCE', self.bot),
+            (main.constellation_notifier, 'bot', self.bot),
+        ]
+        if main.admin_log_pipeline:
+            patches.append((main.admin_log_pipeline, 'bot', self.bot))
+        patches.extend((db, name, _counted(name, function)) for name, function in _db_functions().items())
+        return patches
+
+    async def _dispatch(self, event: Dict[str, Any]):
+        author = self.guild.member(event['user'])
+        if event['type'] == 'message':
+            mentions = [self.guild.member(user_id) for user_id in event.get('mentions', [])]
+            message = fakes.FakeMessage(author, event['content'], self.guild.channel, mentions, self.guild)
+            await main.on_message(message)
+            return
+        command = self.slash_commands.get(event['command'])
+        if command is None:
+            raise ValueError(f"Unknown slash command '/{event['command']}'")
+        # Calling the callback skips checks and cooldowns, as a replay should.
+        values = event.get('options', {})
+        kwargs = {}
+        for option in command.options:
+            value = values.get(option.name, option.default)
+            if value is not None:
+                if option.input_type in (discord.SlashCommandOptionType.user, discord.SlashCommandOptionType.mentionable):
+                    value = self.guild.member(value)
+                elif option.input_type == discord.SlashCommandOptionType.role:
+                    value = self.guild.get_role(value)
+                elif option.input_type == discord.SlashCommandOptionType.channel:
+                    value = self.guild.channel
+                elif option.input_type == discord.SlashCommandOptionType.attachment:
+                    value = None
+            kwargs[option.name] = value
+        await command.callback(fakes.FakeContext(author, self.guild, command), **kwargs)
+
+    async def _handle(self, event: Dict[str, Any]):
+        key = _command_key(event)
+        counts = fakes.CallCounts(spill=self.background)
+        _trace_time.set(event['at'])
+        start = time.perf_counter()
+        with fakes.counting(counts):
+            try:
+                await self._dispatch(event)
+            except Exception as e:
+                self.errors += 1
+                if self.errors == 1:
+                    print(f"WARNING: {key} raised {e!r}")
+        elapsed = time.perf_counter() - start
+        counts.finish()
+        stat = self.stats.setdefault(key, {'latencies': [], 'rest': 0, 'db': 0, 'rest_routes': {}, 'db_calls': {}})
+        stat['latencies'].append(elapsed)
+        for field, counter in (('rest', counts.rest), ('db', counts.db)):
+            stat[field] += sum(counter.values())
+            routes = stat[f"{field}_routes" if field == 'rest' else 'db_calls']
+            for name, count in counter.items():
+                routes[name] = routes.get(name, 0) + count
+
+    async def replay(self, trace: List[Dict[str, Any]], speed: float = 0.0) -> float:
+        """
+        Runs every event, in order, with at most `max_in_flight` at once. A `speed` of 0 runs
+        as fast as possible; otherwise events start at their trace time divided by `speed`.
+        Returns the elapsed wall-clock seconds.
+        """
+        patches = self._patches()
+        saved = [(target, attr, getattr(target, attr)) for target, attr, _ in patches]
+        for target, attr, value in patches:
+            setattr(target, attr, value)
+        if main.admin_log_pipeline:
+            main.admin_log_pipeline.start()
+        slots = asyncio.Semaphore(self.max_in_flight)
+
+        async def run(event):
+            try:
+                await self._handle(event)
+            finally:
+                slots.release()
+
+        tasks = []
+        start = time.perf_counter()
+        try:
+            for event in trace:
+                if speed:
+                    delay = event['at'] / speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await slots.acquire()
+                tasks.append(asyncio.create_task(run(event)))
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+            # Send whatever background work is still holding on to.
+            with fakes.counting(self.background):
+                await main.constellation_notifier.stop()
+                if main.admin_log_pipeline:
+                    await main.admin_log_pipeline.stop()
+        finally:
+            for target, attr, value in saved:
+                setattr(target, attr, value)
+        return elapsed
+
+    def results(self) -> List[Dict[str, Any]]:
+        results = []
+        for key, stat in sorted(self.stats.items()):
+            latencies = sorted(stat['latencies'])
+            count = len(latencies)
+            results.append({
+                'command': key,
+                'count': count,
+                'p50_ms': harness.percentile(latencies, 0.50) * 1000,
+                'p99_ms': harness.percentile(latencies, 0.99) * 1000,
+                'rest_per_command': stat['rest'] / count,
+                'db_per_command': stat['db'] / count,
+                'rest_routes': {name: n / count for name, n in sorted(stat['rest_routes'].items())},
+                'db_calls': {name: n / count for name, n in sorted(stat['db_calls'].items())},
+            })
+        results.append({
+            'command': '(background)',
+            'count': 0,
+            'rest': dict(self.background.rest),
+            'db': dict(self.background.db),
+        })
+        return results
+
+def format_result(result: Dict[str, Any]) -> str:
+    if result['command'] == '(background)':
+        calls = {**result['rest'], **{f"db.{name}": n for name, n in result['db'].items()}}
+        return f"{'(background)':>18}  " + (", ".join(f"{name} x{n}" for name, n in sorted(calls.items())) or "none")
+    routes = ", ".join(f"{name} {n:.2f}" for name, n in result['rest_routes'].items())
+    return (f"{result['command']:>18}  {result['count']:>7,}  p50 {result['p50_ms']:>8.3f}ms  p99 {result['p99_ms']:>8.3f}ms"
+            f"  REST {result['rest_per_command']:>5.2f}  DB {result['db_per_command']:>5.2f}  ({routes})")
+
+# --- CLI ---
+
+async def _run(args: argparse.Namespace, trace: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    async with harness.scratch_database(args.backend):
+        data = BenchData(args.users)
+        await data.seed()
+        if trace is None:
+            trace = synthetic_trace(data, args.events, seed=args.seed)
+            if args.write_trace:
+                command_trace.write_trace(args.write_trace, trace)
+                print(f"Synthetic trace written to {args.write_trace}.")
+        replayer = Replayer(max_in_flight=args.max_in_flight, rate_limits=not args.no_rate_limits)
+        elapsed = await replayer.replay(trace, speed=args.speed)
+    results = replayer.results()
+    print(f"Replayed {len(trace):,} commands in {elapsed:.2f}s ({len(trace) / elapsed:,.0f}/s), {replayer.errors} errors.")
+    print(f"{'command':>18}  {'count':>7}")
+    for result in results:
+        print(format_result(result))
+    return {
+        'meta': {
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'trace': args.trace,
+            'events': len(trace),
+            'users': args.users,
+            'seed': args.seed,
+            'backend': args.backend,
+            'max_in_flight': args.max_in_flight,
+            'rate_limits': not args.no_rate_limits,
+            'seconds': elapsed,
+            'errors': replayer.errors,
+        },
+        'results': results,
+    }
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.replay", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", nargs="?", help="Trace file to replay (default: generate a synthetic one).")
+    parser.add_argument("--users", type=int, default=5_000, help="How many accounts to seed and draw synthetic users from.")
+    parser.add_argument("--events", type=int, default=20_000, help="Length of the synthetic trace.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic trace.")
+    parser.add_argument("--write-trace", help="Also save the synthetic trace to this file.")
+    parser.add_argument("--max-in-flight", type=int, default=50, help="Commands handled at once.")
+    parser.add_argument("--speed", type=float, default=0.0, help="Replay at this multiple of recorded speed (0: as fast as possible).")
+    parser.add_argument("--no-rate-limits", action="store_true", help="Turn off the grr rate limits.")
+    parser.add_argument("--backend", choices=("sqlite", "memory"), default="sqlite", help="Storage engine to run against.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    trace = list(command_trace.read_trace(args.trace)) if args.trace else None
+    report = asyncio.run(_run(args, trace))
+    if args.output:
+        harness.save(report, args.output)
+        print(f"Results written to {args.output}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
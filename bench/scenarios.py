@@ -0,0 +1,200 @@
+"""
+What the benchmark runs. Each scenario is one "operation": a single database.py call, or
+the sequence of calls a bot command makes. Scenarios get a random generator and the
+seeded BenchData, and must leave the data usable for the next operation.
+"""
+import random
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import database as db
+
+GUILD_ID = 1
+SHOP_ITEM_COUNT = 50
+# Seeded accounts are numbered from here.
+FIRST_USER_ID = 1_000_000
+
+class BenchData:
+    """The accounts, names and shop items seeded before the scenarios run."""
+
+    def __init__(self, users: int):
+        self.users = users
+        self.item_names = [f"Artifact {i:03d}" for i in range(SHOP_ITEM_COUNT)]
+
+    def user(self, rng: random.Random) -> int:
+        return FIRST_USER_ID + rng.randrange(self.users)
+
+    async def seed(self):
+        rng = random.Random(0)
+        user_ids = [FIRST_USER_ID + i for i in range(self.users)]
+        await db.update_user_balances_bulk([
+            {'user_id': user_id, 'ssc': rng.randint(0, 10_000), 'grr': rng.randint(0, 1_000_000)} for user_id in user_ids
+        ])
+        await db.store_user_names([
+            {'user_id': user_id, 'name': f"user{user_id}", 'discriminator': '0', 'display_name': f"Incarnation {user_id}"}
+            for user_id in user_ids
+        ])
+        for i, name in enumerate(self.item_names):
+            await db.add_shop_item(GUILD_ID, name, 10 + i, 100 + i, None, i % 5 == 0)
+        await db.set_config_values({'exchange_enabled': 'true', 'exchange_grr_cost': '500', 'exchange_ssc_reward': '10'})
+
+Scenario = Callable[[random.Random, BenchData], Awaitable[None]]
+
+# --- Single calls ---
+
+async def get_balance(rng, data):
+    await db.get_balance(data.user(rng))
+
+async def get_grr_balance(rng, data):
+    await db.get_grr_balance(data.user(rng))
+
+async def add_coins(rng, data):
+    await db.add_coins(data.user(rng), rng.randint(-5, 10))
+
+async def add_grr_coins(rng, data):
+    await db.add_grr_coins(data.user(rng), 1)
+
+async def transfer_coins(rng, data):
+    await db.transfer_coins(data.user(rng), data.user(rng), rng.randint(1, 50))
+
+async def transfer_grr_coins(rng, data):
+    await db.transfer_grr_coins(data.user(rng), data.user(rng), rng.randint(1, 500))
+
+async def settle_grr_wager(rng, data):
+    await db.settle_grr_wager(data.user(rng), 100, rng.choice((0, 200)))
+
+async def claim_daily_grr(rng, data):
+    await db.claim_daily_grr(data.user(rng), 100)
+
+async def perform_grr_ssc_exchange(rng, data):
+    await db.perform_grr_ssc_exchange(data.user(rng), 500, 10)
+
+async def update_user_balances(rng, data):
+    await db.update_user_balances(data.user(rng), rng.randint(0, 10_000), rng.randint(0, 1_000_000))
+
+async def update_user_balances_bulk(rng, data):
+    await db.update_user_balances_bulk([
+        {'user_id': data.user(rng), 'ssc': rng.randint(0, 10_000), 'grr': rng.randint(0, 1_000_000)} for _ in range(100)
+    ])
+
+async def leaderboards(rng, data):
+    await db.get_leaderboard()
+    await db.get_grr_leaderboard()
+    await db.get_leaderboard_page(rng.randint(1, 50))
+    await db.get_grr_leaderboard_page(rng.randint(1, 50))
+    await db.get_rank(data.user(rng))
+    await db.get_grr_rank(data.user(rng))
+
+async def get_all_users_combined(rng, data):
+    await db.get_all_users_combined()
+
+async def verify_balance_caches(rng, data):
+    await db.verify_balance_caches()
+
+async def prune_empty_accounts(rng, data):
+    await db.prune_empty_accounts()
+
+async def user_names(rng, data):
+    user_ids = [data.user(rng) for _ in range(10)]
+    await db.get_user_names(user_ids)
+    await db.store_user_names([
+        {'user_id': user_id, 'name': f"user{user_id}", 'discriminator': '0', 'display_name': f"Renamed {user_id}"}
+        for user_id in user_ids
+    ])
+    await db.get_user_ids_missing_names(data.user(rng))
+
+async def search_users(rng, data):
+    rows, cursor = await db.search_users(sort=rng.choice(('ssc', 'grr')))
+    await db.search_users(sort='ssc', cursor=cursor)
+    await db.search_users(query=str(data.user(rng))[-4:])
+
+async def pending_logs(rng, data):
+    log_ids = await db.add_pending_logs(['{"title": "bench"}'] * 5)
+    await db.get_pending_logs()
+    await db.delete_pending_logs(log_ids)
+
+async def shop_reads(rng, data):
+    await db.get_shop_item(GUILD_ID, rng.choice(data.item_names))
+    await db.get_all_shop_items(GUILD_ID)
+    await db.search_shop_item_names(GUILD_ID, "Artifact 0")
+
+async def shop_admin(rng, data):
+    name = f"Temp {rng.random()}"
+    await db.add_shop_item(GUILD_ID, name, 1, 1, None, True)
+    item = await db.get_shop_item(GUILD_ID, name)
+    await db.update_shop_item(item['item_id'], {'cost': 2, 'image_url': ''})
+    await db.mark_item_as_purchased(item['item_id'], data.user(rng))
+    if rng.random() < 0.5:
+        await db.remove_shop_item(GUILD_ID, name)
+    else:
+        await db.delete_shop_item(item['item_id'])
+
+async def config(rng, data):
+    await db.set_config_value('bench_key', str(rng.random()))
+    await db.get_config_value('bench_key')
+    await db.get_all_configs()
+    db.get_config_float('cf_win_rate', 0.31)
+    db.get_slot_multipliers()
+
+# --- Command mixes: the calls each bot command makes ---
+
+async def cmd_daily(rng, data):
+    user_id = data.user(rng)
+    if await db.claim_daily_grr(user_id, rng.randint(50, 150)) == "success":
+        await db.get_grr_balance(user_id)
+
+async def cmd_cf(rng, data):
+    user_id = data.user(rng)
+    win = rng.random() < db.get_config_float('cf_win_rate', 0.31)
+    if await db.settle_grr_wager(user_id, 100, 200 if win else 0) is None:
+        await db.get_grr_balance(user_id)
+
+async def cmd_slots(rng, data):
+    user_id = data.user(rng)
+    multipliers = db.get_slot_multipliers()
+    payout = 100 * multipliers['2_of_a_kind'] if rng.random() < 0.2 else 0
+    if await db.settle_grr_wager(user_id, 100, payout) is None:
+        await db.get_grr_balance(user_id)
+
+async def cmd_pay(rng, data):
+    sender, recipient = data.user(rng), data.user(rng)
+    await db.transfer_grr_coins(sender, recipient, rng.randint(1, 500))
+    await db.get_grr_balance(sender)
+    await db.get_grr_balance(recipient)
+
+async def cmd_exchange(rng, data):
+    user_id = data.user(rng)
+    if db.get_config_bool('exchange_enabled', False):
+        await db.perform_grr_ssc_exchange(user_id, db.get_config_int('exchange_grr_cost', 5000), db.get_config_int('exchange_ssc_reward', 100))
+        await db.get_grr_balance(user_id)
+        await db.get_balance(user_id)
+
+async def cmd_shop_buy(rng, data):
+    user_id = data.user(rng)
+    name = rng.choice(data.item_names)
+    await db.get_shop_item(GUILD_ID, name)
+    await db.get_balance(user_id)
+    status, item = await db.purchase_item(GUILD_ID, name, user_id)
+    if status == "success" and item['is_one_time_buy']:
+        # Give unique items back so the next buyer has something to buy.
+        await db.release_purchase(item, user_id)
+
+# Command mix weights, roughly how often each command is used.
+MIX: List[Tuple[Scenario, int]] = [
+    (cmd_cf, 30), (cmd_slots, 30), (cmd_daily, 10), (cmd_pay, 10),
+    (cmd_exchange, 5), (cmd_shop_buy, 5), (get_grr_balance, 10),
+]
+
+async def mix(rng, data):
+    scenario, = rng.choices([scenario for scenario, _ in MIX], weights=[weight for _, weight in MIX])
+    await scenario(rng, data)
+
+SCENARIOS: Dict[str, Scenario] = {scenario.__name__: scenario for scenario in (
+    get_balance, get_grr_balance, add_coins, add_grr_coins, transfer_coins, transfer_grr_coins,
+    settle_grr_wager, claim_daily_grr, perform_grr_ssc_exchange, update_user_balances,
+    update_user_balances_bulk, leaderboards, get_all_users_combined, verify_balance_caches,
+    prune_empty_accounts, user_names, search_users, pending_logs, shop_reads, shop_admin, config,
+    cmd_daily, cmd_cf, cmd_slots, cmd_pay, cmd_exchange, cmd_shop_buy, mix,
+)}
+# Run when no scenarios are named: the commands and a few hot single calls.
+DEFAULT_SCENARIOS = ['get_balance', 'add_grr_coins', 'transfer_coins', 'leaderboards',
+                     'cmd_daily', 'cmd_cf', 'cmd_slots', 'cmd_pay', 'cmd_exchange', 'cmd_shop_buy', 'mix']
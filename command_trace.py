@@ -0,0 +1,110 @@
+"""
+Command traces: the commands the bot received, one JSON object per line in arrival order.
+Written by main.py when COMMAND_TRACE_FILE is set, and replayed without Discord by
+`python -m bench.replay`.
+
+    {"at": 0.0, "user": 1, "type": "message", "content": "grr slots 50", "mentions": [2]}
+    {"at": 0.4, "user": 2, "type": "slash", "command": "shop buy", "options": {"name": "Crown"}}
+
+`at` is seconds since the trace started. Slash options hold plain values; user, role and
+channel options hold IDs. The file is written by a background thread, like spans.TraceLog,
+so recording a command never waits on the disk.
+"""
+import json
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import discord
+
+# Option types whose values are snowflake IDs.
+_ID_OPTION_TYPES = (
+    discord.SlashCommandOptionType.user.value,
+    discord.SlashCommandOptionType.channel.value,
+    discord.SlashCommandOptionType.role.value,
+    discord.SlashCommandOptionType.mentionable.value,
+    discord.SlashCommandOptionType.attachment.value,
+)
+
+def message_event(at: float, message: discord.Message) -> Dict[str, Any]:
+    return {
+        'at': round(at, 6),
+        'user': message.author.id,
+        'type': 'message',
+        'content': message.content,
+        'mentions': [user.id for user in message.mentions],
+    }
+
+def _leaf_options(options: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    # Subcommands nest their options one level down per group.
+    options = options or []
+    while len(options) == 1 and 'options' in options[0]:
+        options = options[0]['options']
+    return {
+        option['name']: int(option['value']) if option['type'] in _ID_OPTION_TYPES else option['value']
+        for option in options if 'value' in option
+    }
+
+def slash_event(at: float, ctx: discord.ApplicationContext) -> Dict[str, Any]:
+    return {
+        'at': round(at, 6),
+        'user': ctx.author.id,
+        'type': 'slash',
+        'command': ctx.command.qualified_name,
+        'options': _leaf_options(ctx.selected_options),
+    }
+
+class TraceRecorder:
+    """Appends received commands to a trace file from a writer thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._started = time.monotonic()
+        # Events waiting for the writer thread; None tells it to finish.
+        self._queue: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = threading.Thread(
+            target=self._write_all, name="command-trace-writer", daemon=True)
+        self._writer.start()
+
+    def _write(self, event: Dict[str, Any]):
+        self._queue.put(event)
+
+    def _write_all(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break
+            try:
+                self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+                # Flushed once the queue runs dry rather than after every command.
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                print(f"ERROR: Could not write command trace to {self.path}. {e}")
+        self._file.close()
+
+    def record_message(self, message: discord.Message):
+        self._write(message_event(time.monotonic() - self._started, message))
+
+    def record_slash(self, ctx: discord.ApplicationContext):
+        self._write(slash_event(time.monotonic() - self._started, ctx))
+
+    def close(self):
+        """Writes out every queued command and closes the file."""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+def read_trace(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def write_trace(path: str, events: List[Dict[str, Any]]):
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
@@ -1,316 +1,1302 @@
+import asyncio
+import functools
+import inspect
+import json
+import os
+import time
 import aiosqlite
-from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable, Tuple
 from datetime import date
 
+import metrics
+import spans
+from balance_cache import BalanceCache
+from leaderboard import Leaderboard
+from shop_catalog import ShopCatalog
+from storage import Storage, SHOP_ITEM_FIELDS, encode_search_cursor, decode_search_cursor
+from memory_storage import MemoryStorage
+from query_log import QueryLog, TracedConnection
+
 DB_FILE = "starstream.db"
+# Where balances, the shop and config live: 'sqlite' (DB_FILE) or 'memory' (see
+# memory_storage.py). Overridden by the STORAGE_BACKEND / MEMORY_STORAGE_DIR environment
+# variables. User names, search and pending logs always stay in SQLite.
+STORAGE_BACKEND = "sqlite"
+MEMORY_STORAGE_DIR = "starstream_data"
+READER_POOL_SIZE = 4
+# Times every statement and captures query plans (see query_log.py). Also switched on by the
+# QUERY_TRACING environment variable, or at runtime from the admin panel's Queries page.
+QUERY_TRACING = False
+STATEMENT_CACHE_SIZE = 256
+
+# Applied to every connection the manager opens. WAL lets the readers run
+# alongside the writer; NORMAL sync is safe under WAL and skips an fsync per commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# --- Connection Management ---
+# Group commit: writes that queue up while a transaction is open share its COMMIT
+# (and its fsync). GROUP_COMMIT_WINDOW is how long the writer waits for more writes
+# once the queue runs dry; 0 groups only what's already queued, so a lone write is
+# never delayed. MAX_GROUP_SIZE caps how many writes share one transaction.
+GROUP_COMMIT_WINDOW = 0.0
+MAX_GROUP_SIZE = 64
+
+DB_CONNECTIONS_OPENED = metrics.Counter(
+    "starstream_db_connections_opened_total", "SQLite connections opened, by role.", ["role"])
+DB_READER_WAIT_SECONDS = metrics.Histogram(
+    "starstream_db_reader_wait_seconds", "Time spent waiting for a pooled reader connection.")
+DB_WRITE_GROUP_SIZE = metrics.Histogram(
+    "starstream_db_write_group_size", "Writes sharing one committed transaction.", buckets=(1, 2, 4, 8, 16, 32, 64))
+DB_WRITE_QUEUE_DEPTH = metrics.Gauge(
+    "starstream_db_write_queue_depth", "Writes waiting for the writer task.",
+    function=lambda: _manager._write_queue.qsize() if _manager else 0)
+
+class _WriteOp:
+    """One caller's `write()` block, queued for the writer task."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.turn = loop.create_future()        # set by the writer: the savepoint is open
+        self.finished = loop.create_future()    # set by the caller: True to keep, False to roll back
+        self.committed = loop.create_future()   # set by the writer once the group's COMMIT lands
+        self.callbacks: List[Callable[[], None]] = []
+
+class ConnectionManager:
+    """
+    Long-lived connections to the database: a small pool of readers, and one writer
+    connection owned by a writer task that runs queued writes in grouped transactions.
+    """
+
+    def __init__(self, path: str, reader_count: int = READER_POOL_SIZE,
+                 group_window: float = GROUP_COMMIT_WINDOW, max_group_size: int = MAX_GROUP_SIZE):
+        self.path = path
+        self.reader_count = reader_count
+        self.group_window = group_window
+        self.max_group_size = max_group_size
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_queue: "asyncio.Queue[Optional[_WriteOp]]" = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._current_op: Optional[_WriteOp] = None
+        self._stopping = False
+        self._readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all_readers: List[aiosqlite.Connection] = []
+
+    async def _connect(self, role: str, **kwargs) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+        DB_CONNECTIONS_OPENED.inc(role)
+        conn.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def open(self):
+        """Opens the writer first (so WAL is switched on) and then the reader pool."""
+        # The writer task issues BEGIN/SAVEPOINT/COMMIT itself.
+        self._writer = await self._connect('writer', isolation_level=None)
+        self._writer_task = asyncio.create_task(self._run_writer())
+        for _ in range(self.reader_count):
+            conn = await self._connect('reader')
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        """Closes every connection. Lets queued writes finish first."""
+        if self._writer_task is not None:
+            self._write_queue.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrows a reader connection from the pool."""
+        start = time.perf_counter()
+        conn = await self._readers.get()
+        DB_READER_WAIT_SECONDS.observe(time.perf_counter() - start)
+        try:
+            yield conn if _query_log is None else TracedConnection(conn, _query_log)
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Runs the block as one atomic unit on the writer. It may share a transaction with
+        other writes, but an exception only rolls back this block, and the call returns
+        only after the shared COMMIT has landed.
+        """
+        if self._writer_task is None:
+            raise RuntimeError("Database writer is not running.")
+        op = _WriteOp(asyncio.get_running_loop())
+        self._write_queue.put_nowait(op)
+        try:
+            await op.turn
+        except BaseException:
+            # Cancelled while queued; the writer skips ops that already finished.
+            if not op.finished.done():
+                op.finished.set_result(False)
+            raise
+        try:
+            yield self._writer if _query_log is None else TracedConnection(self._writer, _query_log)
+        except BaseException:
+            op.finished.set_result(False)
+            raise
+        op.finished.set_result(True)
+        await op.committed
+
+    def after_commit(self, callback: Callable[[], None]):
+        """Registers a callback to run if the current write block commits."""
+        self._current_op.callbacks.append(callback)
+
+    async def _next_op(self, deadline: float) -> Optional[_WriteOp]:
+        """Gets the next queued write, waiting until `deadline` at most. None ends the group."""
+        if self._write_queue.empty():
+            # Let callers woken by the previous write enqueue theirs first.
+            await asyncio.sleep(0)
+        try:
+            op = self._write_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                return None
+            try:
+                op = await asyncio.wait_for(self._write_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if op is None:
+            self._stopping = True
+        return op
+
+    async def _run_op(self, op: _WriteOp) -> bool:
+        """Runs one caller's block inside a savepoint. Returns True if it should be kept."""
+        if op.finished.done():
+            return False
+        await self._writer.execute("SAVEPOINT write_op")
+        self._current_op = op
+        op.turn.set_result(None)
+        try:
+            keep = await op.finished
+        finally:
+            self._current_op = None
+        if not keep:
+            await self._writer.execute("ROLLBACK TO write_op")
+        await self._writer.execute("RELEASE write_op")
+        return keep
+
+    async def _run_writer(self):
+        loop = asyncio.get_running_loop()
+        self._stopping = False
+        while not self._stopping:
+            op = await self._write_queue.get()
+            if op is None:
+                break
+            group: List[_WriteOp] = []
+            try:
+                await self._writer.execute("BEGIN IMMEDIATE")
+                deadline = loop.time() + self.group_window
+                while op is not None:
+                    if await self._run_op(op):
+                        group.append(op)
+                    if len(group) >= self.max_group_size:
+                        break
+                    op = await self._next_op(deadline)
+                await self._writer.execute("COMMIT")
+            except Exception as e:
+                print(f"ERROR: Database write transaction failed: {e}")
+                if self._writer.in_transaction:
+                    await self._writer.execute("ROLLBACK")
+                if op is not None and not op.turn.done():
+                    op.turn.set_exception(e)
+                elif op is not None and op not in group and op.finished.done() and op.finished.result():
+                    # Its block ran, but the savepoint couldn't be released.
+                    op.committed.set_exception(e)
+                for failed in group:
+                    failed.committed.set_exception(e)
+                continue
+            DB_WRITE_GROUP_SIZE.observe(len(group))
+            # In-memory caches follow the database only once the commit has landed,
+            # in commit order.
+            for committed in group:
+                for callback in committed.callbacks:
+                    callback()
+                committed.committed.set_result(None)
+
+_manager: Optional[ConnectionManager] = None
+# Set while query tracing is on.
+_query_log: Optional[QueryLog] = None
+
+def set_query_tracing(enabled: bool):
+    """Turns statement tracing on, or off (dropping what has been logged)."""
+    global _query_log
+    if not enabled:
+        _query_log = None
+    elif _query_log is None:
+        _query_log = QueryLog()
+
+def get_query_log() -> Optional[QueryLog]:
+    """The statement log while query tracing is on, else None."""
+    return _query_log
+
+def _db() -> ConnectionManager:
+    if _manager is None:
+        raise RuntimeError("Database is not initialized; call init_db() first.")
+    return _manager
+
+_storage: Optional[Storage] = None
+
+def _store() -> Storage:
+    if _storage is None:
+        raise RuntimeError("Database is not initialized; call init_db() first.")
+    return _storage
+
+async def close_db():
+    """Closes the storage engine and the long-lived connections opened by init_db."""
+    global _manager, _storage
+    if _storage is not None:
+        await _storage.close()
+        _storage = None
+    if _manager is not None:
+        await _manager.close()
+        _manager = None
+        print("Database connections closed.")
+
+# --- Schema Migrations ---
+# Each migration runs once, in its own transaction, and bumps PRAGMA user_version.
+# Databases created before versioning start at 0; the early migrations use IF NOT EXISTS
+# so they apply cleanly over tables those databases already have.
+
+async def _migration_1(db: aiosqlite.Connection):
+    """Core tables."""
+    # --- SSC User table ---
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # --- Shop table ---
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS shop_items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            cost INTEGER NOT NULL,
+            role_id INTEGER NOT NULL,
+            image_url TEXT,
+            is_one_time_buy BOOLEAN NOT NULL DEFAULT 0,
+            purchased_by_user_id INTEGER,
+            UNIQUE(guild_id, name)
+        )
+    ''')
+    # --- GRR Coin User table ---
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS grr_users (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 0,
+            last_daily TEXT
+        )
+    ''')
+    # --- Config table ---
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS config (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+async def _migration_2(db: aiosqlite.Connection):
+    """Cached Discord user names (see user_resolver.py) and their search index."""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_names (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            discriminator TEXT NOT NULL DEFAULT '0',
+            display_name TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    await _create_user_search_index(db)
+
+async def _migration_3(db: aiosqlite.Connection):
+    """Admin log embeds not yet delivered (see notifications.py)."""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS pending_logs (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+
+async def _migration_4(db: aiosqlite.Connection):
+    """Indexes for leaderboard walks, cost-ordered shop listings and purchase lookups."""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_grr_users_balance ON grr_users (balance)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_shop_items_guild_cost ON shop_items (guild_id, cost)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_shop_items_purchased_by ON shop_items (purchased_by_user_id)")
+
+# Index + 1 is the user_version a migration brings the database to. Only ever append.
+MIGRATIONS = [_migration_1, _migration_2, _migration_3, _migration_4]
+
+async def _migrate():
+    async with _db().read() as db:
+        async with db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        async with _db().write() as db:
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {target}")
+        print(f"Database migrated to schema version {target}: {migration.__doc__}")
 
 # --- Database Initialization ---
 async def init_db():
-    """Initializes the database and creates tables if they don't exist."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        # --- SSC User table ---
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                balance INTEGER NOT NULL DEFAULT 0
-            )
-        ''')
-        # --- Shop table ---
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS shop_items (
-                item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                cost INTEGER NOT NULL,
-                role_id INTEGER NOT NULL,
-                image_url TEXT,
-                is_one_time_buy BOOLEAN NOT NULL DEFAULT 0,
-                purchased_by_user_id INTEGER,
-                UNIQUE(guild_id, name)
-            )
-        ''')
-        # --- GRR Coin User table ---
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS grr_users (
-                user_id INTEGER PRIMARY KEY,
-                balance INTEGER NOT NULL DEFAULT 0,
-                last_daily TEXT
+    """
+    Opens the connection manager and the storage engine, brings the schema up to date and
+    warms the in-memory caches.
+    """
+    global _manager, _storage
+    if _manager is not None:
+        return
+    if os.getenv('QUERY_TRACING', str(QUERY_TRACING)).lower() in ('1', 'true', 'yes'):
+        set_query_tracing(True)
+    _manager = ConnectionManager(DB_FILE, group_window=GROUP_COMMIT_WINDOW, max_group_size=MAX_GROUP_SIZE)
+    await _manager.open()
+    await _migrate()
+    async with _manager.read() as db:
+        await _detect_user_search_index(db)
+
+    backend = os.getenv('STORAGE_BACKEND', STORAGE_BACKEND)
+    if backend == 'memory':
+        _storage = MemoryStorage(os.getenv('MEMORY_STORAGE_DIR', MEMORY_STORAGE_DIR))
+    elif backend == 'sqlite':
+        _storage = SQLiteStorage(_manager)
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'")
+    _storage.on_balance = _on_balance
+    _storage.on_accounts_removed = _on_accounts_removed
+    _storage.on_shop_change = _on_shop_change
+    _storage.on_config_change = _on_config_change
+    await _storage.open()
+    if isinstance(_storage, MemoryStorage) and _storage.is_new:
+        # First start on the memory engine: carry over what SQLite already holds.
+        state = await SQLiteStorage(_manager).export_state()
+        await _storage.import_state(state)
+        imported = len(state['balances']['ssc']) + len(state['balances']['grr'])
+        if imported:
+            print(f"Imported {imported} balances from {DB_FILE} into memory storage.")
+
+    _load_config_cache(await _storage.get_config())
+    ssc_balances.clear()
+    grr_balances.clear()
+    await _load_leaderboards()
+    print(f"Database connection established (schema version {len(MIGRATIONS)}, {backend} storage).")
+
+# --- LEADERBOARDS ---
+# Every user's balance kept in sorted order; see leaderboard.py.
+ssc_leaderboard = Leaderboard()
+grr_leaderboard = Leaderboard(positive_only=True)
+
+async def _load_leaderboards():
+    """Loads both boards at once."""
+    ssc_rows, grr_rows = await asyncio.gather(_store().all_balances('ssc'), _store().all_balances('grr'))
+    ssc_leaderboard.load(ssc_rows)
+    grr_leaderboard.load(grr_rows)
+
+# --- BALANCE CACHES ---
+# Recently used balances per currency; see balance_cache.py. Written through by _on_balance.
+BALANCE_CACHE_SIZE = 10000
+# When True, every cache hit is checked against storage and mismatches are reported.
+BALANCE_CACHE_CHECK = False
+
+ssc_balances = BalanceCache(BALANCE_CACHE_SIZE)
+grr_balances = BalanceCache(BALANCE_CACHE_SIZE)
+
+# --- STORAGE HOOKS ---
+# Storage engines report each change once it is durable; these keep the caches in step.
+_BALANCE_VIEWS = {'ssc': (ssc_balances, ssc_leaderboard), 'grr': (grr_balances, grr_leaderboard)}
+
+def _on_balance(currency: str, user_id: int, balance: int):
+    cache, board = _BALANCE_VIEWS[currency]
+    cache.put(user_id, balance)
+    board.update(user_id, balance)
+
+def _on_accounts_removed(currency: str, user_ids: List[int]):
+    # Removed accounts all held 0, which is what a missing account reads as, so the
+    # balance cache stays correct without being told.
+    _, board = _BALANCE_VIEWS[currency]
+    for user_id in user_ids:
+        board.remove(user_id)
+
+def _on_shop_change(guild_id: int):
+    _shop_catalogs.pop(guild_id, None)
+    _shop_generations[guild_id] = _shop_generations.get(guild_id, 0) + 1
+
+def _on_config_change(values: Dict[str, str]):
+    _config_cache.update(values)
+    _parsed_config.clear()
+
+# --- SQLITE STORAGE ---
+
+# Balance tables, keyed by currency. Rows are created by the first write that needs
+# one; reads treat a missing row as a zero balance.
+_BALANCE_TABLES = {'ssc': 'users', 'grr': 'grr_users'}
+
+async def _credit(cursor, currency: str, user_id: int, amount: int) -> int:
+    """Adds `amount` to a user's balance, creating their row if needed. Returns the new balance."""
+    await cursor.execute(
+        f"""
+        INSERT INTO {_BALANCE_TABLES[currency]} (user_id, balance) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance
+        RETURNING balance
+        """,
+        (user_id, amount)
+    )
+    return (await cursor.fetchone())[0]
+
+async def _debit(cursor, currency: str, user_id: int, amount: int) -> Optional[int]:
+    """Takes `amount` from a user's balance if it covers it. Returns the new balance, or None."""
+    await cursor.execute(
+        f"UPDATE {_BALANCE_TABLES[currency]} SET balance = balance - ? WHERE user_id = ? AND balance >= ? RETURNING balance",
+        (amount, user_id, amount)
+    )
+    result = await cursor.fetchone()
+    if result is None and amount <= 0:
+        # A missing row holds 0, which covers a zero (or negative) debit.
+        return await _credit(cursor, currency, user_id, -amount)
+    return result[0] if result else None
+
+# Sort currency -> (table holding that balance, the other table, its result column, the other's).
+_USER_SEARCH_SORTS = {
+    'ssc': ('users', 'grr_users', 'ssc_balance', 'grr_balance'),
+    'grr': ('grr_users', 'users', 'grr_balance', 'ssc_balance'),
+}
+
+class _PurchaseAborted(Exception):
+    """Raised inside purchase_item's transaction to roll back a reservation."""
+
+class SQLiteStorage(Storage):
+    """
+    The default engine: balances, the shop and config live in starstream.db and every
+    change goes through the connection manager's grouped write transactions.
+    """
+
+    def __init__(self, manager: ConnectionManager):
+        super().__init__()
+        self._manager = manager
+
+    # The connection manager is shared with the rest of database.py, which opens and closes it.
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def _balance_changed(self, currency: str, user_id: int, balance: int):
+        self._manager.after_commit(lambda: self.on_balance(currency, user_id, balance))
+
+    def _shop_changed(self, guild_id: int):
+        self._manager.after_commit(lambda: self.on_shop_change(guild_id))
+
+    async def export_state(self) -> Dict[str, Any]:
+        async with self._manager.read() as db:
+            async def rows(query: str) -> list:
+                async with db.execute(query) as cursor:
+                    return [tuple(row) for row in await cursor.fetchall()]
+            state = {
+                'balances': {
+                    currency: await rows(f"SELECT user_id, balance FROM {table}")
+                    for currency, table in _BALANCE_TABLES.items()
+                },
+                'last_daily': await rows("SELECT user_id, last_daily FROM grr_users WHERE last_daily IS NOT NULL"),
+                'config': dict(await rows("SELECT key, value FROM config")),
+            }
+            async with db.execute("SELECT * FROM shop_items") as cursor:
+                state['items'] = [dict(row) for row in await cursor.fetchall()]
+        return state
+
+    # --- Balances ---
+    async def get_balance(self, currency: str, user_id: int) -> int:
+        async with self._manager.read() as db:
+            async with db.execute(f"SELECT balance FROM {_BALANCE_TABLES[currency]} WHERE user_id = ?", (user_id,)) as cursor:
+                result = await cursor.fetchone()
+        return result[0] if result else 0
+
+    async def all_balances(self, currency: str) -> List[Tuple[int, int]]:
+        async with self._manager.read() as db:
+            async with db.execute(f"SELECT user_id, balance FROM {_BALANCE_TABLES[currency]}") as cursor:
+                # Plain tuples are noticeably cheaper than Rows at this volume.
+                cursor.row_factory = None
+                return await cursor.fetchall()
+
+    async def all_accounts(self) -> List[Dict[str, Any]]:
+        async with self._manager.read() as db:
+            query = """
+            SELECT
+                uid.user_id,
+                COALESCE(u.balance, 0) as ssc_balance,
+                COALESCE(g.balance, 0) as grr_balance
+            FROM (
+                SELECT user_id FROM users
+                UNION
+                SELECT user_id FROM grr_users
+            ) as uid
+            LEFT JOIN users u ON uid.user_id = u.user_id
+            LEFT JOIN grr_users g ON uid.user_id = g.user_id
+            ORDER BY ssc_balance DESC, grr_balance DESC;
+            """
+            async with db.execute(query) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def list_account_ids(self, after_user_id: int, limit: int) -> List[int]:
+        async with self._manager.read() as db:
+            async with db.execute(
+                """
+                SELECT user_id FROM (SELECT user_id FROM users UNION SELECT user_id FROM grr_users)
+                WHERE user_id > ? ORDER BY user_id LIMIT ?
+                """,
+                (after_user_id, limit)
+            ) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def search_accounts(self, sort: str, cursor: Optional[str], limit: int,
+                              user_ids: Optional[List[int]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        primary, other, primary_col, other_col = _USER_SEARCH_SORTS[sort]
+        phase, after_balance, after_id = decode_search_cursor(cursor)
+
+        async with self._manager.read() as db:
+            if user_ids is not None:
+                # Matches are a small set: order them by balance with a keyset.
+                keyset = "AND (sort_balance, m.user_id) < (?, ?)" if phase == 'q' else ""
+                sql = f"""
+                    SELECT m.user_id,
+                           COALESCE(p.balance, 0) AS {primary_col},
+                           COALESCE(o.balance, 0) AS {other_col},
+                           COALESCE(p.balance, 0) AS sort_balance
+                    FROM (SELECT DISTINCT value AS user_id FROM json_each(?)) AS m
+                    LEFT JOIN {primary} p ON p.user_id = m.user_id
+                    LEFT JOIN {other} o ON o.user_id = m.user_id
+                    WHERE (p.user_id IS NOT NULL OR o.user_id IS NOT NULL) {keyset}
+                    ORDER BY sort_balance DESC, m.user_id DESC
+                    LIMIT ?
+                """
+                params = [json.dumps(user_ids)] + ([after_balance, after_id] if phase == 'q' else []) + [limit]
+                async with db.execute(sql, params) as cur:
+                    rows = [dict(row) for row in await cur.fetchall()]
+                next_cursor = encode_search_cursor('q', rows[-1]['sort_balance'], rows[-1]['user_id']) if len(rows) == limit else None
+                for row in rows:
+                    del row['sort_balance']
+                return rows, next_cursor
+
+            rows: List[Dict[str, Any]] = []
+            if phase == 'a':
+                # Phase a walks the sorted table's balance index...
+                keyset = "WHERE (p.balance, p.user_id) < (?, ?)" if after_id is not None else ""
+                async with db.execute(
+                    f"""
+                    SELECT p.user_id, p.balance AS {primary_col}, COALESCE(o.balance, 0) AS {other_col}
+                    FROM {primary} p LEFT JOIN {other} o ON o.user_id = p.user_id
+                    {keyset}
+                    ORDER BY p.balance DESC, p.user_id DESC
+                    LIMIT ?
+                    """,
+                    ([after_balance, after_id] if after_id is not None else []) + [limit]
+                ) as cur:
+                    rows = [dict(row) for row in await cur.fetchall()]
+                if len(rows) == limit:
+                    return rows, encode_search_cursor('a', rows[-1][primary_col], rows[-1]['user_id'])
+                phase, after_id = 'b', None
+
+            # ...then phase b lists accounts that only exist in the other table (balance 0 here).
+            remaining = limit - len(rows)
+            keyset = "AND o.user_id < ?" if after_id is not None else ""
+            async with db.execute(
+                f"""
+                SELECT o.user_id, 0 AS {primary_col}, o.balance AS {other_col}
+                FROM {other} o
+                WHERE NOT EXISTS (SELECT 1 FROM {primary} p WHERE p.user_id = o.user_id) {keyset}
+                ORDER BY o.user_id DESC
+                LIMIT ?
+                """,
+                ([after_id] if after_id is not None else []) + [remaining]
+            ) as cur:
+                orphans = [dict(row) for row in await cur.fetchall()]
+            rows.extend(orphans)
+            next_cursor = encode_search_cursor('b', 0, orphans[-1]['user_id']) if orphans and len(orphans) == remaining else None
+            return rows, next_cursor
+
+    async def credit(self, currency: str, user_id: int, amount: int) -> int:
+        async with self._manager.write() as db:
+            async with db.cursor() as cursor:
+                balance = await _credit(cursor, currency, user_id, amount)
+                self._balance_changed(currency, user_id, balance)
+        return balance
+
+    async def transfer(self, currency: str, sender_id: int, recipient_id: int, amount: int) -> bool:
+        async with self._manager.write() as db:
+            async with db.cursor() as cursor:
+                sender_balance = await _debit(cursor, currency, sender_id, amount)
+                if sender_balance is None:
+                    return False
+                self._balance_changed(currency, sender_id, sender_balance)
+                self._balance_changed(currency, recipient_id, await _credit(cursor, currency, recipient_id, amount))
+            return True
+
+    async def settle_wager(self, user_id: int, stake: int, payout: int) -> Optional[int]:
+        async with self._manager.write() as db:
+            async with db.execute(
+                "UPDATE grr_users SET balance = balance - ? + ? WHERE user_id = ? AND balance >= ? RETURNING balance",
+                (stake, payout, user_id, stake)
+            ) as cursor:
+                result = await cursor.fetchall()
+            if result:
+                self._balance_changed('grr', user_id, result[0][0])
+        return result[0][0] if result else None
+
+    async def exchange(self, user_id: int, grr_cost: int, ssc_reward: int) -> bool:
+        async with self._manager.write() as db:
+            async with db.cursor() as cursor:
+                grr_balance = await _debit(cursor, 'grr', user_id, grr_cost)
+                if grr_balance is None:
+                    return False
+                self._balance_changed('grr', user_id, grr_balance)
+                self._balance_changed('ssc', user_id, await _credit(cursor, 'ssc', user_id, ssc_reward))
+            return True
+
+    async def set_balances(self, rows: List[Tuple[int, int, int]]):
+        async with self._manager.write() as db:
+            await db.executemany(
+                """
+                INSERT INTO users (user_id, balance) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance
+                """,
+                [(user_id, ssc) for user_id, ssc, _ in rows]
             )
-        ''')
-        # --- Config table ---
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS config (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
+            await db.executemany(
+                """
+                INSERT INTO grr_users (user_id, balance, last_daily) VALUES (?, ?, NULL)
+                ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance
+                """,
+                [(user_id, grr) for user_id, _, grr in rows]
             )
-        ''')
-        await db.commit()
-    print("Database connection established and tables (users, shop_items, grr_users, config) verified.")
+            for user_id, ssc, grr in rows:
+                self._balance_changed('ssc', user_id, ssc)
+                self._balance_changed('grr', user_id, grr)
 
-# --- USER & CURRENCY FUNCTIONS (Combined & Refined) ---
+    async def prune_empty(self, today: str, batch_size: int) -> int:
+        # Each batch is its own short transaction.
+        queries = (
+            ('ssc', "DELETE FROM users WHERE user_id IN (SELECT user_id FROM users WHERE balance = 0 LIMIT ?) RETURNING user_id",
+             (batch_size,)),
+            ('grr', "DELETE FROM grr_users WHERE user_id IN (SELECT user_id FROM grr_users WHERE balance = 0"
+             " AND (last_daily IS NULL OR last_daily < ?) LIMIT ?) RETURNING user_id",
+             (today, batch_size)),
+        )
+        removed = 0
+        for currency, query, params in queries:
+            while True:
+                async with self._manager.write() as db:
+                    async with db.execute(query, params) as cursor:
+                        user_ids = [row[0] for row in await cursor.fetchall()]
+                    self._manager.after_commit(lambda currency=currency, user_ids=user_ids: self.on_accounts_removed(currency, user_ids))
+                removed += len(user_ids)
+                if len(user_ids) < batch_size:
+                    break
+        return removed
 
-async def _get_or_create_user(cursor, user_id: int):
-    """Ensures a user exists in the 'users' (SSC) table, creating them if not."""
-    await cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-    if await cursor.fetchone() is None:
-        await cursor.execute("INSERT INTO users (user_id, balance) VALUES (?, 0)", (user_id,))
+    # --- Daily claims ---
+    async def claim_daily(self, user_id: int, amount: int, today: str) -> bool:
+        async with self._manager.write() as db:
+            # The DO UPDATE is skipped (and nothing returned) if today's claim was already made.
+            async with db.execute(
+                """
+                INSERT INTO grr_users (user_id, balance, last_daily) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance, last_daily = excluded.last_daily
+                WHERE last_daily IS NOT excluded.last_daily
+                RETURNING balance
+                """,
+                (user_id, amount, today)
+            ) as cursor:
+                result = await cursor.fetchall()
+            if not result:
+                return False
+            self._balance_changed('grr', user_id, result[0][0])
+            return True
+
+    # --- Shop ---
+    async def get_shop_items(self, guild_id: int) -> List[Dict[str, Any]]:
+        async with self._manager.read() as db:
+            async with db.execute("SELECT * FROM shop_items WHERE guild_id = ?", (guild_id,)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def add_shop_item(self, guild_id: int, name: str, cost: int, role_id: int,
+                            image_url: Optional[str], one_time_buy: bool) -> bool:
+        try:
+            async with self._manager.write() as db:
+                await db.execute(
+                    "INSERT INTO shop_items (guild_id, name, cost, role_id, image_url, is_one_time_buy) VALUES (?, ?, ?, ?, ?, ?)",
+                    (guild_id, name, cost, role_id, image_url, one_time_buy)
+                )
+                self._shop_changed(guild_id)
+            return True
+        except aiosqlite.IntegrityError:
+            return False
+
+    async def update_shop_item(self, item_id: int, fields: Dict[str, Any]):
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        try:
+            async with self._manager.write() as db:
+                async with db.execute(
+                    f"UPDATE shop_items SET {assignments} WHERE item_id = ? RETURNING guild_id", (*fields.values(), item_id)
+                ) as cursor:
+                    for row in await cursor.fetchall():
+                        self._shop_changed(row['guild_id'])
+        except aiosqlite.IntegrityError:
+            raise ValueError(f"An item named '{fields.get('name')}' already exists.")
+
+    async def mark_item_as_purchased(self, item_id: int, user_id: int):
+        async with self._manager.write() as db:
+            async with db.execute(
+                "UPDATE shop_items SET purchased_by_user_id = ? WHERE item_id = ? RETURNING guild_id", (user_id, item_id)
+            ) as cursor:
+                for row in await cursor.fetchall():
+                    self._shop_changed(row['guild_id'])
+
+    async def purchase_item(self, guild_id: int, name: str, user_id: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+        item = None
+        try:
+            async with self._manager.write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute("SELECT * FROM shop_items WHERE guild_id = ? AND name = ?", (guild_id, name))
+                    row = await cursor.fetchone()
+                    if row is None:
+                        return "not_found", None
+                    item = dict(row)
+
+                    if item['is_one_time_buy']:
+                        await cursor.execute(
+                            "UPDATE shop_items SET purchased_by_user_id = ? WHERE item_id = ? AND purchased_by_user_id IS NULL",
+                            (user_id, item['item_id'])
+                        )
+                        if cursor.rowcount == 0:
+                            return "already_claimed", item
+                        item['purchased_by_user_id'] = user_id
+                        self._shop_changed(guild_id)
+
+                    balance = await _debit(cursor, 'ssc', user_id, item['cost'])
+                    if balance is None:
+                        raise _PurchaseAborted()
+                    self._balance_changed('ssc', user_id, balance)
+                    return "success", item
+        except _PurchaseAborted:
+            item['purchased_by_user_id'] = None
+            return "insufficient_funds", item
+
+    async def release_purchase(self, item: Dict[str, Any], user_id: int):
+        async with self._manager.write() as db:
+            async with db.cursor() as cursor:
+                self._balance_changed('ssc', user_id, await _credit(cursor, 'ssc', user_id, item['cost']))
+                if item['is_one_time_buy']:
+                    await cursor.execute(
+                        "UPDATE shop_items SET purchased_by_user_id = NULL WHERE item_id = ? AND purchased_by_user_id = ?",
+                        (item['item_id'], user_id)
+                    )
+                    self._shop_changed(item['guild_id'])
+
+    async def remove_shop_item(self, guild_id: int, name: str) -> bool:
+        async with self._manager.write() as db:
+            async with db.cursor() as cursor:
+                await cursor.execute("DELETE FROM shop_items WHERE guild_id = ? AND name = ?", (guild_id, name))
+                if cursor.rowcount > 0:
+                    self._shop_changed(guild_id)
+                return cursor.rowcount > 0
+
+    async def delete_shop_item(self, item_id: int):
+        async with self._manager.write() as db:
+            async with db.execute("DELETE FROM shop_items WHERE item_id = ? RETURNING guild_id", (item_id,)) as cursor:
+                for row in await cursor.fetchall():
+                    self._shop_changed(row['guild_id'])
 
-async def _get_or_create_grr_user(cursor, user_id: int):
-    """Ensures a user exists in the 'grr_users' table, creating them if not."""
-    await cursor.execute("SELECT 1 FROM grr_users WHERE user_id = ?", (user_id,))
-    if await cursor.fetchone() is None:
-        await cursor.execute("INSERT INTO grr_users (user_id, balance, last_daily) VALUES (?, 0, NULL)", (user_id,))
+    # --- Config ---
+    async def get_config(self) -> Dict[str, str]:
+        async with self._manager.read() as db:
+            async with db.execute("SELECT key, value FROM config") as cursor:
+                return {row['key']: row['value'] for row in await cursor.fetchall()}
+
+    async def set_config(self, values: Dict[str, str]):
+        async with self._manager.write() as db:
+            await db.executemany("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", list(values.items()))
+            self._manager.after_commit(lambda: self.on_config_change(values))
+
+# --- USER & CURRENCY FUNCTIONS (Combined & Refined) ---
+
+async def _get_balance(currency: str, cache: BalanceCache, user_id: int) -> int:
+    balance = cache.get(user_id)
+    if balance is not None:
+        if BALANCE_CACHE_CHECK:
+            stored = await _store().get_balance(currency, user_id)
+            if stored != balance:
+                print(f"ERROR: Balance cache for {currency} says {balance} for {user_id}, storage says {stored}.")
+                cache.discard(user_id)
+                return stored
+        return balance
+    write_count = cache.write_count
+    balance = await _store().get_balance(currency, user_id)
+    cache.fill(user_id, balance, write_count)
+    return balance
 
 async def get_balance(user_id: int) -> int:
-    """Gets a user's SSC balance."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.cursor() as cursor:
-            await _get_or_create_user(cursor, user_id)
-            await cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+    """Gets a user's SSC balance (0 if they have no account)."""
+    return await _get_balance('ssc', ssc_balances, user_id)
 
 async def add_coins(user_id: int, amount: int):
     """Adds or removes SSC coins from a user's balance."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.cursor() as cursor:
-            await _get_or_create_user(cursor, user_id)
-            await cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
-        await db.commit()
+    await _store().credit('ssc', user_id, amount)
 
 async def transfer_coins(sender_id: int, recipient_id: int, amount: int) -> bool:
     """Atomically transfers SSC coins from one user to another."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        sender_balance = await get_balance(sender_id)
-        if sender_balance < amount:
-            return False
-        async with db.cursor() as cursor:
-            await _get_or_create_user(cursor, recipient_id)
-            await cursor.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (amount, sender_id))
-            await cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, recipient_id))
-        await db.commit()
-        return True
+    return await _store().transfer('ssc', sender_id, recipient_id, amount)
 
 async def get_grr_balance(user_id: int) -> int:
-    """Gets a user's GRR balance."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.cursor() as cursor:
-            await _get_or_create_grr_user(cursor, user_id)
-            await cursor.execute("SELECT balance FROM grr_users WHERE user_id = ?", (user_id,))
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+    """Gets a user's GRR balance (0 if they have no account)."""
+    return await _get_balance('grr', grr_balances, user_id)
 
 async def add_grr_coins(user_id: int, amount: int):
     """Adds or removes GRR coins from a user's balance."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.cursor() as cursor:
-            await _get_or_create_grr_user(cursor, user_id)
-            await cursor.execute("UPDATE grr_users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
-        await db.commit()
+    await _store().credit('grr', user_id, amount)
 
 async def transfer_grr_coins(sender_id: int, recipient_id: int, amount: int) -> bool:
     """Atomically transfers GRR coins from one user to another."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        sender_balance = await get_grr_balance(sender_id)
-        if sender_balance < amount:
-            return False
-        async with db.cursor() as cursor:
-            await _get_or_create_grr_user(cursor, recipient_id)
-            await cursor.execute("UPDATE grr_users SET balance = balance - ? WHERE user_id = ?", (amount, sender_id))
-            await cursor.execute("UPDATE grr_users SET balance = balance + ? WHERE user_id = ?", (amount, recipient_id))
-        await db.commit()
-        return True
+    return await _store().transfer('grr', sender_id, recipient_id, amount)
+
+async def settle_grr_wager(user_id: int, stake: int, payout: int) -> Optional[int]:
+    """
+    Debits a GRR stake and credits its payout in a single atomic change.
+    Returns the new balance, or None if the user's balance doesn't cover the stake.
+    """
+    return await _store().settle_wager(user_id, stake, payout)
 
 async def get_leaderboard(limit: int = 10) -> List[Dict[str, Any]]:
     """Gets the top N users by SSC balance."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT user_id, balance FROM users ORDER BY balance DESC LIMIT ?", (limit,)) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+    return ssc_leaderboard.page(0, limit)
 
 async def get_grr_leaderboard(limit: int = 10) -> List[Dict[str, Any]]:
     """Gets the top N users by GRR balance."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT user_id, balance FROM grr_users WHERE balance > 0 ORDER BY balance DESC LIMIT ?", (limit,)) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+    return grr_leaderboard.page(0, limit)
+
+async def get_leaderboard_page(page: int, page_size: int = 10) -> Tuple[List[Dict[str, Any]], int]:
+    """Gets one 1-based page of the SSC leaderboard, plus the total number of ranked users."""
+    return ssc_leaderboard.page((max(page, 1) - 1) * page_size, page_size), len(ssc_leaderboard)
+
+async def get_grr_leaderboard_page(page: int, page_size: int = 10) -> Tuple[List[Dict[str, Any]], int]:
+    """Gets one 1-based page of the GRR leaderboard, plus the total number of ranked users."""
+    return grr_leaderboard.page((max(page, 1) - 1) * page_size, page_size), len(grr_leaderboard)
+
+async def get_rank(user_id: int) -> Optional[int]:
+    """Gets a user's 1-based SSC rank, or None if they have no account."""
+    return ssc_leaderboard.rank(user_id)
+
+async def get_grr_rank(user_id: int) -> Optional[int]:
+    """Gets a user's 1-based GRR rank, or None if they hold no GRR."""
+    return grr_leaderboard.rank(user_id)
 
 async def get_all_users_combined() -> List[Dict[str, Any]]:
     """Gets all users from both currency systems, providing a comprehensive view."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        db.row_factory = aiosqlite.Row
-        query = """
-        SELECT
-            uid.user_id,
-            COALESCE(u.balance, 0) as ssc_balance,
-            COALESCE(g.balance, 0) as grr_balance
-        FROM (
-            SELECT user_id FROM users
-            UNION
-            SELECT user_id FROM grr_users
-        ) as uid
-        LEFT JOIN users u ON uid.user_id = u.user_id
-        LEFT JOIN grr_users g ON uid.user_id = g.user_id
-        ORDER BY ssc_balance DESC, grr_balance DESC;
-        """
-        async with db.execute(query) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+    return await _store().all_accounts()
 
 async def update_user_balances(user_id: int, ssc_balance: int, grr_balance: int):
     """Sets the balances for a user across both systems."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO users (user_id, balance) VALUES (?, ?)",
-            (user_id, ssc_balance)
-        )
-        await db.execute(
-            """
-            INSERT INTO grr_users (user_id, balance, last_daily) VALUES (?, ?, NULL)
-            ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance
-            """,
-            (user_id, grr_balance)
-        )
-        await db.commit()
+    await update_user_balances_bulk([{'user_id': user_id, 'ssc': ssc_balance, 'grr': grr_balance}])
+
+async def update_user_balances_bulk(updates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Sets SSC and GRR balances for many users in a single transaction.
+    Each update is a dict with 'user_id', 'ssc' and 'grr'. Returns one result per update,
+    in order; malformed updates are reported and skipped without affecting the rest.
+    """
+    results = []
+    rows = []
+    for update in updates:
+        try:
+            row = (int(update['user_id']), int(update['ssc']), int(update['grr']))
+        except (KeyError, TypeError, ValueError) as e:
+            user_id = update.get('user_id') if isinstance(update, dict) else None
+            results.append({'user_id': user_id, 'status': 'error', 'message': f"Invalid update: {e!r}"})
+            continue
+        rows.append(row)
+        results.append({'user_id': row[0], 'status': 'success'})
+
+    if rows:
+        await _store().set_balances(rows)
+    return results
+
+async def verify_balance_caches() -> List[Dict[str, Any]]:
+    """Compares every cached balance with storage. Returns one entry per mismatch."""
+    mismatches = []
+    for currency, cache in (('ssc', ssc_balances), ('grr', grr_balances)):
+        for user_id, cached in cache.items().items():
+            stored = await _store().get_balance(currency, user_id)
+            if stored != cached:
+                mismatches.append({'currency': currency, 'user_id': user_id, 'cached': cached, 'stored': stored})
+    return mismatches
+
+PRUNE_BATCH_SIZE = 500
+
+async def prune_empty_accounts(batch_size: int = PRUNE_BATCH_SIZE) -> int:
+    """
+    Deletes zero-balance accounts in batches, each in its own short transaction.
+    GRR accounts that claimed today's daily are kept so the claim still counts.
+    Returns how many accounts were removed.
+    """
+    return await _store().prune_empty(str(date.today()), batch_size)
 
 async def claim_daily_grr(user_id: int, amount_to_add: int) -> str:
     """
     Grants a user their daily GRR coins.
     Returns: "success" or "already_claimed".
     """
-    today_str = str(date.today())
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.cursor() as cursor:
-            await _get_or_create_grr_user(cursor, user_id)
-            await cursor.execute("SELECT last_daily FROM grr_users WHERE user_id = ?", (user_id,))
-            result = await cursor.fetchone()
-            last_claim_date = result[0] if result else None
-
-            if last_claim_date == today_str:
-                return "already_claimed"
-
-            await cursor.execute(
-                "UPDATE grr_users SET balance = balance + ?, last_daily = ? WHERE user_id = ?",
-                (amount_to_add, today_str, user_id)
-            )
-            await db.commit()
-            return "success"
+    if await _store().claim_daily(user_id, amount_to_add, str(date.today())):
+        return "success"
+    return "already_claimed"
 
 async def perform_grr_ssc_exchange(user_id: int, grr_cost: int, ssc_reward: int) -> bool:
     """
     Atomically exchanges a specified amount of GRR for SSC.
     Returns True on success, False on failure (e.g., insufficient funds).
     """
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.cursor() as cursor:
-            # Get current GRR balance
-            await _get_or_create_grr_user(cursor, user_id)
-            await cursor.execute("SELECT balance FROM grr_users WHERE user_id = ?", (user_id,))
-            result = await cursor.fetchone()
-            current_grr_balance = result[0] if result else 0
-
-            if current_grr_balance < grr_cost:
-                return False
+    return await _store().exchange(user_id, grr_cost, ssc_reward)
+
+# --- USER NAME CACHE ---
 
-            # Ensure user exists in SSC table before adding to them
-            await _get_or_create_user(cursor, user_id)
+# Stays well under SQLite's bound-parameter limit.
+_IN_CHUNK_SIZE = 500
 
-            # Perform the exchange
-            await cursor.execute("UPDATE grr_users SET balance = balance - ? WHERE user_id = ?", (grr_cost, user_id))
-            await cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (ssc_reward, user_id))
+async def get_user_names(user_ids: List[int], max_age: Optional[float] = None) -> Dict[int, Dict[str, Any]]:
+    """Gets persisted Discord names for the given users, skipping rows older than max_age seconds."""
+    min_updated_at = time.time() - max_age if max_age is not None else 0
+    names = {}
+    async with _db().read() as db:
+        for i in range(0, len(user_ids), _IN_CHUNK_SIZE):
+            chunk = user_ids[i:i + _IN_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            async with db.execute(
+                f"SELECT * FROM user_names WHERE user_id IN ({placeholders}) AND updated_at >= ?",
+                (*chunk, min_updated_at)
+            ) as cursor:
+                for row in await cursor.fetchall():
+                    names[row['user_id']] = dict(row)
+    return names
 
-        await db.commit()
-        return True
+# Keep user_search in step with user_names.
+_USER_SEARCH_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS user_names_ai AFTER INSERT ON user_names BEGIN
+        INSERT INTO user_search (rowid, user_id, name, display_name) VALUES (new.user_id, new.user_id, new.name, new.display_name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS user_names_ad AFTER DELETE ON user_names BEGIN
+        INSERT INTO user_search (user_search, rowid, user_id, name, display_name) VALUES ('delete', old.user_id, old.user_id, old.name, old.display_name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS user_names_au AFTER UPDATE ON user_names BEGIN
+        INSERT INTO user_search (user_search, rowid, user_id, name, display_name) VALUES ('delete', old.user_id, old.user_id, old.name, old.display_name);
+        INSERT INTO user_search (rowid, user_id, name, display_name) VALUES (new.user_id, new.user_id, new.name, new.display_name);
+    END''',
+)
+
+async def _create_user_search_index(db: aiosqlite.Connection):
+    """Creates the trigram FTS5 index over user_names, falling back to LIKE scans if FTS5 is unavailable."""
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'user_search'") as cursor:
+        exists = await cursor.fetchone() is not None
+    try:
+        await db.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+                user_id, name, display_name,
+                content='user_names', content_rowid='user_id', tokenize='trigram'
+            )
+        ''')
+    except aiosqlite.OperationalError as e:
+        print(f"WARNING: FTS5 trigram index unavailable, user search will scan. {e}")
+        return
+    # One statement at a time: executescript would COMMIT the surrounding write transaction.
+    for trigger in _USER_SEARCH_TRIGGERS:
+        await db.execute(trigger)
+    if not exists:
+        await db.execute("INSERT INTO user_search (user_search) VALUES ('rebuild')")
+
+async def _detect_user_search_index(db: aiosqlite.Connection):
+    """Picks FTS or LIKE search depending on whether the index was created."""
+    global _user_search_fts
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'user_search'") as cursor:
+        _user_search_fts = await cursor.fetchone() is not None
+
+async def get_user_ids_missing_names(after_user_id: int = 0, limit: int = 100) -> List[int]:
+    """Gets account IDs (ascending, after the given ID) that have no persisted name yet."""
+    missing: List[int] = []
+    while len(missing) < limit:
+        # Accounts live in the storage engine, names in SQLite, so filter a batch at a time.
+        user_ids = await _store().list_account_ids(after_user_id, _IN_CHUNK_SIZE)
+        if not user_ids:
+            break
+        named = await get_user_names(user_ids)
+        missing.extend(user_id for user_id in user_ids if user_id not in named)
+        after_user_id = user_ids[-1]
+    return missing[:limit]
+
+async def store_user_names(rows: List[Dict[str, Any]]):
+    """Persists resolved Discord names (dicts with user_id, name, discriminator, display_name)."""
+    now = time.time()
+    async with _db().write() as db:
+        await db.executemany(
+            """
+            INSERT INTO user_names (user_id, name, discriminator, display_name, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                name = excluded.name, discriminator = excluded.discriminator,
+                display_name = excluded.display_name, updated_at = excluded.updated_at
+            """,
+            [(r['user_id'], r['name'], r['discriminator'], r['display_name'], now) for r in rows]
+        )
+
+# --- ADMIN USER SEARCH ---
+
+# Set by init_db once it knows whether the FTS5 trigram index could be created.
+_user_search_fts = False
+# Trigram matching needs at least this many characters.
+_TRIGRAM_MIN_LENGTH = 3
+
+async def _match_user_ids(query: str) -> List[int]:
+    """IDs of users whose cached names contain `query`, plus the ID itself if it is one."""
+    if _user_search_fts and len(query) >= _TRIGRAM_MIN_LENGTH:
+        match_sql = "SELECT rowid AS user_id FROM user_search WHERE user_search MATCH ?"
+        match_params = ['"' + query.replace('"', '""') + '"']
+    else:
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        match_sql = "SELECT user_id FROM user_names WHERE name LIKE ? ESCAPE '\\' OR display_name LIKE ? ESCAPE '\\'"
+        match_params = [pattern, pattern]
+    async with _db().read() as db:
+        async with db.execute(match_sql, match_params) as cursor:
+            user_ids = [row[0] for row in await cursor.fetchall()]
+    if query.isdigit():
+        user_ids.append(int(query))
+    return user_ids
+
+async def search_users(query: str = "", sort: str = "ssc", cursor: Optional[str] = None, limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Gets one page of accounts for the admin panel, highest balance first.
+    `query` matches cached display names and user IDs. Pass the returned cursor back in to
+    get the next page; it is None once there are no more rows.
+    """
+    if sort not in _USER_SEARCH_SORTS:
+        raise ValueError(f"Invalid sort '{sort}'")
+    query = query.strip()
+    # Matches are a small set: collect them here, then let storage order them by balance.
+    user_ids = await _match_user_ids(query) if query else None
+    return await _store().search_accounts(sort, cursor, limit, user_ids=user_ids)
+
+# --- PENDING ADMIN LOGS ---
+
+async def add_pending_logs(payloads: List[str]) -> List[int]:
+    """Persists serialized log embeds awaiting delivery. Returns their IDs in order."""
+    now = time.time()
+    log_ids = []
+    async with _db().write() as db:
+        for payload in payloads:
+            async with db.execute(
+                "INSERT INTO pending_logs (payload, created_at) VALUES (?, ?) RETURNING log_id", (payload, now)
+            ) as cursor:
+                log_ids.append((await cursor.fetchone())[0])
+    return log_ids
+
+async def get_pending_logs(limit: int = 1000) -> List[Dict[str, Any]]:
+    """Gets undelivered log embeds, oldest first."""
+    async with _db().read() as db:
+        async with db.execute("SELECT log_id, payload FROM pending_logs ORDER BY log_id LIMIT ?", (limit,)) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+async def delete_pending_logs(log_ids: List[int]):
+    """Forgets log embeds once they have been delivered."""
+    async with _db().write() as db:
+        await db.executemany("DELETE FROM pending_logs WHERE log_id = ?", [(log_id,) for log_id in log_ids])
 
 # --- SHOP FUNCTIONS (Combined & Refined) ---
 
+# Per-guild catalogs, built on first use and dropped after any write to that guild's items.
+_shop_catalogs: Dict[int, ShopCatalog] = {}
+# Bumped on every invalidation so a load that raced a write doesn't cache stale rows.
+_shop_generations: Dict[int, int] = {}
+
+async def _shop_catalog(guild_id: int) -> ShopCatalog:
+    catalog = _shop_catalogs.get(guild_id)
+    if catalog is None:
+        generation = _shop_generations.get(guild_id, 0)
+        catalog = ShopCatalog(await _store().get_shop_items(guild_id))
+        if _shop_generations.get(guild_id, 0) == generation:
+            _shop_catalogs[guild_id] = catalog
+    return catalog
+
 async def add_shop_item(guild_id: int, name: str, cost: int, role_id: int, image_url: Optional[str], one_time_buy: bool) -> bool:
     """Adds a new item to the shop. Returns False if an item with the same name already exists."""
-    try:
-        async with aiosqlite.connect(DB_FILE) as db:
-            await db.execute(
-                "INSERT INTO shop_items (guild_id, name, cost, role_id, image_url, is_one_time_buy) VALUES (?, ?, ?, ?, ?, ?)",
-                (guild_id, name, cost, role_id, image_url, one_time_buy)
-            )
-            await db.commit()
-        return True
-    except aiosqlite.IntegrityError:
-        return False
+    return await _store().add_shop_item(guild_id, name, cost, role_id, image_url, one_time_buy)
 
 async def get_shop_item(guild_id: int, name: str) -> Optional[Dict[str, Any]]:
     """Retrieves a single shop item by name for a specific guild."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM shop_items WHERE guild_id = ? AND name = ?", (guild_id, name)) as cursor:
-            result = await cursor.fetchone()
-            return dict(result) if result else None
+    return (await _shop_catalog(guild_id)).get(name)
 
 async def get_all_shop_items(guild_id: int) -> List[Dict[str, Any]]:
     """Retrieves all shop items for a guild, ordered by cost."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM shop_items WHERE guild_id = ? ORDER BY cost ASC", (guild_id,)) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+    return (await _shop_catalog(guild_id)).all()
+
+async def search_shop_item_names(guild_id: int, prefix: str, limit: int = 25) -> List[str]:
+    """Returns shop item names starting with `prefix`, for autocomplete."""
+    return (await _shop_catalog(guild_id)).names_starting_with(prefix, limit)
 
 async def update_shop_item(item_id: int, updates: Dict[str, Any]):
-    """Updates specific fields of a shop item by its ID."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        fields = []
-        values = []
-        # Allow only a specific set of fields to be updated
-        for key, value in updates.items():
-            if key in ['name', 'cost', 'role_id', 'image_url', 'is_one_time_buy']:
-                fields.append(f"{key} = ?")
-                values.append(value)
-
-        if not fields:
-            return
-
-        values.append(item_id)
-        query = f"UPDATE shop_items SET {', '.join(fields)} WHERE item_id = ?"
-        await db.execute(query, tuple(values))
-        await db.commit()
+    """
+    Updates specific fields of a shop item by its ID. Unknown fields are ignored.
+    Raises ValueError if a field can't be converted or the new name is taken.
+    """
+    # Allow only a specific set of fields to be updated, stored as the same types whichever engine holds them.
+    fields = {key: SHOP_ITEM_FIELDS[key](value) for key, value in updates.items() if key in SHOP_ITEM_FIELDS}
+    if fields:
+        await _store().update_shop_item(item_id, fields)
 
 async def mark_item_as_purchased(item_id: int, user_id: int):
     """Marks a one-time-buy item as sold to a specific user."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("UPDATE shop_items SET purchased_by_user_id = ? WHERE item_id = ?", (user_id, item_id))
-        await db.commit()
+    await _store().mark_item_as_purchased(item_id, user_id)
+
+async def purchase_item(guild_id: int, name: str, user_id: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Charges a user for a shop item in one atomic change. One-time items are reserved for
+    the buyer at the same time; call release_purchase if the purchase can't be fulfilled.
+    Returns: (status, item) where status is "success", "not_found", "already_claimed" or
+    "insufficient_funds".
+    """
+    return await _store().purchase_item(guild_id, name, user_id)
+
+async def release_purchase(item: Dict[str, Any], user_id: int):
+    """Refunds a purchase made with purchase_item and frees a reserved one-time item."""
+    await _store().release_purchase(item, user_id)
 
 async def remove_shop_item(guild_id: int, name: str) -> bool:
     """Removes an item from the shop by name. Returns True if an item was deleted."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.cursor() as cursor:
-            await cursor.execute("DELETE FROM shop_items WHERE guild_id = ? AND name = ?", (guild_id, name))
-            await db.commit()
-            return cursor.rowcount > 0
+    return await _store().remove_shop_item(guild_id, name)
 
 async def delete_shop_item(item_id: int):
     """Deletes a shop item by its primary key (item_id)."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("DELETE FROM shop_items WHERE item_id = ?", (item_id,))
-        await db.commit()
+    await _store().delete_shop_item(item_id)
 
 # --- CONFIG FUNCTIONS (Combined & Refined) ---
 
+# Payout multipliers for `grr slots`, keyed by the suffix of their 'slots_multiplier_*' config key.
+SLOTS_MULTIPLIER_DEFAULTS = {
+    "2_of_a_kind": 2,
+    "cherry": 5, "grape": 5, "orange": 5,
+    "lemon": 8, "bell": 8, "diamond": 15,
+    "clover": 25, "moneybag": 50,
+}
+
+# The config table is tiny and read on every game, so the whole thing lives in memory.
+# It is loaded by init_db and kept current by _on_config_change.
+_config_cache: Dict[str, str] = {}
+# Parsed values keyed by (key, type); cleared whenever the config changes.
+_parsed_config: Dict[Tuple[str, str], Any] = {}
+
+def _load_config_cache(values: Dict[str, str]):
+    _config_cache.clear()
+    _config_cache.update(values)
+    _parsed_config.clear()
+
 async def set_config_value(key: str, value: str):
     """Sets or updates a key-value pair in the config table."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
-            (key, value)
-        )
-        await db.commit()
+    await set_config_values({key: value})
+
+async def set_config_values(values: Dict[str, str]):
+    """Sets several config values in one transaction and updates the in-memory cache."""
+    await _store().set_config(dict(values))
 
 async def get_config_value(key: str, default: Optional[str] = None) -> Optional[str]:
     """Gets a value from the config table, returning a default if not found."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute("SELECT value FROM config WHERE key = ?", (key,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else default
+    return _config_cache.get(key, default)
 
 async def get_all_configs() -> Dict[str, str]:
     """Gets all key-value pairs from the config table."""
-    async with aiosqlite.connect(DB_FILE) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT key, value FROM config") as cursor:
-            return {row['key']: row['value'] for row in await cursor.fetchall()}
\ No newline at end of file
+    return dict(_config_cache)
+
+def _get_parsed(key: str, kind: str, parse: Callable[[str], Any], default: Any) -> Any:
+    cache_key = (key, kind)
+    if cache_key in _parsed_config:
+        return _parsed_config[cache_key]
+    raw = _config_cache.get(key)
+    value = default if raw is None else parse(raw)
+    _parsed_config[cache_key] = value
+    return value
+
+def get_config_str(key: str, default: str) -> str:
+    """Reads a config value from memory."""
+    return _config_cache.get(key, default)
+
+def get_config_int(key: str, default: int) -> int:
+    """Reads a config value from memory as an int. Raises ValueError if it isn't one."""
+    return _get_parsed(key, 'int', int, default)
+
+def get_config_float(key: str, default: float) -> float:
+    """Reads a config value from memory as a float. Raises ValueError if it isn't one."""
+    return _get_parsed(key, 'float', float, default)
+
+def get_config_bool(key: str, default: bool) -> bool:
+    """Reads a 'true'/'false' config value from memory."""
+    return _get_parsed(key, 'bool', lambda raw: raw == 'true', default)
+
+def get_slot_multipliers() -> Dict[str, int]:
+    """Returns the slot payout multipliers keyed like SLOTS_MULTIPLIER_DEFAULTS. Treat as read-only."""
+    cache_key = ('slots_multiplier_*', 'slots')
+    multipliers = _parsed_config.get(cache_key)
+    if multipliers is None:
+        multipliers = {
+            name: int(_config_cache.get(f'slots_multiplier_{name}', default))
+            for name, default in SLOTS_MULTIPLIER_DEFAULTS.items()
+        }
+        _parsed_config[cache_key] = multipliers
+    return multipliers
+
+# --- INSTRUMENTATION ---
+DB_CALL_SECONDS = metrics.Histogram(
+    "starstream_db_call_duration_seconds", "Time spent in each public database.py coroutine.", ["function"])
+DB_CALL_ERRORS = metrics.Counter(
+    "starstream_db_call_errors_total", "Public database.py coroutines that raised.", ["function"])
+
+def _timed(name: str, function):
+    # Bound once here so a call costs two perf_counter reads, an observe() and, outside a
+    # command's trace, one context variable read.
+    seconds = DB_CALL_SECONDS.labels(name)
+    errors = DB_CALL_ERRORS.labels(name)
+
+    span_name = f"db.{name}"
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with spans.span(span_name):
+                return await function(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - start)
+    return wrapper
+
+# Every public coroutine above is replaced with a timed one (and a span, inside a command's
+# trace). Calls between them go through the module globals too, so each function's time
+# includes the functions it calls.
+for _name, _function in list(globals().items()):
+    if not _name.startswith('_') and inspect.iscoroutinefunction(_function) and _function.__module__ == __name__:
+        globals()[_name] = _timed(_name, _function)
+del _name, _function
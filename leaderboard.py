@@ -0,0 +1,169 @@
+from bisect import bisect_left, insort
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+# Entries per block of a _BlockedList; a block splits at twice this and merges below half.
+BLOCK_SIZE = 512
+
+class _BlockedList:
+    """
+    A sorted list stored as sorted blocks of a few hundred entries, in the style of
+    sortedcontainers.SortedList. Inserts and deletes only shift one block, and a Fenwick
+    tree over the block lengths turns an entry into its position (and back) in O(log n),
+    so a board of hundreds of thousands of users never moves the whole list.
+    """
+
+    def __init__(self, items: Iterable[Tuple[int, int]] = ()):
+        self._build(sorted(items))
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _build(self, items: List[Tuple[int, int]]):
+        self._blocks = [items[i:i + BLOCK_SIZE] for i in range(0, len(items), BLOCK_SIZE)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(items)
+        self._index_blocks()
+
+    # --- Fenwick tree over block lengths ---
+    def _index_blocks(self):
+        """Rebuilds the tree in O(blocks); only needed when blocks split or merge."""
+        tree = [0] + [len(block) for block in self._blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _resize(self, block: int, delta: int):
+        i = block + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _count_before(self, block: int) -> int:
+        total, i = 0, block
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, position: int) -> Tuple[int, int]:
+        """Returns (block, offset within it) of the 0-based `position`."""
+        block, step = 0, 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            following = block + step
+            if following < len(self._tree) and self._tree[following] <= position:
+                position -= self._tree[following]
+                block = following
+            step >>= 1
+        return block, position
+
+    # --- Sorted list operations ---
+    def add(self, item: Tuple[int, int]):
+        if not self._blocks:
+            self._build([item])
+            return
+        b = min(bisect_left(self._maxes, item), len(self._blocks) - 1)
+        block = self._blocks[b]
+        insort(block, item)
+        self._maxes[b] = block[-1]
+        self._len += 1
+        if len(block) > 2 * BLOCK_SIZE:
+            self._blocks[b:b + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self._maxes[b:b + 1] = [self._blocks[b][-1], self._blocks[b + 1][-1]]
+            self._index_blocks()
+        else:
+            self._resize(b, 1)
+
+    def remove(self, item: Tuple[int, int]):
+        """Removes an item that is known to be in the list."""
+        b = bisect_left(self._maxes, item)
+        block = self._blocks[b]
+        del block[bisect_left(block, item)]
+        self._len -= 1
+        if len(block) >= BLOCK_SIZE // 2 or len(self._blocks) == 1:
+            if block:
+                self._maxes[b] = block[-1]
+                self._resize(b, -1)
+            else:
+                self._build([])
+            return
+        # Fold a small block into its neighbour so blocks don't dwindle to a few entries each.
+        if b == len(self._blocks) - 1:
+            b -= 1
+        merged = self._blocks[b] + self._blocks[b + 1]
+        if len(merged) > 2 * BLOCK_SIZE:
+            half = len(merged) // 2
+            self._blocks[b:b + 2] = [merged[:half], merged[half:]]
+            self._maxes[b:b + 2] = [merged[half - 1], merged[-1]]
+        else:
+            self._blocks[b:b + 2] = [merged]
+            self._maxes[b:b + 2] = [merged[-1]]
+        self._index_blocks()
+
+    def index(self, item: Tuple[int, int]) -> int:
+        """The 0-based position of an item that is known to be in the list."""
+        b = bisect_left(self._maxes, item)
+        return self._count_before(b) + bisect_left(self._blocks[b], item)
+
+    def slice(self, start: int, count: int) -> List[Tuple[int, int]]:
+        """Up to `count` items from the 0-based position `start`."""
+        if start >= self._len or count <= 0:
+            return []
+        b, offset = self._locate(start)
+        items: List[Tuple[int, int]] = []
+        while b < len(self._blocks) and len(items) < count:
+            items.extend(self._blocks[b][offset:offset + count - len(items)])
+            b, offset = b + 1, 0
+        return items
+
+class Leaderboard:
+    """
+    Every ranked user's balance, kept sorted in memory so that leaderboard pages and
+    rank lookups never scan the users tables. database.py loads it once in init_db and
+    updates it after each committed balance change.
+    """
+
+    def __init__(self, positive_only: bool = False):
+        # The GRR board only ranks users holding coins, matching the old `WHERE balance > 0`.
+        self.positive_only = positive_only
+        self._balances: Dict[int, int] = {}
+        # (-balance, user_id) in ascending order == richest first, ties by user ID.
+        self._order = _BlockedList()
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _is_ranked(self, balance: int) -> bool:
+        return balance > 0 if self.positive_only else True
+
+    def load(self, rows: Iterable[Tuple[int, int]]):
+        """Replaces the board's contents with (user_id, balance) rows."""
+        self._balances = {user_id: balance for user_id, balance in rows if self._is_ranked(balance)}
+        self._order = _BlockedList((-balance, user_id) for user_id, balance in self._balances.items())
+
+    def update(self, user_id: int, balance: int):
+        """Moves a user to their new balance's position."""
+        self.remove(user_id)
+        if self._is_ranked(balance):
+            self._balances[user_id] = balance
+            self._order.add((-balance, user_id))
+
+    def remove(self, user_id: int):
+        old_balance = self._balances.pop(user_id, None)
+        if old_balance is not None:
+            self._order.remove((-old_balance, user_id))
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Returns the user's 1-based rank in O(log n), or None if they aren't ranked."""
+        balance = self._balances.get(user_id)
+        if balance is None:
+            return None
+        return self._order.index((-balance, user_id)) + 1
+
+    def page(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        """Returns `limit` entries starting at the 0-based `offset`."""
+        return [
+            {'rank': offset + i + 1, 'user_id': user_id, 'balance': -neg_balance}
+            for i, (neg_balance, user_id) in enumerate(self._order.slice(offset, limit))
+        ]
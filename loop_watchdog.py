@@ -0,0 +1,157 @@
+"""
+Watches the event loop for stalls. The bot and the admin panel share one loop, so any
+synchronous work that runs too long delays gateway heartbeats for everything else.
+
+A task wakes every CHECK_INTERVAL seconds and measures how late it woke (the lag). A
+sampler thread watches that task's heartbeat, and while the loop is stuck it records
+what the loop thread is running. When the loop gets going again the stall is kept,
+with its most sampled stacks, and logged if it lasted STALL_LOG_THRESHOLD or longer.
+"""
+import asyncio
+import collections
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+CHECK_INTERVAL = 0.1
+# The lag chart gets one point per REPORT_INTERVAL: the worst and mean lag in it.
+REPORT_INTERVAL = 1.0
+# The sampler starts taking stacks once the loop is this late, every SAMPLE_INTERVAL.
+SAMPLE_AFTER = 0.05
+SAMPLE_INTERVAL = 0.01
+STACK_DEPTH = 12
+STALL_LOG_THRESHOLD = 0.25
+WORST_STALLS = 20
+# Stacks kept per stall, most sampled first.
+STACKS_PER_STALL = 3
+
+LOOP_LAG_SECONDS = metrics.Histogram(
+    "starstream_event_loop_lag_seconds", "How late the watchdog woke up, measured every check interval.")
+LOOP_STALLS = metrics.Counter(
+    "starstream_event_loop_stalls_total", f"Event loop stalls of {STALL_LOG_THRESHOLD}s or more.")
+
+Stack = Tuple[str, ...]
+
+def _describe(frame) -> Stack:
+    """The innermost STACK_DEPTH frames, outermost first, as 'file:line function'."""
+    frames = traceback.extract_stack(frame, limit=STACK_DEPTH)
+    return tuple(f"{os.path.basename(fs.filename)}:{fs.lineno} {fs.name}" for fs in frames)
+
+class LoopWatchdog:
+    def __init__(self, publish: Optional[Callable[[Dict[str, Any]], None]] = None):
+        # Called with each dashboard message ('loop_lag' points and 'loop_stall' reports).
+        self.publish = publish
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        # Loop time the watchdog task is due to wake; read by the sampler thread.
+        self._due: Optional[float] = None
+        self._clock: Callable[[], float] = time.monotonic
+        self._lock = threading.Lock()
+        self._samples: "collections.Counter[Stack]" = collections.Counter()
+        # Min-heap of (lag, n, stall) holding the worst stalls seen.
+        self._worst: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._order = itertools.count()
+        self.history: "collections.deque[Dict[str, float]]" = collections.deque(maxlen=300)
+
+    def start(self):
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._clock = loop.time
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._thread = threading.Thread(target=self._sample, name="loop-watchdog-sampler", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def worst_stalls(self) -> List[Dict[str, Any]]:
+        """The longest stalls seen, longest first."""
+        return [stall for _, _, stall in sorted(self._worst, reverse=True)]
+
+    # --- Sampler thread ---
+    def _sample(self):
+        frames = sys._current_frames
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            due = self._due
+            if due is None or self._clock() - due < SAMPLE_AFTER:
+                continue
+            frame = frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = _describe(frame)
+            del frame
+            with self._lock:
+                self._samples[stack] += 1
+
+    # --- Watchdog task ---
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        window: List[float] = []
+        report_at = loop.time() + REPORT_INTERVAL
+        while True:
+            self._due = loop.time() + CHECK_INTERVAL
+            await asyncio.sleep(CHECK_INTERVAL)
+            now = loop.time()
+            lag = max(0.0, now - self._due)
+            self._due = None
+            with self._lock:
+                samples, self._samples = self._samples, collections.Counter()
+            LOOP_LAG_SECONDS.observe(lag)
+            window.append(lag)
+            # A sample taken just as the loop woke can land after the swap; ignore it.
+            if samples and lag >= SAMPLE_AFTER:
+                self._record_stall(lag, samples)
+            if now >= report_at:
+                point = {'t': time.time(), 'max_ms': max(window) * 1000, 'mean_ms': sum(window) / len(window) * 1000}
+                self.history.append(point)
+                self._publish({'type': 'loop_lag', 'payload': point})
+                window = []
+                report_at = now + REPORT_INTERVAL
+
+    def _record_stall(self, lag: float, samples: "collections.Counter[Stack]"):
+        total = sum(samples.values())
+        stall = {
+            'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'lag_ms': round(lag * 1000, 1),
+            'samples': total,
+            'stacks': [{'count': count, 'frames': list(stack)} for stack, count in samples.most_common(STACKS_PER_STALL)],
+        }
+        entry = (lag, next(self._order), stall)
+        if len(self._worst) < WORST_STALLS:
+            heapq.heappush(self._worst, entry)
+        elif lag > self._worst[0][0]:
+            heapq.heapreplace(self._worst, entry)
+        if lag < STALL_LOG_THRESHOLD:
+            return
+        LOOP_STALLS.inc()
+        top = stall['stacks'][0]
+        print(f"WARNING: Event loop blocked for {stall['lag_ms']:.0f}ms. Running in {top['count']}/{total} samples:\n    "
+              + "\n    ".join(top['frames']))
+        self._publish({'type': 'loop_stall', 'payload': stall})
+
+    def _publish(self, message: Dict[str, Any]):
+        if self.publish is not None:
+            self.publish(message)
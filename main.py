@@ -1,21 +1,31 @@
 import os
 import discord
 from discord.commands import SlashCommandGroup
-from discord.ext import commands
+from discord.ext import commands, tasks
 from dotenv import load_dotenv
 
 # --- IMPORTS FROM BOTH SCRIPTS ---
 import asyncio
 import collections
 from datetime import datetime
+import hashlib
 import html # Used to escape characters for safe HTML display
+import json
 import random # For gambling games
+import time
 
 # --- NEW/MODIFIED IMPORTS ---
 # Use the new asynchronous database module
 import database as db
 # Import the new admin panel module
 import admin_panel
+import command_trace
+import loop_watchdog
+import metrics
+import notifications
+import ratelimit
+import spans
+import user_resolver
 
 # --- CONFIGURATION ---
 load_dotenv()
@@ -37,16 +47,122 @@ MAIN_GUILD_ID = 1369930083564912670 # Replace with your main guild ID
 
 # --- NEW: BETTING LIMIT ---
 MAX_GRR_BET = 250000
+
+LEADERBOARD_PAGE_SIZE = 10
+
+# --- GRR RATE LIMITS ---
+# Each user gets a token bucket per command class: (tokens per second, burst).
+GRR_RATE_LIMITS = {
+    'gambling': (0.5, 3),
+    'economy': (1.0, 5),
+    'admin': (1.0, 5),
+}
+# `grr` commands handled at once across all users; more than this are turned away.
+MAX_CONCURRENT_GRR_COMMANDS = 50
+
+# When set, every received command is appended to this file (see command_trace.py).
+COMMAND_TRACE_FILE = os.getenv('COMMAND_TRACE_FILE')
+# Completed command traces (see spans.py) are appended here, rotated at 10 MB. Empty keeps them in memory only.
+SPAN_LOG_FILE = os.getenv('SPAN_LOG_FILE', os.path.join('starstream_data', 'spans.jsonl'))
 # --- END CONFIGURATION ---
 
 
+# --- METRICS ---
+# Served at /metrics by the admin panel (see metrics.py).
+COMMAND_SECONDS = metrics.Histogram(
+    "starstream_command_duration_seconds", "Time from receiving a command to its handler returning.", ["command"])
+COMMANDS = metrics.Counter(
+    "starstream_commands_total", "Commands received, by outcome: ok, error, throttled or shed.", ["command", "outcome"])
+DISCORD_REST_SECONDS = metrics.Histogram(
+    "starstream_discord_rest_duration_seconds", "Discord REST requests made by the bot, by route.", ["method", "route"])
+DISCORD_REST_REQUESTS = metrics.Counter(
+    "starstream_discord_rest_requests_total", "Discord REST requests made by the bot, by route and result.", ["method", "route", "status"])
+
+def record_command(command: str, seconds: float, outcome: str):
+    COMMAND_SECONDS.observe(seconds, command)
+    COMMANDS.inc(command, outcome)
+
+def instrument_http(http):
+    """
+    Times every request made through `http`, labelled with the route template so IDs don't
+    multiply the series, and records it as a span of the current command's trace. Used on
+    the bot's HTTP client and on the webhook adapter that interaction responses and
+    followups go through.
+    """
+    request = http.request
+
+    async def timed_request(route, *args, **kwargs):
+        start = time.perf_counter()
+        status = 'error'
+        with spans.span(f"{route.method} {route.path}") as span:
+            try:
+                response = await request(route, *args, **kwargs)
+                status = 'ok'
+                return response
+            except discord.HTTPException as e:
+                status = str(e.status)
+                raise
+            finally:
+                span.set(status=status)
+                DISCORD_REST_SECONDS.observe(time.perf_counter() - start, route.method, route.path)
+                DISCORD_REST_REQUESTS.inc(route.method, route.path, status)
+
+    http.request = timed_request
+# --- END METRICS ---
+
 # --- BOT SETUP ---
 intents = discord.Intents.default()
 intents.members = True
 intents.guilds = True
 intents.message_content = True
 
-bot = commands.Bot(command_prefix="/", intents=intents)
+class StarStreamBot(commands.Bot):
+    # on_ready fires again after every gateway reconnect; startup work only runs the first time.
+    startup_complete = False
+
+    async def invoke_application_command(self, ctx: discord.ApplicationContext):
+        start = time.perf_counter()
+        command = f"/{ctx.command.qualified_name}"
+        outcome = 'error'
+        with spans.trace(command, user=ctx.author.id) as trace:
+            try:
+                await super().invoke_application_command(ctx)
+                # Most errors are handed to the error handlers inside, which mark the context instead of raising.
+                outcome = 'error' if getattr(ctx, 'command_failed', False) else 'ok'
+            finally:
+                # Commands that raise or are cancelled are timed and counted as errors too.
+                trace.set(outcome=outcome)
+                record_command(command, time.perf_counter() - start, outcome)
+
+    async def close(self):
+        await event_loop_watchdog.stop()
+        # The pending digest is sent and queued admin logs are persisted while the HTTP
+        # session and the database are still open.
+        await constellation_notifier.stop()
+        if admin_log_pipeline:
+            await admin_log_pipeline.stop()
+        await super().close()
+        # Release the long-lived database connections once the gateway is down.
+        await db.close_db()
+        if trace_recorder:
+            trace_recorder.close()
+        spans.disable()
+
+# Commands are synced from on_ready, and only when they've changed (see sync_commands_if_changed).
+bot = StarStreamBot(command_prefix="/", intents=intents, auto_sync_commands=False)
+instrument_http(bot.http)
+instrument_http(discord.webhook.async_.async_context.get())
+user_resolver.BOT_INSTANCE = bot
+constellation_notifier = notifications.ConstellationNotifier(bot, CONSTELLATION_USER_IDS)
+admin_log_pipeline = notifications.AdminLogPipeline(bot, ADMIN_LOG_CHANNEL_ID) if ADMIN_LOG_CHANNEL_ID else None
+trace_recorder = command_trace.TraceRecorder(COMMAND_TRACE_FILE) if COMMAND_TRACE_FILE else None
+# Lag and stall reports stream to the admin dashboard over /ws/logs.
+event_loop_watchdog = loop_watchdog.LoopWatchdog(publish=admin_panel.publish)
+
+@bot.before_invoke
+async def record_slash_command(ctx: discord.ApplicationContext):
+    if trace_recorder:
+        trace_recorder.record_slash(ctx)
 # --- END BOT SETUP ---
 
 # --- THEME & EMBED FACTORY ---
@@ -88,48 +204,84 @@ def is_constellation_from_message(message: discord.Message) -> bool:
 LOG_CACHE = collections.deque(maxlen=200)
 
 async def send_log(embed: discord.Embed):
-    if ADMIN_LOG_CHANNEL_ID:
-        try:
-            log_channel = bot.get_channel(ADMIN_LOG_CHANNEL_ID) or await bot.fetch_channel(ADMIN_LOG_CHANNEL_ID)
-            await log_channel.send(embed=embed)
-        except (discord.NotFound, discord.Forbidden) as e:
-            print(f"ERROR: Could not send to admin log channel ({ADMIN_LOG_CHANNEL_ID}). {e}")
-        except Exception as e:
-            print(f"ERROR: Failed to send log to admin channel. {e}")
-
-    ts = f"<span class='timestamp'>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</span>"
-    title = f"<span class='title'>{html.escape(str(embed.title))}</span>" if embed.title else ""
-    parts = [f"{ts}<br>{title}"]
-    if embed.description:
-        parts.append(html.escape(str(embed.description)))
-    for field in embed.fields:
-        parts.append(f"<span class='field-name'>{html.escape(field.name)}:</span><br>{html.escape(field.value)}")
+    with spans.span("send_log"):
+        # Delivery to the log channel happens in the background (see notifications.py).
+        if admin_log_pipeline:
+            admin_log_pipeline.submit(embed)
+
+        ts = f"<span class='timestamp'>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</span>"
+        title = f"<span class='title'>{html.escape(str(embed.title))}</span>" if embed.title else ""
+        parts = [f"{ts}<br>{title}"]
+        if embed.description:
+            parts.append(html.escape(str(embed.description)))
+        for field in embed.fields:
+            parts.append(f"<span class='field-name'>{html.escape(field.name)}:</span><br>{html.escape(field.value)}")
     
-    html_log = "<br>".join(parts)
-    LOG_CACHE.append(html_log)
-    # The admin panel might not be running yet on initial startup logs
-    if admin_panel.BOT_INSTANCE:
-        await admin_panel.broadcast_log(html_log)
-
-async def send_purchase_log_to_constellations(embed: discord.Embed):
-    for user_id in CONSTELLATION_USER_IDS:
-        try:
-            user = bot.get_user(user_id) or await bot.fetch_user(user_id)
-            if user and not user.bot:
-                await user.send(embed=embed)
-        except Exception as e:
-            print(f"ERROR: Could not DM Constellation {user_id}: {e}")
+        html_log = "<br>".join(parts)
+        LOG_CACHE.append(html_log)
+        # The admin panel might not be running yet on initial startup logs
+        if admin_panel.BOT_INSTANCE:
+            admin_panel.broadcast_log(html_log)
+
+def send_purchase_log_to_constellations(embed: discord.Embed):
+    # DMs go out in the background, batched into digests (see notifications.py).
+    with spans.span("send_purchase_log_to_constellations"):
+        constellation_notifier.submit(embed)
+
+# --- MAINTENANCE ---
+@tasks.loop(hours=6)
+async def prune_empty_accounts():
+    """Clears out zero-balance accounts so the users tables only hold people who've played."""
+    removed = await db.prune_empty_accounts()
+    if removed:
+        print(f"Pruned {removed} empty account row(s).")
 
 # --- BOT EVENTS ---
+def _canonical(value):
+    # Integer lists in command payloads (contexts, integration_types, channel_types) come
+    # from sets, so their order changes between runs.
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [_canonical(item) for item in value]
+        return sorted(items) if all(isinstance(item, int) for item in items) else items
+    return value
+
+def command_hash() -> str:
+    """Fingerprints every registered application command, as Discord would receive it."""
+    payload = json.dumps(_canonical([cmd.to_dict() for cmd in bot.pending_application_commands]), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def sync_commands_if_changed():
+    current_hash = command_hash()
+    if db.get_config_str('command_sync_hash', '') == current_hash:
+        print("Scenarios (Slash Commands) unchanged since the last sync; skipping.")
+        return
+    await bot.sync_commands()
+    await db.set_config_values({'command_sync_hash': current_hash})
+    print("All Scenarios (Slash Commands) have been synced with Discord.")
+
 @bot.event
 async def on_ready():
+    if bot.startup_complete:
+        print(f'Reconnected as {bot.user}.')
+        return
+    bot.startup_complete = True
     print(f'Logged in as {bot.user} | The Star Stream is watching.')
+    event_loop_watchdog.start()
+    spans.enable(spans.TraceLog(SPAN_LOG_FILE or None))
     await db.init_db()
-    await bot.sync_commands()
-    print("All Scenarios (Slash Commands) have been synced with Discord.")
-    asyncio.create_task(admin_panel.start_admin_panel_server(bot, LOG_CACHE))
+    if admin_log_pipeline:
+        admin_log_pipeline.start()
+    prune_empty_accounts.start()
+    await sync_commands_if_changed()
+    asyncio.create_task(admin_panel.start_admin_panel_server(bot, LOG_CACHE, event_loop_watchdog))
 
 # --- GRR TEXT COMMAND HANDLERS ---
+async def _pause(seconds: float):
+    """Waits between the steps of a game animation. The replay harness swaps it out to run at full speed."""
+    await asyncio.sleep(seconds)
+
 async def handle_grr_cash(message: discord.Message, args: list):
     target_user = message.mentions[0] if message.mentions else message.author
     user_balance = await db.get_grr_balance(target_user.id)
@@ -149,16 +301,13 @@ async def handle_grr_daily(message: discord.Message, args: list):
         await message.channel.send(response, reference=message, delete_after=10)
 
 async def handle_grr_exchange(message: discord.Message, args: list):
-    exchange_enabled = await db.get_config_value('exchange_enabled', 'false')
-    if exchange_enabled != 'true':
-        disabled_message = await db.get_config_value('exchange_disabled_message', 'The exchange is currently disabled by the Constellations.')
+    if not db.get_config_bool('exchange_enabled', False):
+        disabled_message = db.get_config_str('exchange_disabled_message', 'The exchange is currently disabled by the Constellations.')
         await message.channel.send(disabled_message, reference=message)
         return
     try:
-        grr_cost_str = await db.get_config_value('exchange_grr_cost', '5000')
-        ssc_reward_str = await db.get_config_value('exchange_ssc_reward', '100')
-        grr_cost = int(grr_cost_str)
-        ssc_reward = int(ssc_reward_str)
+        grr_cost = db.get_config_int('exchange_grr_cost', 5000)
+        ssc_reward = db.get_config_int('exchange_ssc_reward', 100)
     except (ValueError, TypeError):
         await message.channel.send("An error occurred with the exchange configuration. Please contact a Constellation.", reference=message)
         return
@@ -179,9 +328,9 @@ async def handle_grr_cf(message: discord.Message, args: list):
         return await message.channel.send("Usage: `grr cf <amount|all> [t for tails]`", reference=message)
     
     choice = "Tails" if len(args) > 1 and args[1].lower() == 't' else "Heads"
-    balance = await db.get_grr_balance(message.author.id)
 
     if args[0].lower() == 'all':
+        balance = await db.get_grr_balance(message.author.id)
         if balance <= 0: return await message.channel.send("You have no GRR coins to bet!", reference=message)
         bet_amount = balance
     else:
@@ -194,35 +343,33 @@ async def handle_grr_cf(message: discord.Message, args: list):
     if bet_amount > MAX_GRR_BET:
         bet_amount = MAX_GRR_BET
 
-    if balance < bet_amount:
-        return await message.channel.send(f"You can't bet **{bet_amount:,}** GRR, you only have **{balance:,}**.", reference=message)
+    win_rate = db.get_config_float('cf_win_rate', 0.31)
+    win = random.random() < win_rate
+    payout = bet_amount * 2 if win else 0
 
-    win_rate_str = await db.get_config_value('cf_win_rate', '0.31')
-    win_rate = float(win_rate_str)
-    await db.add_grr_coins(message.author.id, -bet_amount)
+    # Stake and payout settle together; the flip below is only presentation.
+    new_balance = await db.settle_grr_wager(message.author.id, bet_amount, payout)
+    if new_balance is None:
+        balance = await db.get_grr_balance(message.author.id)
+        return await message.channel.send(f"You can't bet **{bet_amount:,}** GRR, you only have **{balance:,}**.", reference=message)
     
     initial_msg = await message.channel.send(f"Flipping a coin for **{bet_amount:,}** GRR... your choice is **{choice}**! 🪙", reference=message)
-    await asyncio.sleep(2)
+    await _pause(2)
     
-    win = random.random() < win_rate
-    payout = bet_amount * 2
     if win:
-        await db.add_grr_coins(message.author.id, payout)
         outcome_desc = f"The coin landed on **{choice}**! You win **{payout:,}** GRR!"
     else:
         actual_flip = "Tails" if choice == "Heads" else "Heads"
         outcome_desc = f"Tough luck! It was **{actual_flip}**. You lost **{bet_amount:,}** GRR."
     
-    new_balance = await db.get_grr_balance(message.author.id)
     final_response = f"{message.author.mention}, {outcome_desc}\nYour new balance is **{new_balance:,}** GRR."
     await initial_msg.edit(content=final_response)
 
 async def handle_grr_bet(message: discord.Message, args: list):
     if not args: return await message.channel.send("Usage: `grr bet <amount|all>`", reference=message)
-    
-    balance = await db.get_grr_balance(message.author.id)
 
     if args[0].lower() == 'all':
+        balance = await db.get_grr_balance(message.author.id)
         if balance <= 0: return await message.channel.send("You have no GRR coins to bet!", reference=message)
         bet_amount = balance
     else:
@@ -235,11 +382,7 @@ async def handle_grr_bet(message: discord.Message, args: list):
     if bet_amount > MAX_GRR_BET:
         bet_amount = MAX_GRR_BET
 
-    if balance < bet_amount: return await message.channel.send(f"You can't bet more than you have! Your balance is **{balance:,}** GRR.", reference=message)
-
-    win_rate_str = await db.get_config_value('bet_win_rate', '0.29')
-    win_rate = float(win_rate_str)
-    await db.add_grr_coins(message.author.id, -bet_amount)
+    win_rate = db.get_config_float('bet_win_rate', 0.29)
     
     win = random.random() < win_rate
     payout = 0
@@ -247,9 +390,12 @@ async def handle_grr_bet(message: discord.Message, args: list):
         mu = bet_amount * 2.5
         sigma = bet_amount * 0.75
         payout = max(0, int(round(random.gauss(mu, sigma))))
-        await db.add_grr_coins(message.author.id, payout)
+
+    new_balance = await db.settle_grr_wager(message.author.id, bet_amount, payout)
+    if new_balance is None:
+        balance = await db.get_grr_balance(message.author.id)
+        return await message.channel.send(f"You can't bet more than you have! Your balance is **{balance:,}** GRR.", reference=message)
         
-    new_balance = await db.get_grr_balance(message.author.id)
     profit = payout - bet_amount
     title = "🎉 High-Stakes Win! 🎉" if profit > 0 else "💸 High-Stakes Loss 💸"
     result_text = f"You risked **{bet_amount:,}** and were rewarded with **{payout:,}** GRR!" if profit > 0 else f"You risked **{bet_amount:,}** and lost it all."
@@ -262,9 +408,8 @@ async def handle_grr_slots(message: discord.Message, args: list):
     if not args:
         return await message.channel.send("Usage: `grr slots <amount|all>`", reference=message)
 
-    balance = await db.get_grr_balance(message.author.id)
-
     if args[0].lower() == 'all':
+        balance = await db.get_grr_balance(message.author.id)
         if balance <= 0:
             return await message.channel.send("You have no GRR coins to bet!", reference=message)
         bet_amount = balance
@@ -279,67 +424,54 @@ async def handle_grr_slots(message: discord.Message, args: list):
     if bet_amount > MAX_GRR_BET:
         bet_amount = MAX_GRR_BET
 
-    if balance < bet_amount:
-        return await message.channel.send(f"You can't bet **{bet_amount:,}** GRR, you only have **{balance:,}**.", reference=message)
-
-    await db.add_grr_coins(message.author.id, -bet_amount)
-
     # --- NEW: Configurable Slot Machine Setup ---
     emojis_config = {
-        "🍒": ("slots_multiplier_cherry", 5), "🍇": ("slots_multiplier_grape", 5), 
-        "🍊": ("slots_multiplier_orange", 5), "🍋": ("slots_multiplier_lemon", 8), 
-        "🔔": ("slots_multiplier_bell", 8), "💎": ("slots_multiplier_diamond", 15),
-        "🍀": ("slots_multiplier_clover", 25), "💰": ("slots_multiplier_moneybag", 50)
+        "🍒": "cherry", "🍇": "grape", "🍊": "orange", "🍋": "lemon",
+        "🔔": "bell", "💎": "diamond", "🍀": "clover", "💰": "moneybag"
     }
-    
-    payout_multipliers = {}
-    for symbol, (config_key, default_value) in emojis_config.items():
-        payout_multipliers[symbol] = int(await db.get_config_value(config_key, str(default_value)))
-    
-    two_of_a_kind_multiplier = int(await db.get_config_value("slots_multiplier_2_of_a_kind", "2"))
+
+    multipliers = db.get_slot_multipliers()
+    payout_multipliers = {symbol: multipliers[key] for symbol, key in emojis_config.items()}
+    two_of_a_kind_multiplier = multipliers["2_of_a_kind"]
 
     # Weights for more realistic reel stops
     symbols = list(payout_multipliers.keys())
     weights = [10, 10, 10, 8, 8, 5, 3, 1] 
 
-    initial_msg = await message.channel.send(f"Betting **{bet_amount:,} GRR**... Good luck!\n**[ ❓ | ❓ | ❓ ]**", reference=message)
-    await asyncio.sleep(1)
-
-    # Animation of spinning
-    for _ in range(3): # Do 3 quick spins for animation
-        reels = random.choices(symbols, k=3)
-        await initial_msg.edit(content=f"Betting **{bet_amount:,} GRR**... Good luck!\n**[ {reels[0]} | {reels[1]} | {reels[2]} ]**")
-        await asyncio.sleep(0.5)
-
-    # Final result
+    # Final result (decided up front so the wager settles in one transaction)
     final_reels = random.choices(symbols, weights=weights, k=3)
 
     # Check for wins
-    win = False
     payout = 0
-    result_text = ""
+    result_text = f"💸 Tough luck! You lost **{bet_amount:,}** GRR."
 
     # Three of a kind (Jackpot)
     if final_reels[0] == final_reels[1] == final_reels[2]:
-        win = True
         winning_symbol = final_reels[0]
         multiplier = payout_multipliers[winning_symbol]
         payout = bet_amount * multiplier
         result_text = f"🎉 **JACKPOT!** Three **{winning_symbol}**! You win **{payout:,}** GRR!"
     # Two of a kind (small win)
     elif final_reels[0] == final_reels[1] or final_reels[1] == final_reels[2]:
-        win = True
         winning_symbol = final_reels[1] # The middle reel will be part of any 2-pair
         multiplier = two_of_a_kind_multiplier
         payout = bet_amount * multiplier
         result_text = f"👍 **Small Win!** Two **{winning_symbol}**! You win **{payout:,}** GRR!"
 
-    if win:
-        await db.add_grr_coins(message.author.id, payout)
-    else:
-        result_text = f"💸 Tough luck! You lost **{bet_amount:,}** GRR."
+    new_balance = await db.settle_grr_wager(message.author.id, bet_amount, payout)
+    if new_balance is None:
+        balance = await db.get_grr_balance(message.author.id)
+        return await message.channel.send(f"You can't bet **{bet_amount:,}** GRR, you only have **{balance:,}**.", reference=message)
+
+    initial_msg = await message.channel.send(f"Betting **{bet_amount:,} GRR**... Good luck!\n**[ ❓ | ❓ | ❓ ]**", reference=message)
+    await _pause(1)
+
+    # Animation of spinning
+    for _ in range(3): # Do 3 quick spins for animation
+        reels = random.choices(symbols, k=3)
+        await initial_msg.edit(content=f"Betting **{bet_amount:,} GRR**... Good luck!\n**[ {reels[0]} | {reels[1]} | {reels[2]} ]**")
+        await _pause(0.5)
 
-    new_balance = await db.get_grr_balance(message.author.id)
     final_content = (f"{message.author.mention}'s Spin:\n"
                      f"**[ {final_reels[0]} | {final_reels[1]} | {final_reels[2]} ]**\n\n"
                      f"{result_text}\n"
@@ -360,7 +492,7 @@ async def handle_grr_help(message: discord.Message, args: list):
         "`grr cash [@user]` - Checks your or another user's GRR balance. (Alias: `bal`)\n"
         "`grr daily` - Claims your daily random GRR coins.\n"
         "`grr pay <@user> <amount>` - Pays another user. (Alias: `give`)\n"
-        "`grr leaderboard` - Shows the top 10 GRR holders. (Alias: `lb`)\n"
+        "`grr leaderboard [page]` - Shows the GRR holders ranking and your rank. (Alias: `lb`)\n"
         "`grr exchange` - Exchanges GRR for Starstream Coins (SSC)."
     )
     embed.add_field(name="📜 General Commands", value=user_commands, inline=False)
@@ -382,19 +514,23 @@ async def handle_grr_help(message: discord.Message, args: list):
     await message.channel.send(embed=embed, reference=message)
 
 async def handle_grr_leaderboard(message: discord.Message, args: list):
-    top_users = await db.get_grr_leaderboard(limit=10)
-    if not top_users: return await message.channel.send("The leaderboard is empty.", reference=message)
+    page = int(args[0]) if args and args[0].isdigit() and int(args[0]) > 0 else 1
+    top_users, total = await db.get_grr_leaderboard_page(page, LEADERBOARD_PAGE_SIZE)
+    if not total: return await message.channel.send("The leaderboard is empty.", reference=message)
+    page_count = -(-total // LEADERBOARD_PAGE_SIZE)
+    if not top_users: return await message.channel.send(f"The leaderboard only has **{page_count}** page(s).", reference=message)
     title = "🏆 **GRR Coin Leaderboard** 🏆\n"
     lines = []
-    for rank, record in enumerate(top_users, 1):
-        try:
-            user = bot.get_user(record['user_id']) or await bot.fetch_user(record['user_id'])
-            user_display = user.display_name
-        except discord.NotFound:
-            user_display = f"Forgotten User (ID: {record['user_id']})"
+    names = await user_resolver.resolve_many(record['user_id'] for record in top_users)
+    for record in top_users:
+        rank = record['rank']
+        user = names[record['user_id']]
+        user_display = user.display_name if user.found else f"Forgotten User (ID: {record['user_id']})"
         emoji = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"**#{rank}**"
         lines.append(f"{emoji} {user_display} - **{record['balance']:,}** GRR")
-    response = title + "\n".join(lines)
+    my_rank = await db.get_grr_rank(message.author.id)
+    footer = f"\nPage {page}/{page_count}" + (f" | Your rank: **#{my_rank:,}** of {total:,}" if my_rank else "")
+    response = title + "\n".join(lines) + "\n" + footer
     await message.channel.send(response, reference=message)
 
 async def handle_grr_pay(message: discord.Message, args: list):
@@ -453,8 +589,7 @@ async def handle_grr_set_exchange_rate(message: discord.Message, args: list):
     except (ValueError, IndexError):
         return await message.channel.send("Please provide valid positive numbers for both GRR cost and SSC reward.", reference=message)
 
-    await db.set_config_value('exchange_grr_cost', str(grr_cost))
-    await db.set_config_value('exchange_ssc_reward', str(ssc_reward))
+    await db.set_config_values({'exchange_grr_cost': str(grr_cost), 'exchange_ssc_reward': str(ssc_reward)})
     await message.channel.send(f"⚙️ Exchange rate updated! It now costs **{grr_cost:,} GRR** to get **{ssc_reward:,} {CURRENCY_SYMBOL}**.", reference=message)
 
 async def handle_grr_set_disabled_message(message: discord.Message, args: list):
@@ -470,46 +605,77 @@ async def handle_grr_set_disabled_message(message: discord.Message, args: list):
     await message.channel.send(f"⚙️ Exchange disabled message updated to: \"{new_message}\"", reference=message)
 
 # --- MAIN MESSAGE ROUTER ---
+# Subcommand -> (handler, rate limit class). Aliases share their command's entry.
+GRR_COMMANDS = {
+    'help': (handle_grr_help, 'economy'),
+    'cash': (handle_grr_cash, 'economy'), 'bal': (handle_grr_cash, 'economy'),
+    'daily': (handle_grr_daily, 'economy'),
+    'exchange': (handle_grr_exchange, 'economy'),
+    'leaderboard': (handle_grr_leaderboard, 'economy'), 'lb': (handle_grr_leaderboard, 'economy'),
+    'pay': (handle_grr_pay, 'economy'), 'give': (handle_grr_pay, 'economy'),
+    'cf': (handle_grr_cf, 'gambling'),
+    'bet': (handle_grr_bet, 'gambling'),
+    'slots': (handle_grr_slots, 'gambling'), 'slot': (handle_grr_slots, 'gambling'),
+    # Admin commands
+    'set-winrate': (handle_grr_set_winrate, 'admin'),
+    'toggle-exchange': (handle_grr_toggle_exchange, 'admin'),
+    'set-exchange-rate': (handle_grr_set_exchange_rate, 'admin'),
+    'set-disabled-message': (handle_grr_set_disabled_message, 'admin'),
+}
+# Unknown or missing subcommands still get a reply, so they count against this class.
+GRR_FALLBACK_CLASS = 'economy'
+
+grr_rate_limiters = {name: ratelimit.RateLimiter(rate, burst) for name, (rate, burst) in GRR_RATE_LIMITS.items()}
+grr_command_slots = asyncio.Semaphore(MAX_CONCURRENT_GRR_COMMANDS)
+
 @bot.event
 async def on_message(message: discord.Message):
-    if message.author.bot or not message.content.lower().startswith('grr '):
+    content = message.content
+    if message.author.bot or content[:4].lower() != 'grr ':
         return
-
-    parts = message.content.lower().split()
-    # For commands that need the original casing/spacing, we pass the raw content
-    command_args = message.content.split()[2:]
-    
-    command_map = {
-        'help': handle_grr_help,
-        'cash': handle_grr_cash, 'bal': handle_grr_cash,
-        'daily': handle_grr_daily,
-        'exchange': handle_grr_exchange,
-        'cf': handle_grr_cf,
-        'bet': handle_grr_bet,
-        'slots': handle_grr_slots, 'slot': handle_grr_slots,
-        'leaderboard': handle_grr_leaderboard, 'lb': handle_grr_leaderboard,
-        'pay': handle_grr_pay, 'give': handle_grr_pay,
-        # Admin commands
-        'set-winrate': handle_grr_set_winrate,
-        'toggle-exchange': handle_grr_toggle_exchange,
-        'set-exchange-rate': handle_grr_set_exchange_rate,
-        'set-disabled-message': handle_grr_set_disabled_message,
-    }
-
-    if len(parts) > 1:
-        subcommand = parts[1]
-        if subcommand in command_map:
-            await command_map[subcommand](message, command_args)
-        else:
-            await message.channel.send(f"Unknown subcommand `{subcommand}`.", reference=message, delete_after=10)
-    else:
-        await message.channel.send(f"Please specify a subcommand.", reference=message, delete_after=10)
+    if trace_recorder:
+        trace_recorder.record_message(message)
+
+    # Arguments keep their original casing; handlers lowercase what they compare.
+    parts = content.split()
+    subcommand = parts[1].lower() if len(parts) > 1 else None
+    handler, limit_class = GRR_COMMANDS.get(subcommand, (None, GRR_FALLBACK_CLASS))
+
+    command = f"grr {subcommand}" if handler else "grr unknown"
+    start = time.perf_counter()
+    with spans.trace(command, user=message.author.id) as trace:
+        limiter = grr_rate_limiters[limit_class]
+        retry_after = limiter.check(message.author.id)
+        if retry_after:
+            COMMANDS.inc(command, 'throttled')
+            trace.set(outcome='throttled')
+            if limiter.warn_once(message.author.id):
+                await message.channel.send(f"⏳ Slow down! Try again in **{max(1, round(retry_after))}s**.", reference=message, delete_after=max(retry_after, 5))
+            return
+        if grr_command_slots.locked():
+            COMMANDS.inc(command, 'shed')
+            trace.set(outcome='shed')
+            await message.channel.send("🌌 The Star Stream is overwhelmed right now. Please try again in a moment.", reference=message, delete_after=10)
+            return
+
+        outcome = 'error'
+        try:
+            async with grr_command_slots:
+                if handler:
+                    await handler(message, parts[2:])
+                elif subcommand:
+                    await message.channel.send(f"Unknown subcommand `{subcommand}`.", reference=message, delete_after=10)
+                else:
+                    await message.channel.send(f"Please specify a subcommand.", reference=message, delete_after=10)
+            outcome = 'ok'
+        finally:
+            trace.set(outcome=outcome)
+            record_command(command, time.perf_counter() - start, outcome)
 
 # --- AUTOCOMPLETE & SLASH COMMANDS ---
 async def autocomplete_shop_items(ctx: discord.AutocompleteContext):
     if not ctx.interaction.guild: return []
-    items = await db.get_all_shop_items(ctx.interaction.guild.id)
-    return [item['name'] for item in items if item['name'].lower().startswith(ctx.value.lower())]
+    return await db.search_shop_item_names(ctx.interaction.guild.id, ctx.value)
 
 @bot.slash_command(name="balance", description=f"Examine your or another Incarnation's {CURRENCY_NAME} balance.")
 async def balance(ctx: discord.ApplicationContext, user: discord.Option(discord.Member, "The Incarnation to view.", required=False)):
@@ -539,23 +705,28 @@ async def pay(ctx: discord.ApplicationContext, recipient: discord.Option(discord
         await ctx.followup.send(embed=embed, ephemeral=True)
 
 @bot.slash_command(name="leaderboard", description="View the Ranking Scenario for the wealthiest Incarnations.")
-async def leaderboard(ctx: discord.ApplicationContext):
+async def leaderboard(ctx: discord.ApplicationContext, page: discord.Option(int, "The page of the ranking to view.", required=False, default=1, min_value=1)):
     await ctx.defer()
-    top_users = await db.get_leaderboard(limit=10)
+    top_users, total = await db.get_leaderboard_page(page, LEADERBOARD_PAGE_SIZE)
     embed = EmbedFactory.create(title="🏆「The Throne of the Absolute」🏆", color=discord.Color.blurple())
-    if not top_users:
+    if not total:
         embed.description = "The ranking is currently empty."
         return await ctx.followup.send(embed=embed)
+    page_count = -(-total // LEADERBOARD_PAGE_SIZE)
+    if not top_users:
+        embed.description = f"The ranking only has **{page_count}** page(s)."
+        return await ctx.followup.send(embed=embed)
     desc = []
-    for rank, record in enumerate(top_users, 1):
-        try:
-            user = bot.get_user(record['user_id']) or await bot.fetch_user(record['user_id'])
-            user_display = user.mention
-        except discord.NotFound:
-            user_display = f"A Forgotten Incarnation (ID: {record['user_id']})"
+    names = await user_resolver.resolve_many(record['user_id'] for record in top_users)
+    for record in top_users:
+        rank = record['rank']
+        user = names[record['user_id']]
+        user_display = user.mention if user.found else f"A Forgotten Incarnation (ID: {record['user_id']})"
         emoji = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"**#{rank}**"
         desc.append(f"{emoji} {user_display} — **{record['balance']:,} {CURRENCY_SYMBOL}**")
     embed.description = "\n".join(desc)
+    my_rank = await db.get_rank(ctx.author.id)
+    embed.add_field(name=f"Page {page}/{page_count}", value=f"Your rank: **#{my_rank:,}** of {total:,}" if my_rank else "You are not yet ranked.")
     await ctx.followup.send(embed=embed)
 
 constellation_cmds = SlashCommandGroup("constellation", "Commands for managing the Star Stream.", guild_ids=[MAIN_GUILD_ID])
@@ -629,16 +800,14 @@ async def shop_view(ctx: discord.ApplicationContext):
         embed.description = "The Bag is currently empty."
     else:
         desc = []
+        purchasers = await user_resolver.resolve_many(item['purchased_by_user_id'] for item in items if item['purchased_by_user_id'])
         for item in items:
             role = ctx.guild.get_role(item['role_id'])
             item_line = f"### {item['name']}\n**Cost:** {item['cost']:,} {CURRENCY_SYMBOL}\n**Reward:** {role.mention if role else '`Faded Stigma`'}\n"
             if item['is_one_time_buy']:
                 if item['purchased_by_user_id']:
-                    try:
-                        purchaser = bot.get_user(item['purchased_by_user_id']) or await bot.fetch_user(item['purchased_by_user_id'])
-                        purchaser_mention = purchaser.mention
-                    except discord.NotFound:
-                        purchaser_mention = f"A Forgotten Incarnation"
+                    purchaser = purchasers[item['purchased_by_user_id']]
+                    purchaser_mention = purchaser.mention if purchaser.found else "A Forgotten Incarnation"
                     item_line += f"**Status:** 🔴 CLAIMED (by {purchaser_mention})\n"
                 else:
                     item_line += "**Type:** ✨ Hidden Piece (Unique)\n"
@@ -650,34 +819,42 @@ async def shop_view(ctx: discord.ApplicationContext):
 async def shop_buy(ctx: discord.ApplicationContext, name: discord.Option(str, "The name of the Artifact to buy.", autocomplete=autocomplete_shop_items)):
     await ctx.defer(ephemeral=True)
     if not ctx.guild or not isinstance(ctx.author, discord.Member): return await ctx.followup.send("Contracts can only be made in a guild.", ephemeral=True)
+    # Served from the shop catalog; the role checks run before anything is charged.
     item = await db.get_shop_item(ctx.guild.id, name)
     if not item: return await ctx.followup.send(f"Cannot find an Artifact named '{name}'.", ephemeral=True)
-    if item['is_one_time_buy'] and item['purchased_by_user_id']: return await ctx.followup.send("This Hidden Piece has already been claimed.", ephemeral=True)
-    user_balance = await db.get_balance(ctx.author.id)
-    if user_balance < item['cost']: return await ctx.followup.send(f"Your Fable is insufficient. You need **{item['cost']:,} {CURRENCY_SYMBOL}**.", ephemeral=True)
     role_to_grant = ctx.guild.get_role(item['role_id'])
     if not role_to_grant: return await ctx.followup.send("Error: The promised Stigma has faded.", ephemeral=True)
     if role_to_grant in ctx.author.roles: return await ctx.followup.send("You already possess this Stigma.", ephemeral=True)
     if not ctx.guild.me.guild_permissions.manage_roles or role_to_grant.position >= ctx.guild.me.top_role.position:
         return await ctx.followup.send("Bot Error: This Dokkaebi cannot grant a Stigma of this station.", ephemeral=True)
+    # Availability check, debit and Hidden Piece reservation happen in one transaction.
+    status, item = await db.purchase_item(ctx.guild.id, name, ctx.author.id)
+    if status == "not_found": return await ctx.followup.send(f"Cannot find an Artifact named '{name}'.", ephemeral=True)
+    if status == "already_claimed": return await ctx.followup.send("This Hidden Piece has already been claimed.", ephemeral=True)
+    if status == "insufficient_funds": return await ctx.followup.send(f"Your Fable is insufficient. You need **{item['cost']:,} {CURRENCY_SYMBOL}**.", ephemeral=True)
     try:
-        await db.add_coins(ctx.author.id, -item['cost'])
         await ctx.author.add_roles(role_to_grant, reason=f"Purchased Artifact '{item['name']}'")
-        if item['is_one_time_buy']: await db.mark_item_as_purchased(item['item_id'], ctx.author.id)
+    except Exception as e:
+        print(f"Purchase error, refunding. Error: {e}")
+        await db.release_purchase(item, ctx.author.id)
+        return await ctx.followup.send("A fatal error occurred. The contract is voided and Coins returned.", ephemeral=True)
+    try:
         embed = EmbedFactory.create(title="「Contract Fulfilled」", description=f"You acquired **{item['name']}** for **{item['cost']:,} {CURRENCY_SYMBOL}**.", color=discord.Color.green())
         embed.add_field(name="Stigma Acquired", value=f"You have been granted the {role_to_grant.mention} Stigma!")
         if item['image_url']: embed.set_thumbnail(url=item['image_url'])
-        await ctx.author.send(embed=embed)
-        await ctx.followup.send("Contract fulfilled! Details sent to your DMs.", ephemeral=True)
+        try:
+            await ctx.author.send(embed=embed)
+            await ctx.followup.send("Contract fulfilled! Details sent to your DMs.", ephemeral=True)
+        except discord.Forbidden:
+            await ctx.followup.send(embed=embed, ephemeral=True)
         log_embed = EmbedFactory.create(title="Akashic Record: Artifact Purchase", color=discord.Color.purple(), timestamp=discord.utils.utcnow())
         log_embed.add_field(name="Incarnation", value=f"{ctx.author.mention} (`{ctx.author.id}`)", inline=False)
         log_embed.add_field(name="Artifact", value=item['name'], inline=True)
         log_embed.add_field(name="Cost", value=f"**{item['cost']:,} {CURRENCY_SYMBOL}**", inline=True)
-        await send_log(log_embed); await send_purchase_log_to_constellations(log_embed)
+        await send_log(log_embed); send_purchase_log_to_constellations(log_embed)
     except Exception as e:
-        print(f"Purchase error, refunding. Error: {e}")
-        await ctx.followup.send("A fatal error occurred. The contract is voided and Coins returned.", ephemeral=True)
-        await db.add_coins(ctx.author.id, item['cost'])
+        # The role was granted, so the purchase stands even if a notification failed.
+        print(f"ERROR: Purchase of '{item['name']}' by {ctx.author.id} succeeded but notifying failed: {e}")
 
 @shop.command(name="remove", description="[CONSTELLATION] Remove an Artifact from the Dokkaebi Bag.")
 async def shop_remove(ctx: discord.ApplicationContext, name: discord.Option(str, "The name of the Artifact to remove.", autocomplete=autocomplete_shop_items)):
@@ -0,0 +1,547 @@
+import asyncio
+import collections
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from storage import Storage, CURRENCIES, encode_search_cursor, decode_search_cursor
+
+# Journal operations. Each one records the state a change produced (not the change itself),
+# so replaying a record twice is harmless.
+OP_BALANCE = "b"        # [op, currency, user_id, balance]
+OP_REMOVE_ACCOUNT = "x" # [op, currency, user_id]
+OP_DAILY = "d"          # [op, user_id, date]
+OP_ITEM = "i"           # [op, item_id, row]
+OP_REMOVE_ITEM = "r"    # [op, item_id]
+OP_CONFIG = "c"         # [op, {key: value}]
+
+SNAPSHOT_FILE = "snapshot.json"
+JOURNAL_PREFIX = "journal-"
+
+class _JournalControl:
+    """A request to the journal writer thread, queued in order with the records: 'switch' or 'stop'."""
+    __slots__ = ('action', 'path', 'done')
+
+    def __init__(self, action: str, path: Optional[str], done: asyncio.Future):
+        self.action = action
+        self.path = path
+        self.done = done
+
+def _settle(future: asyncio.Future, error: Optional[BaseException]):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(None)
+
+class MemoryStorage(Storage):
+    """
+    Keeps every balance, daily claim, shop item and config value in plain dicts and answers
+    from memory. Durability comes from an append-only journal on local disk plus periodic
+    snapshots: each change is applied and queued as one journal line, and the caller hears
+    back once a writer thread has written it out. The thread writes whatever has queued up
+    in one go, so the event loop never waits on the disk. A snapshot is serialized and
+    written to a temp file off the loop, renamed into place, and the journals it covers
+    are deleted afterwards. Startup loads the snapshot and replays the journal lines
+    written after it.
+    """
+    # Journal lines reach the OS before a change is acknowledged and are fsynced this often.
+    FSYNC_INTERVAL = 1.0
+    SNAPSHOT_INTERVAL = 300.0
+    # A snapshot is also taken early once this many changes have been journaled.
+    SNAPSHOT_AFTER_RECORDS = 50000
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self._balances: Dict[str, Dict[int, int]] = {currency: {} for currency in CURRENCIES}
+        self._last_daily: Dict[int, str] = {}
+        self._items: Dict[int, Dict[str, Any]] = {}
+        self._item_ids: Dict[Tuple[int, str], int] = {}
+        self._next_item_id = 1
+        self._config: Dict[str, str] = {}
+        self._seq = 0
+        self._records_since_snapshot = 0
+        # Owned by the writer thread, which takes journal records and _JournalControls off _writes.
+        self._journal = None
+        self._writes: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        # (seq, future) for each change not yet written, oldest first.
+        self._unwritten: "collections.deque[Tuple[int, asyncio.Future]]" = collections.deque()
+        self._journal_error: Optional[BaseException] = None
+        # True when open() found neither a snapshot nor a journal to recover from.
+        self.is_new = False
+        self._task: Optional[asyncio.Task] = None
+        self._closing = asyncio.Event()
+        self._snapshot_lock = asyncio.Lock()
+
+    # --- Lifecycle ---
+    async def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        await asyncio.to_thread(self._recover)
+        self._writer = threading.Thread(
+            target=self._write_journal, args=(asyncio.get_running_loop(),), name="memory-storage-journal", daemon=True)
+        self._writer.start()
+        # Start from a fresh snapshot so the replayed journals can go.
+        await self.snapshot()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._closing.set()
+            await self._task
+            self._task = None
+        await self.snapshot()
+        await self._close_journal()
+
+    async def _close_journal(self):
+        """Writes out every queued change, closes the journal and stops the writer thread."""
+        if self._writer is None:
+            return
+        await self._control('stop')
+        await asyncio.to_thread(self._writer.join)
+        self._writer = None
+
+    def _journal_files(self) -> List[Tuple[int, str]]:
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith(JOURNAL_PREFIX) and name.endswith(".log"):
+                files.append((int(name[len(JOURNAL_PREFIX):-4]), os.path.join(self.directory, name)))
+        return sorted(files)
+
+    def _recover(self):
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        self.is_new = not os.path.exists(snapshot_path) and not self._journal_files()
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding="utf-8") as f:
+                self._load_snapshot(json.load(f))
+        replayed = 0
+        for _, path in self._journal_files():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        seq, ops = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write; nothing after it was acknowledged.
+                        break
+                    if seq <= self._seq:
+                        continue
+                    for op in ops:
+                        self._apply(op)
+                    self._seq = seq
+                    replayed += 1
+        if replayed:
+            print(f"Replayed {replayed} journaled change(s) into memory storage.")
+
+    def _load_snapshot(self, state: Dict[str, Any]):
+        self._seq = state['seq']
+        for currency in CURRENCIES:
+            self._balances[currency] = dict(state['balances'][currency])
+        self._last_daily = dict(state['last_daily'])
+        self._items = {item['item_id']: item for item in state['items']}
+        self._item_ids = {(item['guild_id'], item['name']): item['item_id'] for item in state['items']}
+        self._next_item_id = state.get('next_item_id') or max(self._items, default=0) + 1
+        self._config = dict(state['config'])
+
+    async def export_state(self) -> Dict[str, Any]:
+        return {
+            'seq': self._seq,
+            'balances': {currency: list(self._balances[currency].items()) for currency in CURRENCIES},
+            'last_daily': list(self._last_daily.items()),
+            'items': list(self._items.values()),
+            'next_item_id': self._next_item_id,
+            'config': dict(self._config),
+        }
+
+    async def import_state(self, state: Dict[str, Any]):
+        """Replaces everything held with another engine's export_state() and snapshots it."""
+        self._load_snapshot({**state, 'seq': self._seq, 'next_item_id': None})
+        await self.snapshot()
+
+    def _write_snapshot(self, state: Dict[str, Any], journal_path: str):
+        payload = json.dumps(state, separators=(",", ":"))
+        # Every other journal is older than the one the snapshot switched to.
+        covered = [path for _, path in self._journal_files() if path != journal_path]
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(self.directory, os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        for journal_path in covered:
+            os.remove(journal_path)
+
+    async def snapshot(self):
+        """Writes the whole state atomically and drops the journals it makes redundant."""
+        async with self._snapshot_lock:
+            # Capture the state and queue the switch to a new journal without yielding, so
+            # the snapshot covers exactly the changes journaled before it.
+            journal_path = os.path.join(self.directory, f"{JOURNAL_PREFIX}{self._seq + 1:012d}.log")
+            switched = self._control('switch', journal_path)
+            self._records_since_snapshot = 0
+            state = await self.export_state()
+            # The old journal is written out and closed before the snapshot deletes it.
+            await switched
+            await asyncio.to_thread(self._write_snapshot, state, journal_path)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_snapshot = loop.time() + self.SNAPSHOT_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.FSYNC_INTERVAL)
+                # close() takes the final snapshot.
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                if loop.time() >= next_snapshot or self._records_since_snapshot >= self.SNAPSHOT_AFTER_RECORDS:
+                    await self.snapshot()
+                    next_snapshot = loop.time() + self.SNAPSHOT_INTERVAL
+            except Exception as e:
+                print(f"ERROR: Memory storage could not persist its state: {e}")
+
+    # --- Journal writer thread ---
+    def _control(self, action: str, path: Optional[str] = None) -> asyncio.Future:
+        done = asyncio.get_running_loop().create_future()
+        self._writes.put(_JournalControl(action, path, done))
+        return done
+
+    def _journaled(self, seq: int, error: Optional[BaseException]):
+        """Runs on the loop: acknowledges the changes written up to `seq`."""
+        if error is not None and self._journal_error is None:
+            self._journal_error = error
+            print(f"ERROR: Memory storage could not write its journal and stopped accepting changes: {error}")
+        while self._unwritten and self._unwritten[0][0] <= seq:
+            _settle(self._unwritten.popleft()[1], error)
+
+    def _write_journal(self, loop: asyncio.AbstractEventLoop):
+        synced_at = time.monotonic()
+        unsynced = False
+        # After a failed write nothing more is written: replay must not skip over a lost line.
+        failed: Optional[BaseException] = None
+
+        def write_out(lines: List[str], seq: int):
+            nonlocal failed, unsynced
+            if not lines:
+                return
+            if failed is None:
+                try:
+                    self._journal.write("".join(lines))
+                    self._journal.flush()
+                    unsynced = True
+                except Exception as e:
+                    failed = e
+            loop.call_soon_threadsafe(self._journaled, seq, failed)
+
+        def sync():
+            nonlocal failed, unsynced, synced_at
+            if unsynced and failed is None:
+                try:
+                    os.fsync(self._journal.fileno())
+                except Exception as e:
+                    failed = e
+            unsynced = False
+            synced_at = time.monotonic()
+
+        while True:
+            timeout = max(0.0, synced_at + self.FSYNC_INTERVAL - time.monotonic()) if unsynced else None
+            try:
+                batch = [self._writes.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            lines: List[str] = []
+            seq = 0
+            for item in batch:
+                if not isinstance(item, _JournalControl):
+                    lines.append(json.dumps(item, separators=(",", ":")) + "\n")
+                    seq = item[0]
+                    continue
+                write_out(lines, seq)
+                lines = []
+                error = None
+                try:
+                    if self._journal is not None:
+                        sync()
+                        self._journal.close()
+                        self._journal = None
+                    if item.action == 'switch':
+                        # A journal already at this name holds nothing past the snapshot, at most a torn line.
+                        self._journal = open(item.path, "w", encoding="utf-8")
+                except Exception as e:
+                    error = e
+                loop.call_soon_threadsafe(_settle, item.done, error)
+                if item.action == 'stop':
+                    return
+            write_out(lines, seq)
+            if unsynced and time.monotonic() - synced_at >= self.FSYNC_INTERVAL:
+                sync()
+
+    # --- Applying changes ---
+    def _apply(self, op: list):
+        kind = op[0]
+        if kind == OP_BALANCE:
+            self._balances[op[1]][op[2]] = op[3]
+        elif kind == OP_REMOVE_ACCOUNT:
+            self._balances[op[1]].pop(op[2], None)
+            if op[1] == 'grr':
+                self._last_daily.pop(op[2], None)
+        elif kind == OP_DAILY:
+            self._last_daily[op[1]] = op[2]
+        elif kind == OP_ITEM:
+            old = self._items.get(op[1])
+            if old is not None:
+                del self._item_ids[(old['guild_id'], old['name'])]
+            item = dict(op[2])
+            self._items[op[1]] = item
+            self._item_ids[(item['guild_id'], item['name'])] = op[1]
+            self._next_item_id = max(self._next_item_id, op[1] + 1)
+        elif kind == OP_REMOVE_ITEM:
+            old = self._items.pop(op[1], None)
+            if old is not None:
+                del self._item_ids[(old['guild_id'], old['name'])]
+        elif kind == OP_CONFIG:
+            self._config.update(op[1])
+
+    def _commit(self, *ops: list) -> asyncio.Future:
+        """
+        Applies changes, notifies the hooks and queues the changes for the journal as one
+        line. Callers await the result, which is done once the line has been written.
+        """
+        if self._journal_error is not None:
+            raise RuntimeError(f"Memory storage stopped accepting changes after a journal write failed: {self._journal_error}")
+        self._seq += 1
+        shop_guilds = {self._items[op[1]]['guild_id'] for op in ops if op[0] == OP_REMOVE_ITEM and op[1] in self._items}
+        for op in ops:
+            self._apply(op)
+        self._records_since_snapshot += 1
+        for op in ops:
+            if op[0] == OP_BALANCE:
+                self.on_balance(op[1], op[2], op[3])
+            elif op[0] == OP_REMOVE_ACCOUNT:
+                self.on_accounts_removed(op[1], [op[2]])
+            elif op[0] == OP_ITEM:
+                shop_guilds.add(op[2]['guild_id'])
+            elif op[0] == OP_CONFIG:
+                self.on_config_change(op[1])
+        for guild_id in shop_guilds:
+            self.on_shop_change(guild_id)
+        written = asyncio.get_running_loop().create_future()
+        self._unwritten.append((self._seq, written))
+        self._writes.put([self._seq, ops])
+        return written
+
+    # --- Balances ---
+    async def get_balance(self, currency: str, user_id: int) -> int:
+        return self._balances[currency].get(user_id, 0)
+
+    async def all_balances(self, currency: str) -> List[Tuple[int, int]]:
+        return list(self._balances[currency].items())
+
+    async def all_accounts(self) -> List[Dict[str, Any]]:
+        ssc, grr = self._balances['ssc'], self._balances['grr']
+        rows = [
+            {'user_id': user_id, 'ssc_balance': ssc.get(user_id, 0), 'grr_balance': grr.get(user_id, 0)}
+            for user_id in ssc.keys() | grr.keys()
+        ]
+        rows.sort(key=lambda row: (row['ssc_balance'], row['grr_balance']), reverse=True)
+        return rows
+
+    async def list_account_ids(self, after_user_id: int, limit: int) -> List[int]:
+        accounts = self._balances['ssc'].keys() | self._balances['grr'].keys()
+        return heapq.nsmallest(limit, (user_id for user_id in accounts if user_id > after_user_id))
+
+    async def search_accounts(self, sort: str, cursor: Optional[str], limit: int,
+                              user_ids: Optional[List[int]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        other_currency = 'grr' if sort == 'ssc' else 'ssc'
+        primary, other = self._balances[sort], self._balances[other_currency]
+        primary_col, other_col = f"{sort}_balance", f"{other_currency}_balance"
+        phase, after_balance, after_id = decode_search_cursor(cursor)
+
+        def row(user_id: int) -> Dict[str, Any]:
+            return {'user_id': user_id, primary_col: primary.get(user_id, 0), other_col: other.get(user_id, 0)}
+
+        # Each page picks its rows with heapq.nlargest over the keys past the cursor, O(n log limit),
+        # rather than sorting every account.
+        if user_ids is not None:
+            keys = ((primary.get(user_id, 0), user_id) for user_id in set(user_ids) if user_id in primary or user_id in other)
+            if phase == 'q':
+                keys = (key for key in keys if key < (after_balance, after_id))
+            keys = heapq.nlargest(limit, keys)
+            rows = [row(user_id) for _, user_id in keys]
+            next_cursor = encode_search_cursor('q', *keys[-1]) if len(rows) == limit else None
+            return rows, next_cursor
+
+        rows: List[Dict[str, Any]] = []
+        if phase == 'a':
+            keys = ((balance, user_id) for user_id, balance in primary.items())
+            if after_id is not None:
+                keys = (key for key in keys if key < (after_balance, after_id))
+            keys = heapq.nlargest(limit, keys)
+            rows = [row(user_id) for _, user_id in keys]
+            if len(rows) == limit:
+                return rows, encode_search_cursor('a', *keys[-1])
+            after_id = None
+
+        remaining = limit - len(rows)
+        orphans = (user_id for user_id in other if user_id not in primary)
+        if after_id is not None:
+            orphans = (user_id for user_id in orphans if user_id < after_id)
+        orphans = heapq.nlargest(remaining, orphans)
+        rows.extend(row(user_id) for user_id in orphans)
+        next_cursor = encode_search_cursor('b', 0, orphans[-1]) if orphans and len(orphans) == remaining else None
+        return rows, next_cursor
+
+    async def credit(self, currency: str, user_id: int, amount: int) -> int:
+        balance = self._balances[currency].get(user_id, 0) + amount
+        await self._commit([OP_BALANCE, currency, user_id, balance])
+        return balance
+
+    def _covers(self, currency: str, user_id: int, amount: int) -> bool:
+        return self._balances[currency].get(user_id, 0) >= amount
+
+    async def transfer(self, currency: str, sender_id: int, recipient_id: int, amount: int) -> bool:
+        balances = self._balances[currency]
+        if not self._covers(currency, sender_id, amount):
+            return False
+        sender_balance = balances.get(sender_id, 0) - amount
+        # The recipient's balance is read after the debit in case they are the sender.
+        ops = [[OP_BALANCE, currency, sender_id, sender_balance]]
+        recipient_base = sender_balance if recipient_id == sender_id else balances.get(recipient_id, 0)
+        ops.append([OP_BALANCE, currency, recipient_id, recipient_base + amount])
+        await self._commit(*ops)
+        return True
+
+    async def settle_wager(self, user_id: int, stake: int, payout: int) -> Optional[int]:
+        if user_id not in self._balances['grr'] or not self._covers('grr', user_id, stake):
+            return None
+        balance = self._balances['grr'][user_id] - stake + payout
+        await self._commit([OP_BALANCE, 'grr', user_id, balance])
+        return balance
+
+    async def exchange(self, user_id: int, grr_cost: int, ssc_reward: int) -> bool:
+        if not self._covers('grr', user_id, grr_cost):
+            return False
+        await self._commit(
+            [OP_BALANCE, 'grr', user_id, self._balances['grr'].get(user_id, 0) - grr_cost],
+            [OP_BALANCE, 'ssc', user_id, self._balances['ssc'].get(user_id, 0) + ssc_reward],
+        )
+        return True
+
+    async def set_balances(self, rows: List[Tuple[int, int, int]]):
+        ops = []
+        for user_id, ssc, grr in rows:
+            ops.append([OP_BALANCE, 'ssc', user_id, ssc])
+            ops.append([OP_BALANCE, 'grr', user_id, grr])
+        await self._commit(*ops)
+
+    async def prune_empty(self, today: str, batch_size: int) -> int:
+        ops = [[OP_REMOVE_ACCOUNT, 'ssc', user_id] for user_id, balance in self._balances['ssc'].items() if balance == 0]
+        ops += [
+            [OP_REMOVE_ACCOUNT, 'grr', user_id] for user_id, balance in self._balances['grr'].items()
+            if balance == 0 and (self._last_daily.get(user_id) or '') < today
+        ]
+        # Journaled in batches to keep each line a sensible size, all applied before the first wait.
+        await asyncio.gather(*[self._commit(*ops[i:i + batch_size]) for i in range(0, len(ops), batch_size)])
+        return len(ops)
+
+    # --- Daily claims ---
+    async def claim_daily(self, user_id: int, amount: int, today: str) -> bool:
+        if self._last_daily.get(user_id) == today:
+            return False
+        await self._commit(
+            [OP_BALANCE, 'grr', user_id, self._balances['grr'].get(user_id, 0) + amount],
+            [OP_DAILY, user_id, today],
+        )
+        return True
+
+    # --- Shop ---
+    async def get_shop_items(self, guild_id: int) -> List[Dict[str, Any]]:
+        return [dict(item) for item in self._items.values() if item['guild_id'] == guild_id]
+
+    async def add_shop_item(self, guild_id: int, name: str, cost: int, role_id: int,
+                            image_url: Optional[str], one_time_buy: bool) -> bool:
+        if (guild_id, name) in self._item_ids:
+            return False
+        item_id = self._next_item_id
+        await self._commit([OP_ITEM, item_id, {
+            'item_id': item_id, 'guild_id': guild_id, 'name': name, 'cost': cost, 'role_id': role_id,
+            'image_url': image_url, 'is_one_time_buy': int(bool(one_time_buy)), 'purchased_by_user_id': None,
+        }])
+        return True
+
+    def _update_item(self, item_id: int, fields: Dict[str, Any]) -> list:
+        item = dict(self._items[item_id])
+        item.update(fields)
+        return [OP_ITEM, item_id, item]
+
+    async def update_shop_item(self, item_id: int, fields: Dict[str, Any]):
+        item = self._items.get(item_id)
+        if item is None:
+            return
+        renamed = fields.get('name', item['name'])
+        if renamed != item['name'] and (item['guild_id'], renamed) in self._item_ids:
+            raise ValueError(f"An item named '{renamed}' already exists.")
+        await self._commit(self._update_item(item_id, fields))
+
+    async def mark_item_as_purchased(self, item_id: int, user_id: int):
+        if item_id in self._items:
+            await self._commit(self._update_item(item_id, {'purchased_by_user_id': user_id}))
+
+    async def purchase_item(self, guild_id: int, name: str, user_id: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+        item_id = self._item_ids.get((guild_id, name))
+        if item_id is None:
+            return "not_found", None
+        item = dict(self._items[item_id])
+        if item['is_one_time_buy'] and item['purchased_by_user_id'] is not None:
+            return "already_claimed", item
+        if not self._covers('ssc', user_id, item['cost']):
+            return "insufficient_funds", item
+        ops = [[OP_BALANCE, 'ssc', user_id, self._balances['ssc'].get(user_id, 0) - item['cost']]]
+        if item['is_one_time_buy']:
+            item['purchased_by_user_id'] = user_id
+            ops.append(self._update_item(item_id, {'purchased_by_user_id': user_id}))
+        await self._commit(*ops)
+        return "success", item
+
+    async def release_purchase(self, item: Dict[str, Any], user_id: int):
+        ops = [[OP_BALANCE, 'ssc', user_id, self._balances['ssc'].get(user_id, 0) + item['cost']]]
+        current = self._items.get(item['item_id'])
+        if item['is_one_time_buy'] and current is not None and current['purchased_by_user_id'] == user_id:
+            ops.append(self._update_item(item['item_id'], {'purchased_by_user_id': None}))
+        await self._commit(*ops)
+
+    async def remove_shop_item(self, guild_id: int, name: str) -> bool:
+        item_id = self._item_ids.get((guild_id, name))
+        if item_id is None:
+            return False
+        await self._commit([OP_REMOVE_ITEM, item_id])
+        return True
+
+    async def delete_shop_item(self, item_id: int):
+        if item_id in self._items:
+            await self._commit([OP_REMOVE_ITEM, item_id])
+
+    # --- Config ---
+    async def get_config(self) -> Dict[str, str]:
+        return dict(self._config)
+
+    async def set_config(self, values: Dict[str, str]):
+        await self._commit([OP_CONFIG, dict(values)])
@@ -0,0 +1,178 @@
+"""
+In-process metrics, served at /metrics by the admin panel in Prometheus text format.
+
+Metrics are declared at module level next to the code they measure. Recording a value is
+a dict lookup and a couple of additions (callers can bind `labels(...)` once and skip the
+lookup too), so instrumentation stays on in production.
+"""
+import abc
+import bisect
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Latency buckets in seconds, from a cached read to a slow Discord request.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _escape(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class _Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A new series, made the first time `labels` sees its values."""
+
+    def labels(self, *values) -> object:
+        """The series for these label values, created on first use."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def _samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        """(suffix, extra label names, label values, value) for every series."""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape_help(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        for suffix, extra_names, values, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_label_text(self.labelnames + extra_names, values)} {_format_value(value)}")
+        return lines
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+class Counter(_Metric):
+    """A value that only goes up, such as requests made."""
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, *labels, amount: float = 1):
+        self.labels(*labels).inc(amount)
+
+    def _samples(self):
+        return [("", (), key, child.value) for key, child in self._children.items()]
+
+class _GaugeChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down. Set it directly, or give `function` to have it read
+    at scrape time (for queue depths and pool sizes that already live somewhere).
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, *labels, value: float):
+        self.labels(*labels).set(value)
+
+    def _samples(self):
+        if self.function is not None:
+            return [("", (), (), self.function())]
+        return [("", (), key, child.value) for key, child in self._children.items()]
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Per-bucket counts, not cumulative; the last one is +Inf.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(_Metric):
+    """Observations (usually durations in seconds) counted into fixed buckets."""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float, *labels):
+        self.labels(*labels).observe(value)
+
+    def _samples(self):
+        samples = []
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                samples.append(("_bucket", ("le",), key + (_format_value(float(bound)),), cumulative))
+            samples.append(("_sum", (), key, child.sum))
+            samples.append(("_count", (), key, child.count))
+        return samples
+
+REGISTRY: List[_Metric] = []
+
+def render() -> str:
+    """Every registered metric in Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,275 @@
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple
+
+import discord
+
+# Local imports
+import database as db
+import spans
+
+# Discord's per-message limits.
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_CHARS_PER_MESSAGE = 6000
+
+def _fits_in_message(embeds: List[discord.Embed]) -> int:
+    """Returns how many leading embeds fit in one message (always at least one)."""
+    chars = 0
+    for i, embed in enumerate(embeds):
+        chars += len(embed)
+        if i == MAX_EMBEDS_PER_MESSAGE or (i and chars > MAX_CHARS_PER_MESSAGE):
+            return i
+    return len(embeds)
+
+# --- Admin Log Channel Pipeline ---
+class AdminLogPipeline:
+    """
+    Posts admin log embeds from a background worker so commands never wait on Discord.
+    The worker saves embeds to SQLite as soon as it takes them off the queue, then packs
+    them up to Discord's per-message limits and sends them. Saved embeds stay in SQLite
+    until they have been delivered, so a restart doesn't lose them.
+    """
+    # How long the worker waits for more embeds before sending a partial message.
+    FLUSH_INTERVAL = 2.0
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, bot: discord.Client, channel_id: int):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.queue: "asyncio.Queue[discord.Embed]" = asyncio.Queue()
+        self._channel: Optional[discord.abc.Messageable] = None
+        self._task: Optional[asyncio.Task] = None
+        # Embeds taken off the queue but not yet saved.
+        self._unsaved: List[discord.Embed] = []
+        # The save in progress and its embeds. It runs shielded, so stop() can wait for it.
+        self._saving: Optional[asyncio.Future] = None
+        self._saving_embeds: List[discord.Embed] = []
+        # Saved (log_id, embed) entries not yet delivered.
+        self._saved: List[Tuple[int, discord.Embed]] = []
+
+    def submit(self, embed: discord.Embed):
+        """Queues an embed for the log channel and returns immediately."""
+        self.queue.put_nowait(embed)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the worker and saves anything not yet saved, for the next run to send."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        leftovers = []
+        if self._saving is not None:
+            # The worker's last save carries on without it; only a failed one leaves work here.
+            try:
+                await self._saving
+            except Exception:
+                leftovers.extend(self._saving_embeds)
+            self._saving = None
+        leftovers.extend(self._unsaved)
+        self._unsaved = []
+        while not self.queue.empty():
+            leftovers.append(self.queue.get_nowait())
+        if leftovers:
+            await db.add_pending_logs([json.dumps(embed.to_dict()) for embed in leftovers])
+
+    async def _get_channel(self) -> discord.abc.Messageable:
+        if self._channel is None:
+            self._channel = self.bot.get_channel(self.channel_id) or await self.bot.fetch_channel(self.channel_id)
+        return self._channel
+
+    async def _save(self):
+        """Saves every embed taken off (or still waiting in) the queue."""
+        while not self.queue.empty():
+            self._unsaved.append(self.queue.get_nowait())
+        embeds, self._unsaved = self._unsaved, []
+        self._saving_embeds = embeds
+        self._saving = asyncio.ensure_future(db.add_pending_logs([json.dumps(embed.to_dict()) for embed in embeds]))
+        try:
+            log_ids = await asyncio.shield(self._saving)
+        except Exception:
+            self._unsaved = embeds + self._unsaved
+            self._saving = None
+            raise
+        self._saving = None
+        self._saved.extend(zip(log_ids, embeds))
+
+    async def _get(self, timeout: float) -> bool:
+        """Moves the next queued embed to _unsaved, waiting up to `timeout`. Returns False on timeout."""
+        # Not asyncio.wait_for, which can swallow a cancellation that lands as an embed arrives.
+        getter = asyncio.ensure_future(self.queue.get())
+        try:
+            await asyncio.wait([getter], timeout=timeout)
+        finally:
+            got = getter.done()
+            if got:
+                self._unsaved.append(getter.result())
+            else:
+                getter.cancel()
+        return got
+
+    async def _collect(self):
+        """Saves embeds as they arrive until a message is full or FLUSH_INTERVAL passes."""
+        if not self._unsaved:
+            self._unsaved.append(await self.queue.get())
+        await self._save()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.FLUSH_INTERVAL
+        while len(self._saved) < MAX_EMBEDS_PER_MESSAGE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if not await self._get(remaining):
+                break
+            await self._save()
+
+    async def _send(self, entries: List[Tuple[int, discord.Embed]]):
+        """Sends one packed message, retrying rate limits and server errors with backoff."""
+        backoff = 1.0
+        while True:
+            try:
+                channel = await self._get_channel()
+                await channel.send(embeds=[embed for _, embed in entries])
+                return
+            except (discord.NotFound, discord.Forbidden) as e:
+                print(f"ERROR: Could not send to admin log channel ({self.channel_id}), dropping {len(entries)} log(s). {e}")
+                return
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    delay = float(getattr(e, 'retry_after', None) or backoff)
+                elif e.status >= 500:
+                    delay = backoff
+                else:
+                    print(f"ERROR: Admin log channel rejected {len(entries)} log(s). {e}")
+                    return
+            except Exception as e:
+                print(f"ERROR: Failed to send log to admin channel, retrying. {e}")
+                delay = backoff
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+    async def _drain(self):
+        while self._saved:
+            count = _fits_in_message([embed for _, embed in self._saved])
+            message = self._saved[:count]
+            # Traced on its own, apart from the commands whose logs it carries.
+            with spans.trace("admin log delivery", embeds=len(message)):
+                await self._send(message)
+                del self._saved[:count]
+                await db.delete_pending_logs([log_id for log_id, _ in message])
+
+    async def _load_backlog(self) -> bool:
+        """Loads the next page of logs left over from previous runs. Returns False once none are left."""
+        pending = await db.get_pending_logs()
+        self._saved = [(row['log_id'], discord.Embed.from_dict(json.loads(row['payload']))) for row in pending]
+        return bool(pending)
+
+    async def _run(self):
+        # Anything left over from previous runs goes out first, however many pages it takes.
+        backlog = True
+        while True:
+            try:
+                while backlog:
+                    await self._drain()
+                    backlog = await self._load_backlog()
+                await self._drain()
+                await self._collect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERROR: Admin log pipeline failed on {len(self._unsaved) + len(self._saved)} log(s), retrying. {e}")
+                await asyncio.sleep(self.FLUSH_INTERVAL)
+
+# --- Constellation Purchase DMs ---
+class ConstellationNotifier:
+    """
+    DMs purchase logs to every Constellation from the background. Purchases made within
+    DIGEST_WINDOW seconds of each other are sent together as one digest per Constellation.
+    """
+    DIGEST_WINDOW = 5.0
+    DM_CONCURRENCY = 5
+
+    def __init__(self, bot: discord.Client, user_ids: List[int]):
+        self.bot = bot
+        self.user_ids = user_ids
+        self._pending: List[discord.Embed] = []
+        # Waits out the digest window, then sends; kept until the send is done so stop() can wait for it.
+        self._flush_task: Optional[asyncio.Task] = None
+        self._waiting = False
+        self._stopping = False
+        self._dm_channels: Dict[int, discord.DMChannel] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def submit(self, embed: discord.Embed):
+        """Adds an embed to the current digest and returns immediately."""
+        self._pending.append(embed)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def stop(self):
+        """Sends the current digest right away instead of waiting for the window to close."""
+        task = self._flush_task
+        if task is not None:
+            self._stopping = True
+            # A digest already being sent is finished, not cut off.
+            if self._waiting:
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            self._stopping = False
+        await self._flush()
+
+    async def _flush_later(self):
+        try:
+            # Purchases made while a digest is being sent start the next window.
+            while self._pending and not self._stopping:
+                self._waiting = True
+                await asyncio.sleep(self.DIGEST_WINDOW)
+                self._waiting = False
+                await self._flush()
+        finally:
+            self._waiting = False
+            self._flush_task = None
+
+    async def _flush(self):
+        embeds, self._pending = self._pending, []
+        if not embeds:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.DM_CONCURRENCY)
+        # The flush task was started by a command; it gets a trace of its own.
+        with spans.trace("constellation digest", purchases=len(embeds)):
+            await asyncio.gather(*(self._send_digest(user_id, embeds) for user_id in self.user_ids))
+
+    async def _get_dm_channel(self, user_id: int) -> Optional[discord.DMChannel]:
+        channel = self._dm_channels.get(user_id)
+        if channel is None:
+            user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+            if user.bot:
+                return None
+            channel = user.dm_channel or await user.create_dm()
+            self._dm_channels[user_id] = channel
+        return channel
+
+    async def _send_digest(self, user_id: int, embeds: List[discord.Embed]):
+        async with self._semaphore:
+            try:
+                channel = await self._get_dm_channel(user_id)
+                while channel and embeds:
+                    count = _fits_in_message(embeds)
+                    await channel.send(embeds=embeds[:count])
+                    embeds = embeds[count:]
+            except discord.Forbidden:
+                # DMs closed; forget the channel so it's re-created if they reopen them.
+                self._dm_channels.pop(user_id, None)
+                print(f"ERROR: Could not DM Constellation {user_id}: DMs are closed.")
+            except Exception as e:
+                print(f"ERROR: Could not DM Constellation {user_id}: {e}")
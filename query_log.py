@@ -0,0 +1,259 @@
+"""
+Optional statement tracing for database.py (see set_query_tracing). While it's on, the
+connections handed out by ConnectionManager are wrapped so that every statement is timed,
+including the fetches that read its rows. The log keeps per-statement totals, the
+slowest single executions of the last ROLLING_WINDOW seconds with the shape of their
+parameters, and each statement's EXPLAIN QUERY PLAN, captured the first time it runs.
+"""
+import math
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import aiosqlite
+
+MAX_SLOW_QUERIES = 50
+ROLLING_WINDOW = 60 * 60
+# Distinct statements tracked; more than this (say, from varying IN (...) lists) go uncounted.
+MAX_STATEMENTS = 500
+
+def _normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+def _shape_of(value: Any) -> str:
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+def parameters_shape(parameters: Any) -> str:
+    """The types (and string lengths) of a statement's parameters, without their values."""
+    if parameters is None:
+        return "()"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: {_shape_of(value)}" for name, value in parameters.items()) + "}"
+    return "(" + ", ".join(_shape_of(value) for value in parameters) + ")"
+
+def full_scans(plan: List[str]) -> List[str]:
+    """Plan steps that read a whole table rather than searching an index."""
+    steps = [step.strip() for step in plan]
+    return [step for step in steps if step.startswith("SCAN ") and "INDEX" not in step and "CONSTANT ROW" not in step]
+
+class StatementStats:
+    __slots__ = ('sql', 'count', 'total', 'max', 'plan', 'plan_error')
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.plan: Optional[List[str]] = None
+        self.plan_error: Optional[str] = None
+
+    @property
+    def full_scans(self) -> List[str]:
+        return full_scans(self.plan or [])
+
+class QueryLog:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.statements: Dict[str, StatementStats] = {}
+        self.untracked = 0
+        self._slowest: List[Dict[str, Any]] = []
+        # Shortest duration in a full _slowest list, and when its oldest entry expires.
+        self._floor = 0.0
+        self._expires_at = math.inf
+
+    # --- Recording ---
+    def _statement(self, sql: str) -> Optional[StatementStats]:
+        key = _normalize(sql)
+        stats = self.statements.get(key)
+        if stats is None:
+            if len(self.statements) >= MAX_STATEMENTS:
+                self.untracked += 1
+                return None
+            stats = self.statements[key] = StatementStats(key)
+        return stats
+
+    async def _capture_plan(self, conn: aiosqlite.Connection, stats: StatementStats, sql: str, parameters: Any):
+        stats.plan = []
+        try:
+            rows = await conn.execute_fetchall(f"EXPLAIN QUERY PLAN {sql}", parameters if parameters is not None else ())
+        except sqlite3.Error as e:
+            # PRAGMAs and DDL have no query plan.
+            stats.plan_error = str(e)
+            return
+        depth = {0: -1}
+        for row in rows:
+            node_id, parent = row[0], row[1]
+            depth[node_id] = depth.get(parent, -1) + 1
+            stats.plan.append("  " * depth[node_id] + row[3])
+
+    async def begin(self, conn: aiosqlite.Connection, sql: str, parameters: Any, shape: str) -> Optional[Dict[str, Any]]:
+        """Starts timing one execution. Returns the sample that later fetches add their time to."""
+        stats = self._statement(sql)
+        if stats is None:
+            return None
+        if stats.plan is None:
+            await self._capture_plan(conn, stats, sql, parameters)
+        stats.count += 1
+        return {'stats': stats, 'shape': shape, 'seconds': 0.0, 'at': time.time(), 'ranked': False}
+
+    def add(self, sample: Optional[Dict[str, Any]], seconds: float):
+        if sample is None:
+            return
+        stats = sample['stats']
+        stats.total += seconds
+        sample['seconds'] += seconds
+        if sample['seconds'] > stats.max:
+            stats.max = sample['seconds']
+        if not sample['ranked']:
+            self._rank(sample)
+
+    def _rank(self, sample: Dict[str, Any]):
+        slowest = self._slowest
+        if len(slowest) >= MAX_SLOW_QUERIES:
+            now = time.time()
+            if now >= self._expires_at:
+                kept = []
+                for entry in slowest:
+                    if now - entry['at'] < ROLLING_WINDOW:
+                        kept.append(entry)
+                    else:
+                        entry['ranked'] = False
+                slowest[:] = kept
+            if len(slowest) >= MAX_SLOW_QUERIES:
+                if sample['seconds'] <= self._floor:
+                    return
+                # Ranked samples only grow, so the floor can be stale; find the real minimum.
+                victim = min(slowest, key=lambda entry: entry['seconds'])
+                if sample['seconds'] <= victim['seconds']:
+                    self._floor = victim['seconds']
+                    return
+                victim['ranked'] = False
+                slowest.remove(victim)
+        sample['ranked'] = True
+        slowest.append(sample)
+        full = len(slowest) >= MAX_SLOW_QUERIES
+        self._floor = min(entry['seconds'] for entry in slowest) if full else 0.0
+        self._expires_at = min(entry['at'] for entry in slowest) + ROLLING_WINDOW if full else math.inf
+
+    # --- Reading ---
+    def slowest(self) -> List[Dict[str, Any]]:
+        """The slowest executions of the rolling window, slowest first."""
+        cutoff = time.time() - ROLLING_WINDOW
+        return [
+            {'sql': entry['stats'].sql, 'shape': entry['shape'], 'ms': entry['seconds'] * 1000, 'at': entry['at']}
+            for entry in sorted(self._slowest, key=lambda entry: entry['seconds'], reverse=True)
+            if entry['at'] >= cutoff
+        ]
+
+    def by_total_time(self) -> List[StatementStats]:
+        return sorted(self.statements.values(), key=lambda stats: stats.total, reverse=True)
+
+# --- Connection wrappers ---
+class _TracedResult:
+    """What TracedConnection.execute/cursor return: awaitable, or usable with `async with`."""
+
+    def __init__(self, coro):
+        self._coro = coro
+        self._cursor: Optional["TracedCursor"] = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self) -> "TracedCursor":
+        self._cursor = await self._coro
+        return self._cursor
+
+    async def __aexit__(self, *exc_info):
+        await self._cursor.close()
+
+class TracedCursor:
+    """An aiosqlite Cursor whose executes and fetches are timed."""
+
+    def __init__(self, cursor: aiosqlite.Cursor, traced: "TracedConnection", sample: Optional[Dict[str, Any]] = None):
+        self._cursor = cursor
+        self._traced = traced
+        self._sample = sample
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    async def execute(self, sql: str, parameters: Optional[Iterable[Any]] = None) -> "TracedCursor":
+        self._sample = await self._traced._log.begin(self._traced._conn, sql, parameters, parameters_shape(parameters))
+        start = time.perf_counter()
+        try:
+            await self._cursor.execute(sql, parameters)
+        finally:
+            self._traced._log.add(self._sample, time.perf_counter() - start)
+        return self
+
+    async def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return await fetch(*args)
+        finally:
+            self._traced._log.add(self._sample, time.perf_counter() - start)
+
+    async def fetchone(self):
+        return await self._timed_fetch(self._cursor.fetchone)
+
+    async def fetchmany(self, size: Optional[int] = None):
+        return await self._timed_fetch(self._cursor.fetchmany, size)
+
+    async def fetchall(self):
+        return await self._timed_fetch(self._cursor.fetchall)
+
+    async def close(self):
+        await self._cursor.close()
+
+    async def __aenter__(self) -> "TracedCursor":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class TracedConnection:
+    """Wraps an aiosqlite Connection so its statements are recorded in a QueryLog."""
+
+    def __init__(self, conn: aiosqlite.Connection, log: QueryLog):
+        self._conn = conn
+        self._log = log
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+    async def _execute(self, sql: str, parameters: Optional[Iterable[Any]]) -> TracedCursor:
+        sample = await self._log.begin(self._conn, sql, parameters, parameters_shape(parameters))
+        start = time.perf_counter()
+        try:
+            cursor = await self._conn.execute(sql, parameters)
+        finally:
+            self._log.add(sample, time.perf_counter() - start)
+        return TracedCursor(cursor, self, sample)
+
+    def execute(self, sql: str, parameters: Optional[Iterable[Any]] = None) -> _TracedResult:
+        return _TracedResult(self._execute(sql, parameters))
+
+    async def _cursor(self) -> TracedCursor:
+        return TracedCursor(await self._conn.cursor(), self)
+
+    def cursor(self) -> _TracedResult:
+        return _TracedResult(self._cursor())
+
+    async def executemany(self, sql: str, parameters: Iterable[Iterable[Any]]) -> aiosqlite.Cursor:
+        parameters = list(parameters)
+        shape = f"{len(parameters)} x {parameters_shape(parameters[0])}" if parameters else "0 x ()"
+        sample = await self._log.begin(self._conn, sql, parameters[0] if parameters else None, shape)
+        start = time.perf_counter()
+        try:
+            return await self._conn.executemany(sql, parameters)
+        finally:
+            self._log.add(sample, time.perf_counter() - start)
+
+    async def execute_fetchall(self, sql: str, parameters: Optional[Iterable[Any]] = None):
+        async with self.execute(sql, parameters) as cursor:
+            return await cursor.fetchall()
@@ -0,0 +1,60 @@
+import collections
+import time
+from typing import Hashable, Optional
+
+class TokenBucket:
+    """Allows `burst` actions at once, refilling at `rate` tokens per second."""
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+        # Set once a denial has been reported, cleared by the next allowed action.
+        self.warned = False
+
+    def take(self, now: float) -> float:
+        """Takes a token if there is one. Returns 0, or the seconds until a token is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.warned = False
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    """
+    One token bucket per key (a user ID, say), all with the same rate and burst. Only the
+    `max_keys` most recently seen keys are tracked; a forgotten key starts with a full bucket,
+    which is what it would have refilled to anyway unless it was evicted mid-spam.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "collections.OrderedDict[Hashable, TokenBucket]" = collections.OrderedDict()
+
+    def _bucket(self, key: Hashable, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def check(self, key: Hashable, now: Optional[float] = None) -> float:
+        """Takes a token for `key`. Returns 0 if allowed, else the seconds until it would be."""
+        now = time.monotonic() if now is None else now
+        return self._bucket(key, now).take(now)
+
+    def warn_once(self, key: Hashable) -> bool:
+        """True the first time it's asked after a denial, so a spammer is told only once per cooldown."""
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.warned:
+            return False
+        bucket.warned = True
+        return True
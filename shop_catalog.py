@@ -0,0 +1,37 @@
+from bisect import bisect_left
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+class ShopCatalog:
+    """
+    One guild's shop items held in memory, with a sorted name index so autocomplete
+    prefix lookups are a bisect instead of a table scan. database.py builds it on first
+    use and throws it away whenever a write touches that guild's items.
+    """
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        # Ordered by cost, matching get_all_shop_items.
+        self._items: List[Dict[str, Any]] = sorted(rows, key=lambda item: (item['cost'], item['item_id']))
+        self._by_name: Dict[str, Dict[str, Any]] = {item['name']: item for item in self._items}
+        # (lowercased name, name), sorted, for case-insensitive prefix search.
+        self._name_index: List[Tuple[str, str]] = sorted((item['name'].lower(), item['name']) for item in self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        item = self._by_name.get(name)
+        return dict(item) if item else None
+
+    def all(self) -> List[Dict[str, Any]]:
+        return [dict(item) for item in self._items]
+
+    def names_starting_with(self, prefix: str, limit: int) -> List[str]:
+        """Returns up to `limit` item names starting with `prefix` (case-insensitive), alphabetically."""
+        prefix = prefix.lower()
+        names = []
+        for i in range(bisect_left(self._name_index, (prefix,)), len(self._name_index)):
+            key, name = self._name_index[i]
+            if not key.startswith(prefix) or len(names) >= limit:
+                break
+            names.append(name)
+        return names
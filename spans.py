@@ -0,0 +1,231 @@
+"""
+Span tracing for commands. main.py opens a trace for each command it handles, and the
+database calls and Discord requests made on its behalf become spans inside it, so a slow
+command shows where its time went.
+
+    with spans.trace("/shop buy", user=ctx.author.id):
+        ...
+        with spans.span("db.purchase_item"):
+            ...
+
+The current span lives in a context variable, so tasks a command starts inherit it. Spans
+opened outside any trace, or after their trace has finished, record nothing. Completed
+traces go to the TraceLog passed to `enable`, which keeps the recent ones for the admin
+panel's Traces page and hands them to a writer thread that appends them to a rotating
+JSONL file, so the event loop never waits on the disk.
+"""
+import collections
+import contextvars
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+# A runaway loop inside one command stops adding spans here.
+MAX_SPANS_PER_TRACE = 500
+# Completed traces kept in memory; the Traces page shows the slowest of them.
+RECENT_TRACES = 2000
+SLOWEST_TRACES = 25
+# The trace file is rotated at this size, keeping this many older files (spans.jsonl.1, ...).
+MAX_FILE_BYTES = 10 * 1024 * 1024
+BACKUP_FILES = 5
+
+class _NoSpan:
+    """Stands in for a span when nothing is being traced."""
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    __slots__ = ('name', 'attributes', 'parent', 'trace', 'start', 'end', 'error', '_token')
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional["Span"], trace: "Trace"):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.trace = trace
+        self.start = 0.0
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        """Adds attributes learned while the span was running, such as a response status."""
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self.trace.spans.append(self)
+        self.start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        return False
+
+class Trace(Span):
+    """The root span of one command. Its spans are kept in the order they started."""
+    __slots__ = ('trace_id', 'started_at', 'spans', 'dropped', 'log')
+
+    def __init__(self, name: str, attributes: Dict[str, Any], log: "TraceLog"):
+        super().__init__(name, attributes, None, self)
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.log = log
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        try:
+            self.log.record(self.to_dict())
+        except Exception as e:
+            print(f"ERROR: Could not record trace '{self.name}'. {e}")
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        index = {id(span): i for i, span in enumerate(self.spans)}
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'at': round(self.started_at, 3),
+            'ms': round((self.end - self.start) * 1000, 3),
+            'dropped': self.dropped,
+            'spans': [
+                {
+                    'name': span.name,
+                    'parent': index.get(id(span.parent)),
+                    'start_ms': round((span.start - self.start) * 1000, 3),
+                    # Spans of background tasks can still be running when the command finishes.
+                    'ms': round((span.end - span.start) * 1000, 3) if span.end is not None else None,
+                    'attributes': span.attributes,
+                    'error': span.error,
+                }
+                for span in self.spans
+            ],
+        }
+
+_log: Optional["TraceLog"] = None
+
+def enable(log: "TraceLog"):
+    global _log
+    _log = log
+
+def disable():
+    """Stops tracing and closes the trace file."""
+    global _log
+    if _log is not None:
+        _log.close()
+    _log = None
+
+def get_log() -> Optional["TraceLog"]:
+    """The TraceLog completed traces go to, or None while tracing is off."""
+    return _log
+
+def trace(name: str, **attributes) -> Span:
+    """Starts a new trace, even inside another one (background work started by a command gets its own)."""
+    if _log is None:
+        return _NO_SPAN
+    return Trace(name, attributes, _log)
+
+def span(name: str, **attributes) -> Span:
+    """A child of the current span, or a no-op outside a running trace."""
+    parent = _current.get()
+    if parent is None:
+        return _NO_SPAN
+    root = parent.trace
+    if root.end is not None:
+        return _NO_SPAN
+    if len(root.spans) >= MAX_SPANS_PER_TRACE:
+        root.dropped += 1
+        return _NO_SPAN
+    return Span(name, attributes, parent, root)
+
+class TraceLog:
+    """Completed traces, kept in memory and, when `path` is set, appended to a JSONL file by a writer thread."""
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = MAX_FILE_BYTES, backups: int = BACKUP_FILES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.recent: "collections.deque[Dict[str, Any]]" = collections.deque(maxlen=RECENT_TRACES)
+        self._file = None
+        self._size = 0
+        # Traces waiting for the writer thread; None tells it to finish.
+        self._queue: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._open()
+            self._writer = threading.Thread(target=self._write_all, name="trace-log-writer", daemon=True)
+            self._writer.start()
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def record(self, entry: Dict[str, Any]):
+        self.recent.append(entry)
+        if self._writer is not None:
+            self._queue.put(entry)
+
+    # --- Writer thread ---
+    def _write(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, default=str) + "\n"
+        if self._size and self._size + len(line) > self.max_bytes:
+            self._rotate()
+        self._file.write(line)
+        self._size += len(line)
+
+    def _write_all(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                break
+            try:
+                self._write(entry)
+                # Flushed once the queue runs dry rather than after every trace.
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                print(f"ERROR: Could not write trace to {self.path}. {e}")
+        self._file.close()
+        self._file = None
+
+    def slowest(self, limit: int = SLOWEST_TRACES) -> List[Dict[str, Any]]:
+        """The slowest of the recent traces, slowest first."""
+        return heapq.nlargest(limit, self.recent, key=lambda entry: entry['ms'])
+
+    def close(self):
+        """Writes out every queued trace and closes the file."""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
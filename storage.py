@@ -0,0 +1,157 @@
+import abc
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+# The two currencies every engine keeps balances for.
+CURRENCIES = ('ssc', 'grr')
+
+# Shop columns update_shop_item may change, and how to normalize what callers pass.
+SHOP_ITEM_FIELDS: Dict[str, Callable[[Any], Any]] = {
+    'name': str,
+    'cost': int,
+    'role_id': int,
+    'image_url': lambda value: value or None,
+    'is_one_time_buy': lambda value: int(bool(value)),
+}
+
+# --- Account search cursors ---
+# Shared by every engine so a cursor stays meaningful whichever one produced it:
+# "a:<balance>:<id>" walks accounts in the sorted currency, "b:0:<id>" lists accounts
+# that only exist in the other currency, "q:<balance>:<id>" pages through query matches.
+
+def encode_search_cursor(phase: str, balance: int, user_id: int) -> str:
+    return f"{phase}:{balance}:{user_id}"
+
+def decode_search_cursor(cursor: Optional[str]) -> Tuple[str, Optional[int], Optional[int]]:
+    if not cursor:
+        return 'a', None, None
+    phase, balance, user_id = cursor.split(':')
+    if phase not in ('a', 'b', 'q'):
+        raise ValueError("Invalid cursor")
+    return phase, int(balance), int(user_id)
+
+class Storage(abc.ABC):
+    """
+    What database.py needs from a storage engine: balances, daily claims, the shop and config.
+
+    Engines call the on_* hooks as each change is committed, in the order the changes
+    were made; database.py points them at its in-memory caches and leaderboards.
+    Balance lookups treat a missing account as holding 0.
+    """
+
+    def __init__(self):
+        self.on_balance: Callable[[str, int, int], None] = lambda currency, user_id, balance: None
+        self.on_accounts_removed: Callable[[str, List[int]], None] = lambda currency, user_ids: None
+        self.on_shop_change: Callable[[int], None] = lambda guild_id: None
+        self.on_config_change: Callable[[Dict[str, str]], None] = lambda values: None
+
+    @abc.abstractmethod
+    async def open(self):
+        ...
+
+    @abc.abstractmethod
+    async def close(self):
+        ...
+
+    @abc.abstractmethod
+    async def export_state(self) -> Dict[str, Any]:
+        """
+        Everything the engine holds, for moving it to another engine: balances per currency
+        and last_daily as (user_id, value) lists, shop items as row dicts, and config.
+        """
+
+    # --- Balances ---
+    @abc.abstractmethod
+    async def get_balance(self, currency: str, user_id: int) -> int:
+        ...
+
+    @abc.abstractmethod
+    async def all_balances(self, currency: str) -> List[Tuple[int, int]]:
+        """Every (user_id, balance) account in the currency."""
+
+    @abc.abstractmethod
+    async def all_accounts(self) -> List[Dict[str, Any]]:
+        """Every account in either currency as user_id/ssc_balance/grr_balance, richest first."""
+
+    @abc.abstractmethod
+    async def list_account_ids(self, after_user_id: int, limit: int) -> List[int]:
+        """Account IDs in either currency, ascending, after the given ID."""
+
+    @abc.abstractmethod
+    async def search_accounts(self, sort: str, cursor: Optional[str], limit: int,
+                              user_ids: Optional[List[int]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of accounts ordered by the `sort` currency's balance, richest first. With
+        `user_ids`, only those accounts are listed. Returns the rows and the next cursor.
+        """
+
+    @abc.abstractmethod
+    async def credit(self, currency: str, user_id: int, amount: int) -> int:
+        """Adds `amount` (which may be negative) to a balance. Returns the new balance."""
+
+    @abc.abstractmethod
+    async def transfer(self, currency: str, sender_id: int, recipient_id: int, amount: int) -> bool:
+        """Moves `amount` between users if the sender has it."""
+
+    @abc.abstractmethod
+    async def settle_wager(self, user_id: int, stake: int, payout: int) -> Optional[int]:
+        """Debits a GRR stake and credits its payout. Returns the new balance, or None if the stake isn't covered."""
+
+    @abc.abstractmethod
+    async def exchange(self, user_id: int, grr_cost: int, ssc_reward: int) -> bool:
+        """Converts GRR into SSC if the user has the GRR."""
+
+    @abc.abstractmethod
+    async def set_balances(self, rows: List[Tuple[int, int, int]]):
+        """Sets (user_id, ssc, grr) balances, creating accounts as needed."""
+
+    @abc.abstractmethod
+    async def prune_empty(self, today: str, batch_size: int) -> int:
+        """Deletes zero-balance accounts, keeping GRR accounts that claimed `today`. Returns the count."""
+
+    # --- Daily claims ---
+    @abc.abstractmethod
+    async def claim_daily(self, user_id: int, amount: int, today: str) -> bool:
+        """Grants the daily GRR amount unless it was already claimed `today`."""
+
+    # --- Shop ---
+    @abc.abstractmethod
+    async def get_shop_items(self, guild_id: int) -> List[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    async def add_shop_item(self, guild_id: int, name: str, cost: int, role_id: int,
+                            image_url: Optional[str], one_time_buy: bool) -> bool:
+        """Returns False if the guild already has an item with that name."""
+
+    @abc.abstractmethod
+    async def update_shop_item(self, item_id: int, fields: Dict[str, Any]):
+        ...
+
+    @abc.abstractmethod
+    async def mark_item_as_purchased(self, item_id: int, user_id: int):
+        ...
+
+    @abc.abstractmethod
+    async def purchase_item(self, guild_id: int, name: str, user_id: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Atomically reserves a one-time item and debits its cost. See database.purchase_item."""
+
+    @abc.abstractmethod
+    async def release_purchase(self, item: Dict[str, Any], user_id: int):
+        ...
+
+    @abc.abstractmethod
+    async def remove_shop_item(self, guild_id: int, name: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def delete_shop_item(self, item_id: int):
+        ...
+
+    # --- Config ---
+    @abc.abstractmethod
+    async def get_config(self) -> Dict[str, str]:
+        ...
+
+    @abc.abstractmethod
+    async def set_config(self, values: Dict[str, str]):
+        ...
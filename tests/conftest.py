@@ -0,0 +1,20 @@
+"""
+Shared test setup. Tests may be plain functions or coroutines; coroutines run on a fresh
+event loop each. Anything touching database.py goes through `scratch_database` so it
+never sees starstream.db.
+"""
+import asyncio
+import inspect
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def pytest_pyfunc_call(pyfuncitem):
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
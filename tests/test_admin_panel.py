@@ -0,0 +1,52 @@
+"""The admin panel's login check, served through aiohttp's test client."""
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import admin_panel
+
+PASSWORD = "correct horse"
+
+@pytest.fixture(autouse=True)
+def password(monkeypatch):
+    monkeypatch.setenv('ADMIN_PANEL_PASSWORD', PASSWORD)
+
+async def _client() -> TestClient:
+    client = TestClient(TestServer(admin_panel.create_app()))
+    await client.start_server()
+    return client
+
+async def test_log_socket_refuses_anonymous_clients():
+    client = await _client()
+    try:
+        with pytest.raises(aiohttp.WSServerHandshakeError) as refused:
+            await client.ws_connect('/ws/logs')
+        assert refused.value.status == 401
+        assert not admin_panel.active_websockets
+        # Pages still send anonymous visitors to the login page.
+        response = await client.get('/traces', allow_redirects=False)
+        assert response.status == 302 and response.headers['Location'] == '/login'
+    finally:
+        await client.close()
+
+async def test_log_socket_streams_to_logged_in_clients():
+    client = await _client()
+    try:
+        response = await client.post('/login', data={'password': "wrong"}, allow_redirects=False)
+        assert response.headers['Location'] == '/login?error=1'
+        with pytest.raises(aiohttp.WSServerHandshakeError):
+            await client.ws_connect('/ws/logs')
+
+        response = await client.post('/login', data={'password': PASSWORD}, allow_redirects=False)
+        assert response.headers['Location'] == '/'
+        ws = await client.ws_connect('/ws/logs')
+        stall = {'type': 'loop_stall', 'payload': {'lag_ms': 300.0, 'stacks': []}}
+        admin_panel.publish(stall)
+        assert await ws.receive_json(timeout=2) == stall
+        await ws.close()
+
+        await client.get('/logout', allow_redirects=False)
+        with pytest.raises(aiohttp.WSServerHandshakeError):
+            await client.ws_connect('/ws/logs')
+    finally:
+        await client.close()
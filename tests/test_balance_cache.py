@@ -0,0 +1,98 @@
+"""The write-through balance caches, with BALANCE_CACHE_CHECK comparing every hit against storage."""
+import asyncio
+
+import pytest
+
+import database as db
+from bench.harness import scratch_database
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def backend(request, monkeypatch) -> str:
+    monkeypatch.setattr(db, 'BALANCE_CACHE_CHECK', True)
+    return request.param
+
+async def _assert_consistent():
+    assert await db.verify_balance_caches() == []
+
+async def test_write_through_on_credit_and_debit(backend):
+    async with scratch_database(backend):
+        assert await db.get_balance(1) == 0
+        await db.add_coins(1, 100)
+        assert db.ssc_balances.items()[1] == 100
+        await db.add_coins(1, -40)
+        await db.add_grr_coins(1, 30)
+        assert await db.transfer_coins(1, 2, 10)
+        assert await db.settle_grr_wager(1, 30, 45) == 45
+        assert await db.perform_grr_ssc_exchange(1, 45, 7)
+        assert await db.claim_daily_grr(3, 5) == "success"
+        assert (await db.get_balance(1), await db.get_grr_balance(1)) == (57, 0)
+        assert (await db.get_balance(2), await db.get_grr_balance(3)) == (10, 5)
+        await _assert_consistent()
+
+async def test_lru_eviction(backend, monkeypatch):
+    monkeypatch.setattr(db.ssc_balances, 'capacity', 3)
+    async with scratch_database(backend):
+        for user_id in range(1, 6):
+            await db.add_coins(user_id, user_id * 10)
+        assert sorted(db.ssc_balances.items()) == [3, 4, 5]
+        # Reading user 3 makes user 4 the least recently used.
+        assert await db.get_balance(3) == 30
+        assert await db.get_balance(1) == 10
+        assert sorted(db.ssc_balances.items()) == [1, 3, 5]
+        for user_id in range(1, 6):
+            assert await db.get_balance(user_id) == user_id * 10
+        await _assert_consistent()
+
+async def test_fill_racing_a_write_keeps_the_newer_balance(backend, monkeypatch):
+    async with scratch_database(backend):
+        await db.add_coins(1, 100)
+        db.ssc_balances.clear()
+        store = db._store()
+        read_balance = store.get_balance
+        read_done = asyncio.Event()
+        write_done = asyncio.Event()
+
+        async def slow_get_balance(currency, user_id):
+            # The read sees the old balance, then a write commits before the cache is filled.
+            balance = await read_balance(currency, user_id)
+            read_done.set()
+            await write_done.wait()
+            return balance
+
+        monkeypatch.setattr(store, 'get_balance', slow_get_balance)
+        reader = asyncio.create_task(db.get_balance(1))
+        await read_done.wait()
+        await db.add_coins(1, 50)
+        write_done.set()
+        assert await reader == 100
+        monkeypatch.setattr(store, 'get_balance', read_balance)
+
+        assert db.ssc_balances.items()[1] == 150
+        assert await db.get_balance(1) == 150
+        await _assert_consistent()
+
+async def test_bulk_admin_updates(backend):
+    async with scratch_database(backend):
+        for user_id in range(1, 4):
+            await db.add_coins(user_id, 5)
+            await db.get_grr_balance(user_id)
+        results = await db.update_user_balances_bulk([
+            {'user_id': 1, 'ssc': 100, 'grr': 200},
+            {'user_id': 'nope', 'ssc': 1, 'grr': 1},
+            {'user_id': 3, 'ssc': 0, 'grr': 7},
+        ])
+        assert [result['status'] for result in results] == ['success', 'error', 'success']
+        assert (await db.get_balance(1), await db.get_grr_balance(1)) == (100, 200)
+        assert (await db.get_balance(2), await db.get_grr_balance(2)) == (5, 0)
+        assert (await db.get_balance(3), await db.get_grr_balance(3)) == (0, 7)
+        await _assert_consistent()
+
+async def test_check_reports_and_repairs_divergence(backend, capsys):
+    async with scratch_database(backend):
+        await db.add_coins(1, 100)
+        # A cache that missed a write.
+        db.ssc_balances.put(1, 999)
+        assert await db.verify_balance_caches() == [{'currency': 'ssc', 'user_id': 1, 'cached': 999, 'stored': 100}]
+        assert await db.get_balance(1) == 100
+        assert "Balance cache for ssc says 999" in capsys.readouterr().out
+        await _assert_consistent()
@@ -0,0 +1,62 @@
+"""Command timing and outcome counts in main.py, whether the command succeeds, fails or raises."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from discord.ext import commands
+
+import main
+import metrics
+import spans
+
+def _ctx(name: str) -> SimpleNamespace:
+    return SimpleNamespace(command=SimpleNamespace(qualified_name=name), author=SimpleNamespace(id=7), command_failed=False)
+
+def _counts(command: str):
+    return (main.COMMANDS.labels(command, 'ok').value, main.COMMANDS.labels(command, 'error').value,
+            main.COMMAND_SECONDS.labels(command).count)
+
+@pytest.fixture
+def log():
+    log = spans.TraceLog()
+    spans.enable(log)
+    yield log
+    spans.disable()
+
+async def test_outcomes_are_recorded(monkeypatch, log):
+    async def invoke(self, ctx):
+        if ctx.command.qualified_name == "boom":
+            raise RuntimeError("handler blew up")
+        if ctx.command.qualified_name == "slow":
+            await asyncio.sleep(10)
+        ctx.command_failed = ctx.command.qualified_name == "fails"
+
+    monkeypatch.setattr(commands.Bot, 'invoke_application_command', invoke)
+    before = {name: _counts(f"/{name}") for name in ("works", "fails", "boom", "slow")}
+
+    await main.bot.invoke_application_command(_ctx("works"))
+    await main.bot.invoke_application_command(_ctx("fails"))
+    with pytest.raises(RuntimeError):
+        await main.bot.invoke_application_command(_ctx("boom"))
+    slow = asyncio.create_task(main.bot.invoke_application_command(_ctx("slow")))
+    await asyncio.sleep(0)
+    slow.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await slow
+
+    added = {name: tuple(a - b for a, b in zip(_counts(f"/{name}"), before[name])) for name in before}
+    # (ok, error, timed)
+    assert added == {'works': (1, 0, 1), 'fails': (0, 1, 1), 'boom': (0, 1, 1), 'slow': (0, 1, 1)}
+    outcomes = {entry['name']: entry['spans'][0]['attributes']['outcome'] for entry in log.recent}
+    assert outcomes == {'/works': 'ok', '/fails': 'error', '/boom': 'error', '/slow': 'error'}
+    assert [entry['spans'][0]['error'] for entry in log.recent][2:] == ['RuntimeError', 'CancelledError']
+
+def test_metric_types_must_define_their_series():
+    class Partial(metrics._Metric):
+        def _new_child(self):
+            return None
+
+    registered = len(metrics.REGISTRY)
+    with pytest.raises(TypeError):
+        Partial("starstream_partial", "Forgot _samples.")
+    assert len(metrics.REGISTRY) == registered
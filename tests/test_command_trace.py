@@ -0,0 +1,47 @@
+"""Recording commands to a trace file and reading them back."""
+import threading
+from types import SimpleNamespace
+
+import discord
+
+import command_trace
+
+def _message(user_id: int, content: str, mentions=()) -> SimpleNamespace:
+    return SimpleNamespace(author=SimpleNamespace(id=user_id), content=content,
+                           mentions=[SimpleNamespace(id=mention) for mention in mentions])
+
+def _slash(user_id: int, name: str, options) -> SimpleNamespace:
+    return SimpleNamespace(author=SimpleNamespace(id=user_id), command=SimpleNamespace(qualified_name=name),
+                           selected_options=options)
+
+def test_recorded_commands_read_back_in_order(tmp_path):
+    path = str(tmp_path / "commands.jsonl")
+    recorder = command_trace.TraceRecorder(path)
+    for i in range(100):
+        recorder.record_message(_message(i, f"grr slots {i}", mentions=[i + 1]))
+    user_option = discord.SlashCommandOptionType.user.value
+    recorder.record_slash(_slash(7, "shop buy", [{'name': 'buy', 'options': [
+        {'name': 'name', 'type': 3, 'value': "Crown"}, {'name': 'for', 'type': user_option, 'value': "42"},
+    ]}]))
+    recorder.close()
+    recorder.close()
+
+    events = list(command_trace.read_trace(path))
+    assert [event['content'] for event in events[:100]] == [f"grr slots {i}" for i in range(100)]
+    assert events[0]['mentions'] == [1] and events[0]['type'] == 'message'
+    assert events[-1]['command'] == "shop buy" and events[-1]['options'] == {'name': "Crown", 'for': 42}
+    assert [event['at'] for event in events] == sorted(event['at'] for event in events)
+
+def test_recording_leaves_the_disk_to_the_writer_thread(tmp_path, monkeypatch):
+    recorder = command_trace.TraceRecorder(str(tmp_path / "commands.jsonl"))
+    writers = set()
+    dumps = command_trace.json.dumps
+
+    def tracking_dumps(*args, **kwargs):
+        writers.add(threading.current_thread().name)
+        return dumps(*args, **kwargs)
+
+    monkeypatch.setattr(command_trace.json, 'dumps', tracking_dumps)
+    recorder.record_message(_message(1, "grr bal"))
+    recorder.close()
+    assert writers == {"command-trace-writer"}
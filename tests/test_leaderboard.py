@@ -0,0 +1,60 @@
+"""The leaderboard's ranking against a plain sorted list."""
+import random
+
+import pytest
+
+import leaderboard
+from leaderboard import Leaderboard
+
+def _expected(balances, positive_only=False):
+    order = sorted((-balance, user_id) for user_id, balance in balances.items() if balance > 0 or not positive_only)
+    return [{'rank': i + 1, 'user_id': user_id, 'balance': -neg} for i, (neg, user_id) in enumerate(order)]
+
+def test_ranks_and_pages():
+    board = Leaderboard()
+    board.load([(1, 50), (2, 70), (3, 50), (4, 0)])
+    assert [entry['user_id'] for entry in board.page(0, 10)] == [2, 1, 3, 4]
+    assert (board.rank(2), board.rank(3), board.rank(99)) == (1, 3, None)
+    board.update(4, 100)
+    board.remove(2)
+    assert board.page(1, 2) == [{'rank': 2, 'user_id': 1, 'balance': 50}, {'rank': 3, 'user_id': 3, 'balance': 50}]
+    assert board.page(5, 10) == [] and len(board) == 3
+
+def test_positive_only_drops_empty_accounts():
+    board = Leaderboard(positive_only=True)
+    board.load([(1, 5), (2, 0)])
+    board.update(1, 0)
+    board.update(3, 2)
+    assert board.page(0, 10) == [{'rank': 1, 'user_id': 3, 'balance': 2}]
+    assert board.rank(1) is None
+
+@pytest.mark.parametrize('positive_only', [False, True])
+def test_random_updates_match_a_sorted_list(monkeypatch, positive_only):
+    # Tiny blocks so that splits, merges and emptied blocks all happen.
+    monkeypatch.setattr(leaderboard, 'BLOCK_SIZE', 4)
+    rng = random.Random(7)
+    balances = {user_id: rng.randint(0, 50) for user_id in range(200)}
+    board = Leaderboard(positive_only)
+    board.load(balances.items())
+    for step in range(3000):
+        user_id = rng.randrange(300)
+        if rng.random() < 0.2:
+            balances.pop(user_id, None)
+            board.remove(user_id)
+        else:
+            balances[user_id] = rng.randint(0, 50)
+            board.update(user_id, balances[user_id])
+        if step % 100 == 0:
+            expected = _expected(balances, positive_only)
+            assert board.page(0, len(expected) + 5) == expected
+            assert len(board) == len(expected)
+            for entry in expected:
+                assert board.rank(entry['user_id']) == entry['rank']
+            offset = rng.randrange(len(expected) + 1)
+            assert board.page(offset, 7) == expected[offset:offset + 7]
+    # Draining the board entirely leaves it usable.
+    for user_id in list(balances):
+        board.remove(user_id)
+    assert len(board) == 0 and board.page(0, 5) == []
+    board.update(1, 9)
+    assert board.page(0, 5) == [{'rank': 1, 'user_id': 1, 'balance': 9}]
@@ -0,0 +1,43 @@
+"""The watchdog against a loop that really is blocked."""
+import asyncio
+import time
+
+import loop_watchdog
+from loop_watchdog import LoopWatchdog
+
+def _block_the_loop(seconds: float):
+    time.sleep(seconds)
+
+async def test_blocked_loop_is_reported_with_its_stack():
+    published = []
+    watchdog = LoopWatchdog(published.append)
+    stalls_before = loop_watchdog.LOOP_STALLS.labels().value
+    watchdog.start()
+    try:
+        await asyncio.sleep(loop_watchdog.CHECK_INTERVAL * 3)
+        _block_the_loop(0.4)
+        # Let the watchdog wake and see how late it is.
+        await asyncio.sleep(loop_watchdog.CHECK_INTERVAL * 3)
+    finally:
+        await watchdog.stop()
+
+    reports = [message['payload'] for message in published if message['type'] == 'loop_stall']
+    assert len(reports) == 1
+    [stall] = reports
+    assert stall['lag_ms'] >= 300 and stall['samples'] > 0
+    assert any('_block_the_loop' in frame for frame in stall['stacks'][0]['frames'])
+    assert watchdog.worst_stalls()[0] is stall
+    assert loop_watchdog.LOOP_STALLS.labels().value == stalls_before + 1
+
+async def test_short_pauses_are_not_reported():
+    published = []
+    watchdog = LoopWatchdog(published.append)
+    watchdog.start()
+    try:
+        for _ in range(5):
+            _block_the_loop(0.01)
+            await asyncio.sleep(loop_watchdog.CHECK_INTERVAL)
+    finally:
+        await watchdog.stop()
+    assert not [message for message in published if message['type'] == 'loop_stall']
+    assert watchdog._task is None and watchdog._thread is None
@@ -0,0 +1,176 @@
+"""The background admin log pipeline and constellation digests."""
+import asyncio
+import json
+
+import discord
+from discord.ext import commands
+
+import database as db
+import main
+import notifications
+from bench import fakes
+from bench.harness import scratch_database
+
+def _fake_bot() -> fakes.FakeBot:
+    return fakes.FakeBot(fakes.FakeGuild(1, "Guild", []))
+
+def _embed(title: str) -> discord.Embed:
+    return discord.Embed(title=title)
+
+async def test_bot_close_sends_pending_digest_before_http_closes(monkeypatch):
+    notifier = notifications.ConstellationNotifier(_fake_bot(), [101, 102])
+    monkeypatch.setattr(main, 'constellation_notifier', notifier)
+    monkeypatch.setattr(main, 'admin_log_pipeline', None)
+    counts = fakes.CallCounts()
+    sent_before_close = []
+
+    async def close(self):
+        sent_before_close.append(counts.rest['channel.send'])
+
+    monkeypatch.setattr(commands.Bot, 'close', close)
+    with fakes.counting(counts):
+        notifier.submit(_embed("Purchase"))
+        await main.bot.close()
+    # One digest per Constellation, both sent before the HTTP session went away.
+    assert sent_before_close == [2]
+
+async def test_purchases_within_the_window_share_one_digest():
+    notifier = notifications.ConstellationNotifier(_fake_bot(), [101, 102])
+    notifier.DIGEST_WINDOW = 0.1
+    counts = fakes.CallCounts()
+    with fakes.counting(counts):
+        for i in range(3):
+            notifier.submit(_embed(f"Purchase {i}"))
+        await asyncio.sleep(0.05)
+        assert counts.rest['channel.send'] == 0
+        await asyncio.sleep(0.15)
+        # One message per Constellation, each holding all three purchases.
+        assert counts.rest['channel.send'] == 2
+        assert counts.rest['user.create_dm'] == 2
+
+        # A digest larger than one message is split; the DM channels are reused.
+        for i in range(notifications.MAX_EMBEDS_PER_MESSAGE + 2):
+            notifier.submit(_embed(f"Purchase {i}"))
+        await asyncio.sleep(0.2)
+        assert counts.rest['channel.send'] == 2 + 2 * 2
+        assert counts.rest['user.create_dm'] == 2
+        await notifier.stop()
+    assert counts.rest['channel.send'] == 6
+
+async def test_stop_waits_for_a_digest_being_sent(monkeypatch):
+    notifier = notifications.ConstellationNotifier(_fake_bot(), [101, 102])
+    notifier.DIGEST_WINDOW = 0.05
+    sending = asyncio.Event()
+    send = fakes.FakeChannel.send
+
+    async def slow_send(self, *args, embeds, **kwargs):
+        # The first digest is slow to send; later ones are quick.
+        first = embeds[0].title == "Purchase 0"
+        sending.set()
+        await asyncio.sleep(0.2 if first else 0.01)
+        return await send(self, *args, embeds=embeds, **kwargs)
+
+    monkeypatch.setattr(fakes.FakeChannel, 'send', slow_send)
+    counts = fakes.CallCounts()
+    with fakes.counting(counts):
+        notifier.submit(_embed("Purchase 0"))
+        await sending.wait()
+        # Arrives mid-send, so it belongs to the next digest.
+        notifier.submit(_embed("Purchase 1"))
+        await notifier.stop()
+        # Both digests went to both Constellations before stop() returned.
+        assert counts.rest['channel.send'] == 4
+        assert notifier._flush_task is None
+
+    # A digest still inside its window is sent at once.
+    with fakes.counting(counts):
+        notifier.DIGEST_WINDOW = 60
+        notifier.submit(_embed("Purchase 2"))
+        await asyncio.sleep(0)
+        await notifier.stop()
+        assert counts.rest['channel.send'] == 6
+
+# --- Admin log pipeline ---
+def _pipeline() -> notifications.AdminLogPipeline:
+    bot = _fake_bot()
+    pipeline = notifications.AdminLogPipeline(bot, bot.guild.channel.id)
+    pipeline.FLUSH_INTERVAL = 0.2
+    return pipeline
+
+async def _pending_titles():
+    return [json.loads(row['payload'])['title'] for row in await db.get_pending_logs()]
+
+async def test_pipeline_saves_at_once_and_sends_one_message():
+    async with scratch_database():
+        pipeline = _pipeline()
+        counts = fakes.CallCounts()
+        with fakes.counting(counts):
+            pipeline.start()
+            for i in range(3):
+                pipeline.submit(_embed(f"log {i}"))
+            # Saved well before the flush interval is up.
+            await asyncio.sleep(0.05)
+            assert await _pending_titles() == ["log 0", "log 1", "log 2"]
+            assert counts.rest['channel.send'] == 0
+            await asyncio.sleep(0.3)
+            assert counts.rest['channel.send'] == 1
+            assert await _pending_titles() == []
+            await pipeline.stop()
+
+async def test_pipeline_stop_keeps_unsent_logs_for_the_next_run():
+    async with scratch_database():
+        pipeline = _pipeline()
+        pipeline.start()
+        pipeline.submit(_embed("saved"))
+        await asyncio.sleep(0.05)
+        pipeline.submit(_embed("queued"))
+        await pipeline.stop()
+        assert await _pending_titles() == ["saved", "queued"]
+
+        counts = fakes.CallCounts()
+        with fakes.counting(counts):
+            pipeline = _pipeline()
+            pipeline.start()
+            await asyncio.sleep(0.1)
+            await pipeline.stop()
+        assert counts.rest['channel.send'] == 1
+        assert await _pending_titles() == []
+
+async def test_pipeline_sends_a_backlog_larger_than_one_page(monkeypatch):
+    async with scratch_database():
+        await db.add_pending_logs([json.dumps(_embed(f"old {i}").to_dict()) for i in range(7)])
+        get_pending_logs = db.get_pending_logs
+        monkeypatch.setattr(db, 'get_pending_logs', lambda limit=3: get_pending_logs(limit))
+        counts = fakes.CallCounts()
+        with fakes.counting(counts):
+            pipeline = _pipeline()
+            pipeline.start()
+            await asyncio.sleep(0.1)
+            # Pages of 3, 3 and 1, all delivered without a restart.
+            assert counts.rest['channel.send'] == 3
+            assert await get_pending_logs() == []
+            pipeline.submit(_embed("new"))
+            await asyncio.sleep(0.3)
+            assert counts.rest['channel.send'] == 4
+            await pipeline.stop()
+
+async def test_pipeline_stop_during_save_saves_each_log_once(monkeypatch):
+    async with scratch_database():
+        add_pending_logs = db.add_pending_logs
+        save_started = asyncio.Event()
+
+        async def slow_add_pending_logs(payloads):
+            save_started.set()
+            await asyncio.sleep(0.1)
+            return await add_pending_logs(payloads)
+
+        monkeypatch.setattr(db, 'add_pending_logs', slow_add_pending_logs)
+        pipeline = _pipeline()
+        pipeline.start()
+        pipeline.submit(_embed("first"))
+        pipeline.submit(_embed("second"))
+        await save_started.wait()
+        pipeline.submit(_embed("third"))
+        # The worker is cancelled while its save is in flight.
+        await pipeline.stop()
+        assert await _pending_titles() == ["first", "second", "third"]
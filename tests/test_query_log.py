@@ -0,0 +1,104 @@
+"""Statement tracing: query plans captured through TracedConnection, and the slow-statement list."""
+import aiosqlite
+import pytest
+
+import database as db
+import query_log
+from bench.harness import scratch_database
+from query_log import QueryLog, TracedConnection
+
+async def _open() -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(":memory:")
+    await conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, name TEXT)")
+    await conn.executemany("INSERT INTO users VALUES (?, ?)", [(i, f"user{i}") for i in range(20)])
+    return conn
+
+async def test_plans_are_captured_once_per_statement():
+    conn = await _open()
+    log = QueryLog()
+    traced = TracedConnection(conn, log)
+    try:
+        for user_id in (1, 2, 3):
+            assert await traced.execute_fetchall("SELECT name FROM users WHERE user_id = ?", (user_id,)) == [(f"user{user_id}",)]
+        async with traced.execute("SELECT user_id FROM  users\n WHERE name = ?", ("user4",)) as cursor:
+            assert await cursor.fetchone() == (4,)
+        await traced.executemany("UPDATE users SET name = ? WHERE user_id = ?", [("a", 1), ("b", 2)])
+    finally:
+        await conn.close()
+
+    stats = {stats.sql: stats for stats in log.by_total_time()}
+    by_id = stats["SELECT name FROM users WHERE user_id = ?"]
+    assert by_id.count == 3 and len(by_id.plan) == 1
+    assert by_id.plan[0].startswith("SEARCH users") and by_id.full_scans == []
+    # Whitespace differences don't make a new statement; a lookup by an unindexed column is a full scan.
+    by_name = stats["SELECT user_id FROM users WHERE name = ?"]
+    assert by_name.full_scans == ["SCAN users"]
+    update = stats["UPDATE users SET name = ? WHERE user_id = ?"]
+    assert update.count == 1 and update.plan_error is None
+
+    shapes = {entry['sql']: entry['shape'] for entry in log.slowest()}
+    assert shapes["SELECT user_id FROM users WHERE name = ?"] == "(str(5))"
+    assert shapes["UPDATE users SET name = ? WHERE user_id = ?"] == "2 x (str(1), int)"
+
+async def test_statements_without_a_plan_are_still_counted():
+    conn = await _open()
+    log = QueryLog()
+    try:
+        await TracedConnection(conn, log).execute("PRAGMA user_version = 3")
+    finally:
+        await conn.close()
+    [stats] = log.by_total_time()
+    assert stats.count == 1 and stats.plan == [] and stats.full_scans == []
+
+async def _sample(log: QueryLog, conn: aiosqlite.Connection, n: int):
+    return await log.begin(conn, f"SELECT {n}", None, "()")
+
+async def test_slow_list_keeps_only_the_slowest(monkeypatch):
+    monkeypatch.setattr(query_log, 'MAX_SLOW_QUERIES', 3)
+    conn = await _open()
+    log = QueryLog()
+    try:
+        samples = {}
+        for n, seconds in enumerate([0.5, 0.1, 0.3, 0.2, 0.4, 0.05]):
+            samples[n] = await _sample(log, conn, n)
+            log.add(samples[n], seconds)
+        assert [entry['sql'] for entry in log.slowest()] == ["SELECT 0", "SELECT 4", "SELECT 2"]
+
+        # A ranked sample that grows (its fetches took time too) moves up without a second entry.
+        log.add(samples[2], 0.5)
+        assert [entry['sql'] for entry in log.slowest()] == ["SELECT 2", "SELECT 0", "SELECT 4"]
+        # An unranked one that grows past the floor displaces the fastest.
+        log.add(samples[3], 0.3)
+        assert [(entry['sql'], round(entry['ms'])) for entry in log.slowest()] == [
+            ("SELECT 2", 800), ("SELECT 0", 500), ("SELECT 3", 500)]
+    finally:
+        await conn.close()
+
+async def test_slow_list_forgets_entries_outside_the_window(monkeypatch):
+    monkeypatch.setattr(query_log, 'MAX_SLOW_QUERIES', 2)
+    now = [1_000_000.0]
+    monkeypatch.setattr(query_log.time, 'time', lambda: now[0])
+    conn = await _open()
+    log = QueryLog()
+    try:
+        for n in (1, 2):
+            log.add(await _sample(log, conn, n), 1.0)
+        now[0] += query_log.ROLLING_WINDOW + 1
+        assert log.slowest() == []
+        # A fast statement now beats the expired slow ones.
+        log.add(await _sample(log, conn, 3), 0.01)
+        assert [entry['sql'] for entry in log.slowest()] == ["SELECT 3"]
+    finally:
+        await conn.close()
+
+async def test_database_calls_are_traced_when_enabled():
+    async with scratch_database('sqlite'):
+        db.set_query_tracing(True)
+        try:
+            await db.add_coins(1, 10)
+            assert await db.get_balance(1) == 10
+            log = db.get_query_log()
+            assert log.statements and all(stats.count for stats in log.statements.values())
+        finally:
+            db.set_query_tracing(False)
+        assert db.get_query_log() is None
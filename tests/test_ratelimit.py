@@ -0,0 +1,93 @@
+"""Per-user token buckets, and how on_message throttles and sheds `grr` commands."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+import ratelimit
+
+def test_burst_then_refill():
+    limiter = ratelimit.RateLimiter(rate=2.0, burst=3)
+    assert [limiter.check(1, now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # The fourth has to wait for half a token at two per second.
+    assert limiter.check(1, now=0.0) == pytest.approx(0.5)
+    assert limiter.check(1, now=0.25) == pytest.approx(0.25)
+    assert limiter.check(1, now=0.5) == 0.0
+    # A long pause refills to the burst, no further.
+    assert [limiter.check(1, now=100.0) == 0.0 for _ in range(4)] == [True, True, True, False]
+
+def test_users_have_their_own_buckets():
+    limiter = ratelimit.RateLimiter(rate=1.0, burst=1)
+    assert limiter.check(1, now=0.0) == 0.0
+    assert limiter.check(1, now=0.0) > 0
+    assert limiter.check(2, now=0.0) == 0.0
+
+def test_only_recent_users_are_tracked():
+    limiter = ratelimit.RateLimiter(rate=1.0, burst=1, max_keys=2)
+    limiter.check(1, now=0.0)
+    limiter.check(2, now=0.0)
+    # Seeing user 1 again makes user 2 the one forgotten.
+    assert limiter.check(1, now=0.0) > 0
+    limiter.check(3, now=0.0)
+    assert limiter.check(2, now=0.0) == 0.0
+    assert limiter.check(1, now=0.0) == 0.0
+
+def test_warn_once_per_cooldown():
+    limiter = ratelimit.RateLimiter(rate=1.0, burst=1)
+    assert not limiter.warn_once(1)
+    limiter.check(1, now=0.0)
+    limiter.check(1, now=0.0)
+    assert limiter.warn_once(1)
+    assert not limiter.warn_once(1)
+    # Allowed again, so the next denial is reported again.
+    limiter.check(1, now=5.0)
+    limiter.check(1, now=5.0)
+    assert limiter.warn_once(1)
+
+# --- on_message ---
+def _message(user_id: int, content: str, replies: list) -> SimpleNamespace:
+    async def send(content=None, **kwargs):
+        replies.append(content)
+
+    return SimpleNamespace(author=SimpleNamespace(id=user_id, bot=False), content=content,
+                           channel=SimpleNamespace(send=send), mentions=[])
+
+def _outcomes(command: str):
+    return {outcome: main.COMMANDS.labels(command, outcome).value for outcome in ('ok', 'throttled', 'shed')}
+
+@pytest.fixture
+def handled(monkeypatch):
+    handled = []
+
+    async def cash(message, args):
+        handled.append(message.author.id)
+
+    monkeypatch.setitem(main.GRR_COMMANDS, 'cash', (cash, 'economy'))
+    monkeypatch.setattr(main, 'grr_rate_limiters', {name: ratelimit.RateLimiter(1.0, 2) for name in main.GRR_RATE_LIMITS})
+    monkeypatch.setattr(main, 'trace_recorder', None)
+    return handled
+
+async def test_spammer_is_throttled_and_told_once(handled):
+    before = _outcomes("grr cash")
+    replies = []
+    for _ in range(5):
+        await main.on_message(_message(1, "grr cash", replies))
+    await main.on_message(_message(2, "grr cash", replies))
+    assert handled == [1, 1, 2]
+    assert len(replies) == 1 and "Slow down" in replies[0]
+    after = _outcomes("grr cash")
+    assert {outcome: after[outcome] - before[outcome] for outcome in after} == {'ok': 3, 'throttled': 3, 'shed': 0}
+
+async def test_commands_are_shed_while_every_slot_is_busy(handled, monkeypatch):
+    slots = asyncio.Semaphore(1)
+    monkeypatch.setattr(main, 'grr_command_slots', slots)
+    before = _outcomes("grr cash")
+    replies = []
+    async with slots:
+        await main.on_message(_message(1, "grr cash", replies))
+    await main.on_message(_message(1, "grr cash", replies))
+    assert handled == [1]
+    assert len(replies) == 1 and "overwhelmed" in replies[0]
+    after = _outcomes("grr cash")
+    assert {outcome: after[outcome] - before[outcome] for outcome in after} == {'ok': 1, 'throttled': 0, 'shed': 1}
@@ -0,0 +1,118 @@
+"""Span nesting inside a trace, and the TraceLog's writer thread."""
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+import spans
+
+@pytest.fixture
+def log():
+    log = spans.TraceLog()
+    spans.enable(log)
+    yield log
+    spans.disable()
+
+async def test_spans_nest_across_gather(log):
+    async def lookup(name: str, delay: float):
+        with spans.span(name):
+            await asyncio.sleep(delay)
+            with spans.span(f"{name}.inner"):
+                await asyncio.sleep(0)
+
+    with spans.trace("/cmd", user=1):
+        with spans.span("fan out"):
+            await asyncio.gather(lookup("a", 0.02), lookup("b", 0.0))
+
+    [entry] = log.recent
+    by_name = {span['name']: span for span in entry['spans']}
+    names = [span['name'] for span in entry['spans']]
+    # The trace is its own first span.
+    assert names[0] == '/cmd' and by_name['/cmd']['parent'] is None
+    assert by_name['fan out']['parent'] == 0
+    # Each gathered task hangs off the span that was current when it started, not off its sibling.
+    assert by_name['a']['parent'] == by_name['b']['parent'] == names.index('fan out')
+    assert by_name['a.inner']['parent'] == names.index('a')
+    assert by_name['b.inner']['parent'] == names.index('b')
+    assert entry['spans'] and all(span['ms'] is not None for span in entry['spans'])
+    assert by_name['a']['ms'] >= 20
+
+async def test_spans_after_the_trace_ends_are_dropped(log):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def background():
+        with spans.span("early"):
+            started.set()
+            await release.wait()
+        with spans.span("late"):
+            pass
+
+    with spans.trace("/cmd"):
+        task = asyncio.create_task(background())
+        await started.wait()
+    release.set()
+    await task
+
+    [entry] = log.recent
+    assert [span['name'] for span in entry['spans']] == ['/cmd', 'early']
+    # Still running when the command finished.
+    assert entry['spans'][1]['ms'] is None
+
+def test_span_limit_counts_dropped(log, monkeypatch):
+    monkeypatch.setattr(spans, 'MAX_SPANS_PER_TRACE', 3)
+    with spans.trace("/cmd"):
+        for _ in range(5):
+            with spans.span("db"):
+                pass
+    [entry] = log.recent
+    assert len(entry['spans']) == 3 and entry['dropped'] == 3
+
+def test_no_spans_without_a_trace():
+    assert spans.get_log() is None
+    assert spans.trace("/cmd") is spans._NO_SPAN
+    assert spans.span("db") is spans._NO_SPAN
+
+# --- Trace file ---
+def _lines(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def test_close_writes_every_queued_trace(tmp_path):
+    path = str(tmp_path / "traces" / "spans.jsonl")
+    log = spans.TraceLog(path)
+    for i in range(200):
+        log.record({'name': f"/cmd{i}", 'ms': i})
+    log.close()
+    assert [entry['name'] for entry in _lines(path)] == [f"/cmd{i}" for i in range(200)]
+    # Closing twice is harmless.
+    log.close()
+
+def test_record_leaves_the_disk_to_the_writer_thread(tmp_path, monkeypatch):
+    log = spans.TraceLog(str(tmp_path / "spans.jsonl"))
+    writers = set()
+    write = log._write
+
+    def tracking_write(entry):
+        writers.add(threading.current_thread().name)
+        write(entry)
+
+    monkeypatch.setattr(log, '_write', tracking_write)
+    log.record({'name': "/cmd", 'ms': 1})
+    log.close()
+    assert writers == {"trace-log-writer"}
+    assert [entry['name'] for entry in log.recent] == ["/cmd"]
+
+def test_rotation(tmp_path):
+    path = str(tmp_path / "spans.jsonl")
+    line_bytes = len(json.dumps({'name': "/cmd0", 'ms': 0})) + 1
+    log = spans.TraceLog(path, max_bytes=line_bytes * 2, backups=2)
+    for i in range(7):
+        log.record({'name': f"/cmd{i}", 'ms': 0})
+    log.close()
+    assert [entry['name'] for entry in _lines(path)] == ["/cmd6"]
+    assert [entry['name'] for entry in _lines(path + ".1")] == ["/cmd4", "/cmd5"]
+    assert [entry['name'] for entry in _lines(path + ".2")] == ["/cmd2", "/cmd3"]
+    assert not os.path.exists(path + ".3")
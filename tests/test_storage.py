@@ -0,0 +1,529 @@
+"""Both storage engines against the same checks, plus the memory engine's durability."""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import database as db
+from bench.harness import scratch_database
+from memory_storage import MemoryStorage, JOURNAL_PREFIX, SNAPSHOT_FILE
+from storage import Storage
+
+ENGINES = {'sqlite': db.SQLiteStorage, 'memory': MemoryStorage}
+GUILD_ID = 42
+TODAY = "2026-10-17"
+YESTERDAY = "2026-10-16"
+
+@pytest.fixture(params=sorted(ENGINES))
+def backend(request) -> str:
+    return request.param
+
+def _engine(backend: str) -> Storage:
+    store = db._store()
+    assert type(store) is ENGINES[backend]
+    return store
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+    class Partial(Storage):
+        async def open(self):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+# --- Balances ---
+async def test_balances(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        assert await store.get_balance('ssc', 1) == 0
+        assert await store.credit('ssc', 1, 100) == 100
+        assert await store.credit('ssc', 1, -30) == 70
+        assert await store.credit('grr', 2, 5) == 5
+        assert sorted(await store.all_balances('ssc')) == [(1, 70)]
+
+        assert await store.transfer('ssc', 1, 2, 50)
+        assert not await store.transfer('ssc', 1, 2, 50)
+        assert await store.get_balance('ssc', 1) == 20
+        assert await store.get_balance('ssc', 2) == 50
+        # Paying yourself leaves the balance unchanged.
+        assert await store.transfer('ssc', 2, 2, 10)
+        assert await store.get_balance('ssc', 2) == 50
+
+        await store.set_balances([(3, 7, 9), (1, 0, 0)])
+        assert (await store.get_balance('ssc', 3), await store.get_balance('grr', 3)) == (7, 9)
+        assert await store.list_account_ids(0, 10) == [1, 2, 3]
+        accounts = await store.all_accounts()
+        assert accounts[0] == {'user_id': 2, 'ssc_balance': 50, 'grr_balance': 5}
+
+        assert await store.exchange(3, 9, 100)
+        assert not await store.exchange(3, 1, 100)
+        assert (await store.get_balance('ssc', 3), await store.get_balance('grr', 3)) == (107, 0)
+
+async def test_balance_hooks_follow_commits(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        await store.credit('ssc', 1, 10)
+        await store.transfer('ssc', 1, 2, 4)
+        assert db.ssc_leaderboard.page(0, 10) == [
+            {'rank': 1, 'user_id': 1, 'balance': 6}, {'rank': 2, 'user_id': 2, 'balance': 4},
+        ]
+        assert db.ssc_balances.items() == {1: 6, 2: 4}
+
+async def test_prune_keeps_todays_daily_claims(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        await store.set_balances([(1, 0, 0), (2, 5, 0)])
+        assert await store.claim_daily(3, 0, TODAY)
+        removed = await store.prune_empty(TODAY, batch_size=1)
+        # User 1 in both currencies, user 2's GRR account; user 3 claimed today.
+        assert removed == 3
+        assert await store.list_account_ids(0, 10) == [2, 3]
+
+async def _all_pages(store: Storage, sort: str, limit: int, user_ids=None):
+    rows, cursor, pages = [], None, 0
+    while True:
+        page, cursor = await store.search_accounts(sort, cursor, limit, user_ids)
+        rows.extend(page)
+        pages += 1
+        if cursor is None:
+            return rows, pages
+
+async def test_search_accounts_pages(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        # Users 1-6 hold SSC (two tied balances); 7-9 only hold GRR.
+        await store.set_balances([(1, 50, 1), (2, 70, 0), (3, 50, 9), (4, 10, 0), (5, 0, 0), (6, 90, 3)])
+        for user_id in (7, 8, 9):
+            await store.credit('grr', user_id, user_id)
+            await store.credit('ssc', user_id, 0)
+        await store.prune_empty(TODAY, batch_size=100)
+        # Pruning left user 5 with no account at all, and 7-9 without an SSC account.
+        expected = [(6, 90, 3), (2, 70, 0), (3, 50, 9), (1, 50, 1), (4, 10, 0), (9, 0, 9), (8, 0, 8), (7, 0, 7)]
+        for limit in (1, 2, 3, 8, 20):
+            rows, pages = await _all_pages(store, 'ssc', limit)
+            assert [(row['user_id'], row['ssc_balance'], row['grr_balance']) for row in rows] == expected
+            assert pages == len(expected) // limit + 1
+        rows, _ = await _all_pages(store, 'grr', 2)
+        assert [row['user_id'] for row in rows][:3] == [9, 3, 8]
+
+        rows, pages = await _all_pages(store, 'ssc', 2, user_ids=[1, 3, 3, 7, 5, 6])
+        assert [row['user_id'] for row in rows] == [6, 3, 1, 7] and pages == 3
+
+# --- Daily claims ---
+async def test_daily_claims(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        assert await store.claim_daily(1, 500, YESTERDAY)
+        assert await store.claim_daily(1, 500, TODAY)
+        assert not await store.claim_daily(1, 500, TODAY)
+        assert await store.get_balance('grr', 1) == 1000
+
+# --- Wagers ---
+async def test_wagers(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        assert await store.settle_wager(1, 10, 0) is None
+        await store.credit('grr', 1, 100)
+        assert await store.settle_wager(1, 40, 0) == 60
+        assert await store.settle_wager(1, 60, 150) == 150
+        assert await store.settle_wager(1, 151, 1000) is None
+        assert await store.get_balance('grr', 1) == 150
+
+# --- Shop ---
+async def test_shop_purchase_and_release(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        assert await store.add_shop_item(GUILD_ID, "Crown", 100, 7, None, True)
+        assert not await store.add_shop_item(GUILD_ID, "Crown", 5, 7, None, False)
+        assert await store.add_shop_item(GUILD_ID, "Potion", 10, 8, "https://img", False)
+
+        assert await store.purchase_item(GUILD_ID, "Nothing", 1) == ("not_found", None)
+        status, item = await store.purchase_item(GUILD_ID, "Crown", 1)
+        assert status == "insufficient_funds" and item['cost'] == 100
+
+        await store.credit('ssc', 1, 250)
+        await store.credit('ssc', 2, 250)
+        status, crown = await store.purchase_item(GUILD_ID, "Crown", 1)
+        assert status == "success" and crown['purchased_by_user_id'] == 1
+        assert (await store.purchase_item(GUILD_ID, "Crown", 2))[0] == "already_claimed"
+        assert await store.get_balance('ssc', 1) == 150
+
+        # Granting the role failed: the money comes back and the Crown is free again.
+        await store.release_purchase(crown, 1)
+        assert await store.get_balance('ssc', 1) == 250
+        status, _ = await store.purchase_item(GUILD_ID, "Crown", 2)
+        assert status == "success"
+
+        # Repeatable items are never reserved.
+        for _ in range(2):
+            assert (await store.purchase_item(GUILD_ID, "Potion", 1))[0] == "success"
+        assert await store.get_balance('ssc', 1) == 230
+
+async def test_shop_edits(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        await store.add_shop_item(GUILD_ID, "Crown", 100, 7, None, True)
+        await store.add_shop_item(GUILD_ID, "Potion", 10, 8, None, False)
+        items = {item['name']: item for item in await store.get_shop_items(GUILD_ID)}
+        await store.update_shop_item(items['Potion']['item_id'], {'cost': 12, 'name': "Elixir"})
+        with pytest.raises(Exception):
+            await store.update_shop_item(items['Potion']['item_id'], {'name': "Crown"})
+        assert sorted(item['name'] for item in await store.get_shop_items(GUILD_ID)) == ["Crown", "Elixir"]
+        assert await store.remove_shop_item(GUILD_ID, "Crown")
+        assert not await store.remove_shop_item(GUILD_ID, "Crown")
+        await store.delete_shop_item(items['Potion']['item_id'])
+        assert await store.get_shop_items(GUILD_ID) == []
+
+async def test_shop_catalog_prefix_search(backend):
+    async with scratch_database(backend):
+        for cost, name in enumerate(["Crown", "crystal", "Cape", "Elixir", "Crow's Feather"]):
+            await db.add_shop_item(GUILD_ID, name, 10 - cost, cost, None, False)
+        await db.add_shop_item(GUILD_ID + 1, "Crowbar", 1, 1, None, False)
+        # Case-insensitive, alphabetical, only this guild's items.
+        assert await db.search_shop_item_names(GUILD_ID, "CR") == ["Crow's Feather", "Crown", "crystal"]
+        assert await db.search_shop_item_names(GUILD_ID, "crow", limit=1) == ["Crow's Feather"]
+        assert await db.search_shop_item_names(GUILD_ID, "") == ["Cape", "Crow's Feather", "Crown", "crystal", "Elixir"]
+        assert await db.search_shop_item_names(GUILD_ID, "crystals") == []
+        assert await db.search_shop_item_names(GUILD_ID, "z") == []
+        assert [item['name'] for item in await db.get_all_shop_items(GUILD_ID)][:2] == ["Crow's Feather", "Elixir"]
+
+async def test_shop_catalog_follows_writes(backend):
+    async with scratch_database(backend):
+        await db.add_shop_item(GUILD_ID, "Crown", 100, 7, None, True)
+        assert (await db.get_shop_item(GUILD_ID, "Crown"))['cost'] == 100
+        catalog = db._shop_catalogs[GUILD_ID]
+        await db.get_all_shop_items(GUILD_ID)
+        assert db._shop_catalogs[GUILD_ID] is catalog
+
+        await db.add_shop_item(GUILD_ID, "Potion", 10, 8, None, False)
+        assert [item['name'] for item in await db.get_all_shop_items(GUILD_ID)] == ["Potion", "Crown"]
+        potion = await db.get_shop_item(GUILD_ID, "Potion")
+        await db.update_shop_item(potion['item_id'], {'name': "Elixir", 'cost': 500})
+        assert await db.search_shop_item_names(GUILD_ID, "") == ["Crown", "Elixir"]
+        assert [item['name'] for item in await db.get_all_shop_items(GUILD_ID)] == ["Crown", "Elixir"]
+        assert await db.get_shop_item(GUILD_ID, "Potion") is None
+
+        await db.add_coins(1, 100)
+        assert (await db.purchase_item(GUILD_ID, "Crown", 1))[0] == "success"
+        assert (await db.get_shop_item(GUILD_ID, "Crown"))['purchased_by_user_id'] == 1
+        assert await db.remove_shop_item(GUILD_ID, "Crown")
+        assert await db.search_shop_item_names(GUILD_ID, "c") == []
+        # Handing out copies keeps callers from editing the cached rows.
+        (await db.get_shop_item(GUILD_ID, "Elixir"))['cost'] = 1
+        assert (await db.get_shop_item(GUILD_ID, "Elixir"))['cost'] == 500
+
+async def test_shop_catalog_load_racing_a_write_is_not_cached(backend, monkeypatch):
+    async with scratch_database(backend):
+        await db.add_shop_item(GUILD_ID, "Crown", 100, 7, None, True)
+        store = db._store()
+        get_shop_items = store.get_shop_items
+        loaded = asyncio.Event()
+        written = asyncio.Event()
+
+        async def slow_get_shop_items(guild_id):
+            # The load reads the old rows, then a write lands before the catalog is built.
+            rows = await get_shop_items(guild_id)
+            loaded.set()
+            await written.wait()
+            return rows
+
+        monkeypatch.setattr(store, 'get_shop_items', slow_get_shop_items)
+        reader = asyncio.create_task(db.get_all_shop_items(GUILD_ID))
+        await loaded.wait()
+        await db.add_shop_item(GUILD_ID, "Potion", 10, 8, None, False)
+        written.set()
+        assert [item['name'] for item in await reader] == ["Crown"]
+        monkeypatch.setattr(store, 'get_shop_items', get_shop_items)
+
+        assert GUILD_ID not in db._shop_catalogs
+        assert await db.search_shop_item_names(GUILD_ID, "") == ["Crown", "Potion"]
+
+# --- Config ---
+async def test_config(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        await store.set_config({'cf_win_rate': '0.5', 'exchange_enabled': 'true'})
+        await store.set_config({'cf_win_rate': '0.4'})
+        config = await store.get_config()
+        assert config['cf_win_rate'] == '0.4' and config['exchange_enabled'] == 'true'
+        assert db.get_config_str('cf_win_rate', '') == '0.4'
+
+async def test_export_state(backend):
+    async with scratch_database(backend):
+        store = _engine(backend)
+        await store.set_balances([(1, 10, 20)])
+        await store.claim_daily(1, 5, TODAY)
+        await store.add_shop_item(GUILD_ID, "Crown", 100, 7, None, True)
+        await store.set_config({'k': 'v'})
+        state = await store.export_state()
+        assert sorted(state['balances']['ssc']) == [(1, 10)]
+        assert sorted(state['balances']['grr']) == [(1, 25)]
+        assert [tuple(row) for row in state['last_daily']] == [(1, TODAY)]
+        assert [item['name'] for item in state['items']] == ["Crown"]
+        assert state['config']['k'] == 'v'
+
+# --- Admin user search ---
+def _names(*rows):
+    return [{'user_id': user_id, 'name': name, 'discriminator': '0', 'display_name': display} for user_id, name, display in rows]
+
+async def _search_ids(query: str):
+    rows, cursor = await db.search_users(query, limit=100)
+    assert cursor is None
+    return sorted(row['user_id'] for row in rows)
+
+async def test_user_search_matches_trigrams(backend):
+    async with scratch_database(backend):
+        assert db._user_search_fts
+        await db.update_user_balances_bulk([{'user_id': user_id, 'ssc': 10, 'grr': 0} for user_id in (1, 2, 3, 44)])
+        await db.store_user_names(_names((1, "stargazer", "Star Gazer"), (2, "dokja", "Kim Dokja"), (3, "joonghyuk", "Yoo Joonghyuk"),
+                                         (44, "ab_cd", "Abby")))
+        # Any three or more characters inside the name or display name, ignoring case.
+        assert await _search_ids("GAZ") == [1]
+        assert await _search_ids("dokja") == [2]
+        assert await _search_ids("oong") == [3]
+        assert await _search_ids("zzz") == []
+        # Quotes and FTS syntax are searched for literally.
+        assert await _search_ids('"kim" OR') == []
+        # The index follows renames.
+        await db.store_user_names(_names((1, "moonwatcher", "Moon Watcher")))
+        assert await _search_ids("gaz") == []
+        assert await _search_ids("watch") == [1]
+        # An ID finds its account even without a cached name.
+        assert await _search_ids("44") == [44]
+
+async def test_user_search_short_queries_scan_names(backend):
+    async with scratch_database(backend):
+        await db.update_user_balances_bulk([{'user_id': user_id, 'ssc': 10, 'grr': 0} for user_id in (1, 2, 3)])
+        await db.store_user_names(_names((1, "ab_cd", "Abby"), (2, "abcd", "Cab"), (3, "dokja", "Kim Dokja")))
+        # Too short for a trigram: matched with LIKE, with its wildcards escaped.
+        assert await _search_ids("ab") == [1, 2]
+        assert await _search_ids("b_") == [1]
+        assert await _search_ids("%") == []
+        assert await _search_ids("k") == [3]
+        assert await _search_ids("3") == [3]
+
+async def test_user_search_cursor_crosses_into_accounts_without_a_balance(backend):
+    async with scratch_database(backend):
+        await db.update_user_balances_bulk([{'user_id': user_id, 'ssc': user_id * 10, 'grr': 1} for user_id in (1, 2, 3)])
+        for user_id in (4, 5, 6):
+            await db.add_grr_coins(user_id, user_id)
+        # Phase a lists SSC holders by balance, phase b the GRR-only accounts by ID.
+        rows, cursor, phases = [], None, []
+        while True:
+            page, cursor = await db.search_users(cursor=cursor, limit=2)
+            rows.extend(page)
+            if cursor is None:
+                break
+            phases.append(cursor[0])
+        assert [row['user_id'] for row in rows] == [3, 2, 1, 6, 5, 4]
+        assert [row['grr_balance'] for row in rows] == [1, 1, 1, 6, 5, 4]
+        # The second page holds the last SSC holder and the first GRR-only account.
+        assert phases == ['a', 'b', 'b']
+
+        await db.store_user_names(_names(*((user_id, f"user{user_id}", f"Incarnation {user_id}") for user_id in range(1, 7))))
+        page, cursor = await db.search_users("incarnation", sort='grr', limit=4)
+        assert [row['user_id'] for row in page] == [6, 5, 4, 3] and cursor[0] == 'q'
+        page, cursor = await db.search_users("incarnation", sort='grr', cursor=cursor, limit=4)
+        assert [row['user_id'] for row in page] == [2, 1] and cursor is None
+
+        with pytest.raises(ValueError):
+            await db.search_users(cursor="z:0:0")
+        with pytest.raises(ValueError):
+            await db.search_users(sort="gold")
+
+# --- Schema migrations ---
+# The tables as the bot created them before schema versions existed (user_version 0).
+BASELINE_SCHEMA = """
+    CREATE TABLE users (user_id INTEGER PRIMARY KEY, balance INTEGER NOT NULL DEFAULT 0);
+    CREATE TABLE shop_items (
+        item_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, name TEXT NOT NULL,
+        cost INTEGER NOT NULL, role_id INTEGER NOT NULL, image_url TEXT,
+        is_one_time_buy BOOLEAN NOT NULL DEFAULT 0, purchased_by_user_id INTEGER, UNIQUE(guild_id, name)
+    );
+    CREATE TABLE grr_users (user_id INTEGER PRIMARY KEY, balance INTEGER NOT NULL DEFAULT 0, last_daily TEXT);
+    CREATE TABLE config (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    INSERT INTO users VALUES (1, 500), (2, 20);
+    INSERT INTO grr_users VALUES (1, 7, '2020-01-01'), (3, 900, NULL);
+    INSERT INTO shop_items (guild_id, name, cost, role_id, is_one_time_buy) VALUES (42, 'Crown', 100, 7, 1);
+    INSERT INTO config VALUES ('cf_win_rate', '0.45');
+"""
+
+def _schema(path: str):
+    with sqlite3.connect(path) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        names = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+    conn.close()
+    return version, names
+
+async def test_baseline_database_upgrades(backend, tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "starstream.db")
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+    monkeypatch.setattr(db, 'DB_FILE', path)
+    monkeypatch.setattr(db, 'STORAGE_BACKEND', backend)
+    monkeypatch.setattr(db, 'MEMORY_STORAGE_DIR', str(tmp_path / "memory"))
+    monkeypatch.delenv('STORAGE_BACKEND', raising=False)
+    monkeypatch.delenv('MEMORY_STORAGE_DIR', raising=False)
+
+    await db.init_db()
+    try:
+        out = capsys.readouterr().out
+        assert [f"schema version {n}:" in out for n in range(1, 5)] == [True] * 4
+        # Everything the baseline held is still there, whichever engine now serves it.
+        assert (await db.get_balance(1), await db.get_balance(2), await db.get_grr_balance(3)) == (500, 20, 900)
+        assert await db.claim_daily_grr(1, 5) == "success"
+        assert (await db.get_shop_item(42, "Crown"))['cost'] == 100
+        assert db.get_config_str('cf_win_rate', '') == '0.45'
+        assert db._user_search_fts
+        await db.store_user_names(_names((3, "stargazer", "Star Gazer")))
+        rows, _ = await db.search_users("gazer")
+        assert [row['user_id'] for row in rows] == [3]
+    finally:
+        await db.close_db()
+
+    version, names = _schema(path)
+    assert version == len(db.MIGRATIONS) == 4
+    assert {'users', 'grr_users', 'shop_items', 'config', 'user_names', 'user_search', 'pending_logs'} <= names
+    assert {'idx_users_balance', 'idx_grr_users_balance', 'idx_shop_items_guild_cost', 'idx_shop_items_purchased_by'} <= names
+
+    # The next start has nothing to migrate.
+    await db.init_db()
+    try:
+        assert "migrated" not in capsys.readouterr().out
+        assert await db.get_balance(1) == 500
+    finally:
+        await db.close_db()
+    assert _schema(path) == (version, names)
+
+# --- Memory engine durability ---
+async def _crash(store: MemoryStorage):
+    """Stops the background task and drops the engine without a final snapshot."""
+    store._closing.set()
+    await store._task
+    await store._close_journal()
+
+def _journals(directory: str):
+    return sorted(name for name in os.listdir(directory) if name.startswith(JOURNAL_PREFIX))
+
+async def test_memory_journal_replay(tmp_path):
+    store = MemoryStorage(str(tmp_path))
+    await store.open()
+    await store.credit('ssc', 1, 100)
+    await store.claim_daily(1, 50, TODAY)
+    await store.add_shop_item(GUILD_ID, "Crown", 100, 7, None, True)
+    await store.set_config({'k': 'v'})
+    await _crash(store)
+
+    reopened = MemoryStorage(str(tmp_path))
+    await reopened.open()
+    assert not reopened.is_new
+    assert await reopened.get_balance('ssc', 1) == 100
+    assert await reopened.get_balance('grr', 1) == 50
+    assert not await reopened.claim_daily(1, 50, TODAY)
+    assert [item['name'] for item in await reopened.get_shop_items(GUILD_ID)] == ["Crown"]
+    assert (await reopened.get_config())['k'] == 'v'
+    await reopened.close()
+
+async def test_memory_snapshot_swap(tmp_path):
+    store = MemoryStorage(str(tmp_path))
+    await store.open()
+    await store.credit('ssc', 1, 100)
+    before = _journals(str(tmp_path))
+    await store.snapshot()
+    after = _journals(str(tmp_path))
+    # The snapshot covers the old journal, which is deleted; new changes go to a new one.
+    assert len(after) == 1 and after != before
+    with open(tmp_path / SNAPSHOT_FILE, encoding="utf-8") as f:
+        assert json.load(f)['balances']['ssc'] == [[1, 100]]
+    assert not os.path.exists(tmp_path / (SNAPSHOT_FILE + ".tmp"))
+
+    await store.credit('ssc', 1, 5)
+    await _crash(store)
+    reopened = MemoryStorage(str(tmp_path))
+    await reopened.open()
+    assert await reopened.get_balance('ssc', 1) == 105
+    await reopened.close()
+
+async def test_memory_recovers_from_torn_journal_line(tmp_path):
+    store = MemoryStorage(str(tmp_path))
+    await store.open()
+    await store.credit('ssc', 1, 100)
+    await store.credit('ssc', 2, 7)
+    journal_path = store._journal.name
+    await _crash(store)
+    # A crash mid-write leaves half a line at the end of the journal.
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write('[3,[["b","ssc",1,99')
+
+    reopened = MemoryStorage(str(tmp_path))
+    await reopened.open()
+    assert await reopened.get_balance('ssc', 1) == 100
+    assert await reopened.get_balance('ssc', 2) == 7
+    # Changes made after recovery survive the next restart too.
+    await reopened.credit('ssc', 1, 1)
+    await _crash(reopened)
+
+    again = MemoryStorage(str(tmp_path))
+    await again.open()
+    assert await again.get_balance('ssc', 1) == 101
+    await again.close()
+
+async def test_memory_journal_is_written_off_the_loop(tmp_path, monkeypatch):
+    store = MemoryStorage(str(tmp_path))
+    await store.open()
+    writers = set()
+    dumps = json.dumps
+
+    def tracking_dumps(value, *args, **kwargs):
+        if isinstance(value, list):
+            writers.add(threading.current_thread().name)
+        return dumps(value, *args, **kwargs)
+
+    monkeypatch.setattr(json, 'dumps', tracking_dumps)
+    # Concurrent changes are applied in order and written out together.
+    balances = await asyncio.gather(*(store.credit('ssc', 1, 1) for _ in range(200)))
+    assert sorted(balances) == list(range(1, 201))
+    assert writers == {"memory-storage-journal"}
+    await _crash(store)
+
+    reopened = MemoryStorage(str(tmp_path))
+    await reopened.open()
+    assert await reopened.get_balance('ssc', 1) == 200
+    await reopened.close()
+
+class _FullDisk:
+    """A journal file whose writes fail."""
+
+    def __init__(self, journal):
+        self._journal = journal
+
+    def write(self, text: str):
+        raise OSError("No space left on device")
+
+    def __getattr__(self, name: str):
+        return getattr(self._journal, name)
+
+async def test_memory_refuses_changes_after_a_failed_journal_write(tmp_path, capsys):
+    store = MemoryStorage(str(tmp_path))
+    await store.open()
+    await store.credit('ssc', 1, 5)
+    store._journal = _FullDisk(store._journal)
+    with pytest.raises(OSError):
+        await store.credit('ssc', 1, 10)
+    with pytest.raises(RuntimeError):
+        await store.credit('ssc', 2, 1)
+    assert "stopped accepting changes" in capsys.readouterr().out
+    await _crash(store)
+
+    # Only the change that was written survives.
+    reopened = MemoryStorage(str(tmp_path))
+    await reopened.open()
+    assert await reopened.get_balance('ssc', 1) == 5
+    await reopened.close()
@@ -0,0 +1,184 @@
+import asyncio
+import collections
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import discord
+
+# Local imports
+import database as db
+import metrics
+
+# Populated by main.py
+BOT_INSTANCE = None
+
+MEMORY_CACHE_SIZE = 5000
+MEMORY_TTL_SECONDS = 30 * 60
+NOT_FOUND_TTL_SECONDS = 5 * 60
+# Names persisted in SQLite are trusted for this long before being re-fetched.
+STORED_TTL_SECONDS = 7 * 24 * 60 * 60
+FETCH_CONCURRENCY = 4
+MAX_FETCH_ATTEMPTS = 3
+
+USER_LOOKUPS = metrics.Counter(
+    "starstream_user_lookups_total", "User name lookups, by the tier that answered them.", ["source"])
+USER_REST_FETCHES = metrics.Counter(
+    "starstream_user_rest_fetches_total", "fetch_user calls made when every cache missed, by result.", ["result"])
+
+class UserDisplay(NamedTuple):
+    user_id: int
+    name: str
+    discriminator: str
+    display_name: str
+    found: bool
+
+    @property
+    def tag(self) -> str:
+        return f"{self.name}#{self.discriminator}"
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.user_id}>"
+
+def _unknown(user_id: int) -> UserDisplay:
+    return UserDisplay(user_id, "Unknown User", "0", "Unknown User", False)
+
+def _from_user(user: discord.abc.User) -> UserDisplay:
+    return UserDisplay(user.id, user.name, str(user.discriminator), user.display_name, True)
+
+# --- In-memory LRU + TTL cache ---
+_cache: "collections.OrderedDict[int, Tuple[UserDisplay, float]]" = collections.OrderedDict()
+_inflight: Dict[int, "asyncio.Future[UserDisplay]"] = {}
+_fetch_semaphore: Optional[asyncio.Semaphore] = None
+# Set when Discord answers 429 so that every fetcher backs off together.
+_paused_until = 0.0
+
+def _cache_get(user_id: int) -> Optional[UserDisplay]:
+    entry = _cache.get(user_id)
+    if entry is None:
+        return None
+    display, expires_at = entry
+    if expires_at < time.monotonic():
+        del _cache[user_id]
+        return None
+    _cache.move_to_end(user_id)
+    return display
+
+def _cache_put(display: UserDisplay):
+    ttl = MEMORY_TTL_SECONDS if display.found else NOT_FOUND_TTL_SECONDS
+    _cache[display.user_id] = (display, time.monotonic() + ttl)
+    _cache.move_to_end(display.user_id)
+    while len(_cache) > MEMORY_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+# --- REST fallback ---
+async def _fetch_one(user_id: int) -> UserDisplay:
+    global _fetch_semaphore, _paused_until
+    if _fetch_semaphore is None:
+        _fetch_semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    async with _fetch_semaphore:
+        for _ in range(MAX_FETCH_ATTEMPTS):
+            delay = _paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                display = _from_user(await BOT_INSTANCE.fetch_user(user_id))
+                USER_REST_FETCHES.inc('found')
+                return display
+            except discord.NotFound:
+                USER_REST_FETCHES.inc('not_found')
+                return _unknown(user_id)
+            except discord.HTTPException as e:
+                USER_REST_FETCHES.inc('rate_limited' if e.status == 429 else 'error')
+                if e.status != 429:
+                    break
+                retry_after = float(getattr(e, 'retry_after', None) or 1.0)
+                _paused_until = max(_paused_until, time.monotonic() + retry_after)
+            except Exception as e:
+                USER_REST_FETCHES.inc('error')
+                print(f"ERROR: Could not fetch user {user_id}: {e}")
+                break
+    return _unknown(user_id)
+
+async def _resolve_misses(user_ids: List[int]) -> Dict[int, UserDisplay]:
+    resolved: Dict[int, UserDisplay] = {}
+    to_store: List[UserDisplay] = []
+
+    # 1. The gateway's member/user cache costs nothing.
+    remaining = []
+    for user_id in user_ids:
+        user = BOT_INSTANCE.get_user(user_id) if BOT_INSTANCE else None
+        if user is not None:
+            resolved[user_id] = _from_user(user)
+            to_store.append(resolved[user_id])
+        else:
+            remaining.append(user_id)
+    USER_LOOKUPS.inc('gateway', amount=len(user_ids) - len(remaining))
+
+    # 2. Names persisted by earlier runs, in one query.
+    if remaining:
+        stored = await db.get_user_names(remaining, max_age=STORED_TTL_SECONDS)
+        for user_id, row in stored.items():
+            resolved[user_id] = UserDisplay(user_id, row['name'], row['discriminator'], row['display_name'], True)
+        remaining = [user_id for user_id in remaining if user_id not in stored]
+        USER_LOOKUPS.inc('stored', amount=len(stored))
+
+    # 3. REST, with bounded concurrency.
+    if remaining and BOT_INSTANCE is not None:
+        USER_LOOKUPS.inc('rest', amount=len(remaining))
+        fetched = await asyncio.gather(*(_fetch_one(user_id) for user_id in remaining))
+        for display in fetched:
+            resolved[display.user_id] = display
+            if display.found:
+                to_store.append(display)
+
+    if to_store:
+        await db.store_user_names([
+            {'user_id': d.user_id, 'name': d.name, 'discriminator': d.discriminator, 'display_name': d.display_name}
+            for d in to_store
+        ])
+    return resolved
+
+# --- Public API ---
+async def resolve_many(user_ids: Iterable[int]) -> Dict[int, UserDisplay]:
+    """Resolves display info for many users, batching every cache miss into one lookup."""
+    results: Dict[int, UserDisplay] = {}
+    waiting: Dict[int, "asyncio.Future[UserDisplay]"] = {}
+    misses: List[int] = []
+    for user_id in dict.fromkeys(user_ids):
+        cached = _cache_get(user_id)
+        if cached is not None:
+            results[user_id] = cached
+        elif user_id in _inflight:
+            waiting[user_id] = _inflight[user_id]
+        else:
+            misses.append(user_id)
+    USER_LOOKUPS.inc('memory', amount=len(results))
+    USER_LOOKUPS.inc('shared', amount=len(waiting))
+
+    if misses:
+        loop = asyncio.get_running_loop()
+        futures = {user_id: loop.create_future() for user_id in misses}
+        _inflight.update(futures)
+        resolved: Dict[int, UserDisplay] = {}
+        try:
+            resolved = await _resolve_misses(misses)
+        except Exception as e:
+            print(f"ERROR: User name resolution failed: {e}")
+        finally:
+            for user_id, future in futures.items():
+                display = resolved.get(user_id) or _unknown(user_id)
+                if user_id in resolved:
+                    _cache_put(display)
+                if not future.done():
+                    future.set_result(display)
+                results[user_id] = display
+                _inflight.pop(user_id, None)
+
+    for user_id, future in waiting.items():
+        results[user_id] = await future
+    return results
+
+async def resolve(user_id: int) -> UserDisplay:
+    """Resolves display info for a single user."""
+    return (await resolve_many([user_id]))[user_id]